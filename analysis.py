@@ -0,0 +1,807 @@
+# analysis.py — สูตรวิเคราะห์ (pure functions, ไม่ผูกกับ Telegram)
+import re
+import hashlib
+import logging
+from itertools import combinations
+from typing import NamedTuple
+
+from rounds import RoundArchive
+
+# ──────────────────────────────────────────────────────────────────────
+# Formula 2
+def analyze_formula_2(results: list[dict], lock_size: int = 4) -> str | None:
+    if not results:
+        return None
+    usable = (len(results) // lock_size) * lock_size
+    if usable == 0:
+        return None
+
+    last_lock = results[usable - lock_size: usable]
+    try:
+        digits = formula_2_digits(last_lock)
+        block_lines = []
+        for r in last_lock:
+            prefix = f"{r.get('round', ''):>3}: " if r.get('round') else ""
+            block_lines.append(f"<code>{prefix}{r['top3']} - {r['bottom2']}</code>")
+        return _render_formula_2(block_lines, digits, lock_size)
+
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        logging.error("[ERROR] Formula 2 failed: %s", e)
+        return None
+
+def formula_2_archive(arch: RoundArchive, usable: int, lock_size: int) -> str | None:
+    """สูตร 2 ของล็อคที่จบที่รอบ usable — อ่านคอลัมน์หลักของคลังตรงๆ ไม่สร้าง dict / int() ทีละตัวอักษร
+
+    ไม่แสดงเลขรอบ: ได้ข้อความเดียวกับ analyze_numbers() ของ "top3 - bottom2" ชุดเดียวกันทุกไบต์"""
+    if lock_size < 2 or usable < lock_size:
+        return None        # ทางเดิมหา last_lock[-2] ไม่เจอ → None เหมือนกัน
+    block_lines = [f"<code>{arch.top3(i)} - {arch.bottom2(i)}</code>" for i in range(usable - lock_size, usable)]
+    digits = formula_2_from_digits(arch.digits(usable - 2), arch.digits(usable - 1))
+    return _render_formula_2(block_lines, digits, lock_size)
+
+def _render_formula_2(block_lines: list[str], digits: tuple[int, int, int], lock_size: int) -> str:
+    run_digits = "-".join(map(str, digits))
+    return (
+        "📊 <b>สูตร 2 (หาเลขวิ่ง)</b>\n"
+        + "─" * 20 + "\n"
+        + f"วิเคราะห์จากล็อค {lock_size} รอบล่าสุด:\n"
+        + "\n".join(block_lines)
+        + f"\n\n→ <b>ผลลัพธ์:</b> <code>{run_digits}</code> (แนะนำวิ่งบน 19 ประตู)"
+    )
+
+def formula_2_digits(last_lock: list[dict]) -> tuple[int, int, int]:
+    """เลขวิ่ง 3 ตัวของสูตร 2 จากสองรอบท้ายของล็อค (ข้อมูลผิดรูป → KeyError/IndexError/ValueError)"""
+    r3 = last_lock[-2]
+    r4 = last_lock[-1]
+    t3_r3, b2_r3 = r3['top3'], r3['bottom2']
+    t3_r4, b2_r4 = r4['top3'], r4['bottom2']
+
+    digit1 = (int(t3_r3[0]) + int(t3_r4[0])) % 10
+    digit2 = (int(t3_r4[2]) + int(b2_r4[0])) % 10
+    digit3 = (int(b2_r3[1]) + int(b2_r4[1])) % 10
+    return digit1, digit2, digit3
+
+def formula_2_from_digits(r3: tuple, r4: tuple) -> tuple[int, int, int]:
+    """เหมือน formula_2_digits แต่รับหลัก (h, t, u, bt, bu) เป็น int แล้ว (RoundArchive.digits)"""
+    return (r3[0] + r4[0]) % 10, (r4[2] + r4[3]) % 10, (r3[4] + r4[4]) % 10
+
+# ──────────────────────────────────────────────────────────────────────
+# Formula 1 — ตารางบิตมาสก์ (สร้างครั้งเดียวตอน import)
+# เลขโดด d แทนด้วยบิต 1 << d (10 บิต), ชุดเลข 3 ตัวทั้ง 120 ชุดแทนด้วย
+# บิตที่ i ของจำนวนเต็ม 120 บิต (เรียงตาม combinations("0123456789", 3))
+ALL_DIGITS = "0123456789"
+COMBOS = ["".join(c) for c in combinations(ALL_DIGITS, 3)]
+COMBO_SETS = [frozenset(c) for c in COMBOS]
+COMBO_LISTS = [list(c) for c in COMBOS]
+COMBO_MASKS = [sum(1 << int(d) for d in c) for c in COMBOS]
+_ALL_COMBO_BITS = (1 << len(COMBOS)) - 1
+
+# ชุดที่มีเลขโดด d อยู่
+_DIGIT_COMBO_BITS = [
+    sum(1 << i for i, m in enumerate(COMBO_MASKS) if m & (1 << d))
+    for d in range(10)
+]
+
+# ANY: ชุดที่มีเลขอย่างน้อย 1 ตัวอยู่ใน digit mask m
+_ANY_BITS = [0] * 1024
+for _m in range(1, 1024):
+    _low = _m & -_m
+    _ANY_BITS[_m] = _ANY_BITS[_m ^ _low] | _DIGIT_COMBO_BITS[_low.bit_length() - 1]
+
+# ALL3: ชุดที่เป็น subset ของ m  ⇔  ไม่แตะเลขนอก m เลย
+_ALL3_BITS = [_ALL_COMBO_BITS & ~_ANY_BITS[1023 ^ _m] for _m in range(1024)]
+
+# BOTH: ชุดที่มีเลขสองหลักท้ายครบทั้งคู่ (key = "12", "90", ...)
+_PAIR_MASK = {}
+_PAIR_BOTH_BITS = {}
+for _a in ALL_DIGITS:
+    for _b in ALL_DIGITS:
+        if _a != _b:
+            _PAIR_MASK[_a + _b] = (1 << int(_a)) | (1 << int(_b))
+            _PAIR_BOTH_BITS[_a + _b] = _DIGIT_COMBO_BITS[int(_a)] & _DIGIT_COMBO_BITS[int(_b)]
+del _m, _low, _a, _b
+
+_DIGIT_MASK = {d: 1 << int(d) for d in ALL_DIGITS}
+
+def _lock_bits(pairs: list[str]) -> tuple[int, int, int]:
+    """คืน (any, both, all3) ของล็อคหนึ่ง เป็นบิต 120 ชุดพร้อมกัน"""
+    lock_mask = 0
+    both = 0
+    for p in pairs:
+        m = _PAIR_MASK.get(p)
+        if m is None:
+            # เลขโดดที่ไม่ใช่ ASCII (เช่นเลขไทย) ไม่ตรงกับชุดใดเลย
+            lock_mask |= _DIGIT_MASK.get(p[0], 0) | _DIGIT_MASK.get(p[1], 0)
+            continue
+        lock_mask |= m
+        both |= _PAIR_BOTH_BITS[p]
+    return _ANY_BITS[lock_mask], both, _ALL3_BITS[lock_mask]
+
+def _add_bits(planes: list[int], bits: int):
+    """บวก 1 ให้ทุกชุดที่บิตตั้งอยู่ (ตัวนับแบบ bit-sliced: planes[k] = บิตที่ k ของตัวนับ)"""
+    carry = bits
+    for k in range(len(planes)):
+        if not carry:
+            return
+        planes[k], carry = planes[k] ^ carry, planes[k] & carry
+    if carry:
+        planes.append(carry)
+
+def _plane_counts(planes: list[int]) -> list[int]:
+    return [
+        sum(((p >> i) & 1) << k for k, p in enumerate(planes))
+        for i in range(len(COMBOS))
+    ]
+
+def _plane_equals(planes: list[int], value: int, universe: int = _ALL_COMBO_BITS) -> int:
+    """บิตของชุดที่ตัวนับ == value พอดี (เทียบทีละ plane ไม่ต้องแตกเป็นตัวเลข)"""
+    if value.bit_length() > len(planes):
+        return 0
+    bits = universe
+    for k, p in enumerate(planes):
+        bits &= p if (value >> k) & 1 else ~p
+    return bits
+
+def _plane_argmax(planes: list[int], candidates: int) -> int:
+    """บิตของชุดใน candidates ที่ตัวนับมีค่ามากที่สุด (ไล่จาก plane บนสุดลงมา)"""
+    for p in reversed(planes):
+        if candidates & p:
+            candidates &= p
+    return candidates
+
+def _first_best(primary: list[int], secondary: list[int], candidates: int) -> int:
+    """ชุดแรกตามลำดับ sorted(key=(primary, secondary), reverse=True) ของ _rank_formula_1
+    (เท่ากันหมด → index น้อยสุด เพราะ sort แบบ stable); คืน -1 ถ้าไม่มี candidates"""
+    best = _plane_argmax(secondary, _plane_argmax(primary, candidates))
+    return (best & -best).bit_length() - 1
+
+def _plane_count_at(planes: list[int], i: int) -> int:
+    return sum(((p >> i) & 1) << k for k, p in enumerate(planes))
+
+def _coverage_results(any_p: list[int], both_p: list[int], all3_p: list[int], total_locks: int,
+                      combos: list[str] = COMBOS, universe: int = _ALL_COMBO_BITS) -> list[dict]:
+    """แถวของ _render_formula_1 เฉพาะชุดที่ครอบคลุมทุกล็อค (ชุดอื่นไม่ถูกใช้ในรายงานเลย)
+    เรียงตาม index ชุดเหมือนตารางเต็ม 120 ชุด จึงได้ลำดับ/ผลเสมอกันเหมือนเดิม"""
+    cover = _plane_equals(any_p, total_locks, universe)
+    results = []
+    while cover:
+        low = cover & -cover
+        i = low.bit_length() - 1
+        cover ^= low
+        results.append({"combo_set": frozenset(combos[i]), "combo_list": list(combos[i]), "any": total_locks,
+                        "both": _plane_count_at(both_p, i), "all3": _plane_count_at(all3_p, i)})
+    return results
+
+def _pick_combos(any_p: list[int], both_p: list[int], all3_p: list[int],
+                 total_locks: int) -> tuple[str, str, str | None] | None:
+    cover = _plane_equals(any_p, total_locks)
+    if not cover:
+        return None
+    i_all3 = _first_best(all3_p, both_p, cover)
+    i_both = _first_best(both_p, all3_p, cover)
+    i_sup = _first_best(both_p, all3_p, cover & ~(1 << i_all3) & ~(1 << i_both))
+    return COMBOS[i_all3], COMBOS[i_both], COMBOS[i_sup] if i_sup >= 0 else None
+
+def _rank_formula_1(results: list[dict], total_locks: int):
+    """(sorted_combos, best_all3, best_both, supplement) หรือ None ถ้าไม่มีชุดที่ครอบคลุมทุกล็อค"""
+    full_coverage = [r for r in results if r["any"] == total_locks]
+    if not full_coverage:
+        return None
+
+    sorted_combos = sorted(full_coverage, key=lambda x: (x["both"], x["all3"]), reverse=True)
+    best_all3 = max(sorted_combos, key=lambda x: x['all3'])
+    best_both = max(sorted_combos, key=lambda x: x['both'])
+    supplement = next((c for c in sorted_combos if c['combo_set'] not in [best_all3['combo_set'], best_both['combo_set']]), None)
+    return sorted_combos, best_all3, best_both, supplement
+
+# ข้อความของรายงานสูตร 1 (DigitComboEngine ใช้ชุดอื่นเมื่อเลือกหลัก/ขนาดชุดไม่ตรงกับสูตร 1)
+_F1_LABELS = {
+    "none": "ไม่พบชุดเลข 3 ตัวที่ครอบคลุมทุกล็อค",
+    "title": "📊 <b>สูตร 1: วิเคราะห์ชุดเลข 3 ตัว</b>",
+    "focus": "โฟกัสที่ <b>หลักสิบ+หลักหน่วย</b> ของสามตัวบนเท่านั้น\n",
+    "both": "มีรอบที่เลขสองหลักท้ายเข้าคู่ในชุดเดียวกัน",
+    "all": "ALL3",
+    "all_desc": "ทั้งล็อคมีตัวเลขครบทั้ง 3 ตัวของชุดนั้น",
+    "picks": "ชุดแนะนำ (สำหรับรูด 19 ประตูบน):",
+}
+
+def _render_formula_1(results: list[dict], total_locks: int, total_rounds: int,
+                      last_lock_size: int, lock_size: int, labels: dict = _F1_LABELS) -> str:
+    ranked = _rank_formula_1(results, total_locks)
+    if ranked is None:
+        return f"{labels['none']} ({total_locks}/{total_locks})"
+    sorted_combos, best_all3, best_both, supplement = ranked
+
+    last_lock_info = ""
+    if total_locks > 0 and last_lock_size != lock_size:
+        last_lock_info = f" (ล็อค {total_locks} มี {last_lock_size} รอบ)"
+
+    report = []
+    report.append(labels["title"])
+    report.append(f"จากรอบ 1–{total_rounds} (ล็อค 1–{total_locks}{last_lock_info})")
+    report.append(labels["focus"])
+    report.append("วัด 3 เกณฑ์ต่อ “ล็อค”:\n"
+                  "<b>ANY</b> = มีเลขชุดปรากฏอย่างน้อย 1 ตัว\n"
+                  f"<b>BOTH</b> = {labels['both']}\n"
+                  f"<b>{labels['all']}</b> = {labels['all_desc']}\n")
+
+    report.append(f"\n<b>{labels['picks']}</b>")
+    report.append(f"<b>ชุดหลัก 1: {'-'.join(best_all3['combo_list'])}</b> — ครอบคลุมทุกล็อค และ {labels['all']} สูงสุด ({best_all3['all3']}/{total_locks})")
+    report.append(f"<b>ชุดหลัก 2: {'-'.join(best_both['combo_list'])}</b> — ครอบคลุมทุกล็อค และ BOTH สูงสุด ({best_both['both']}/{total_locks})")
+
+    if supplement:
+        report.append(f"<b>ชุดเสริม: {'-'.join(supplement['combo_list'])}</b> — BOTH {supplement['both']}/{total_locks} ดีมาก")
+
+    other_options = []
+    recommended_sets = {best_all3['combo_set'], best_both['combo_set']}
+    if supplement:
+        recommended_sets.add(supplement['combo_set'])
+    for r in sorted_combos:
+        if r['combo_set'] not in recommended_sets:
+            other_options.append("".join(r['combo_list']))
+        if len(other_options) >= 3:
+            break
+    if other_options:
+        report.append(f"\n<b>ทางเลือกที่ยังดี:</b> {', '.join(other_options)}")
+
+    return "\n".join(report)
+
+def _counts_to_planes(counts: list[int]) -> list[int]:
+    planes = []
+    for k in range(max(counts, default=0).bit_length()):
+        planes.append(sum(1 << i for i, c in enumerate(counts) if (c >> k) & 1))
+    return planes
+
+# ──────────────────────────────────────────────────────────────────────
+# Formula 1
+class ComboAccumulator:
+    """ตัวนับ ANY/BOTH/ALL3 ของสูตร 1 แบบเติมทีละรอบ
+
+    ล็อคที่ครบแล้วถูกนับเก็บไว้ใน bit planes; รอบที่ยังไม่ครบล็อคค้างอยู่ใน
+    pending และถูกนับเป็นล็อคสุดท้ายตอน report() เท่านั้น
+    ผลของ report() เหมือน analyze_3_digit_combos(รอบทั้งหมดที่ feed, lock_size) ทุกไบต์
+    """
+
+    def __init__(self, lock_size: int = 4):
+        self.lock_size = lock_size
+        self.rounds = 0          # จำนวนเลข 3 ตัวที่ feed เข้ามาทั้งหมด
+        self.pairs = 0           # จำนวนที่ใช้ได้ (ไม่ใช่เลขเบิ้ล)
+        self.locks = 0           # ล็อคที่ครบแล้ว
+        self.pending: list[str] = []
+        self._any: list[int] = []
+        self._both: list[int] = []
+        self._all3: list[int] = []
+
+    def feed(self, num: str):
+        self.rounds += 1
+        if not (len(num) == 3 and num.isdigit() and num[1] != num[2]):
+            return
+        self._push(num[1:])
+
+    def feed_tu(self, tens, units):
+        """feed_many จากหลักสิบ/หน่วยที่เป็น int แล้ว (คอลัมน์ t/u ของ RoundArchive)"""
+        for t, u in zip(tens, units):
+            self.rounds += 1
+            if t != u:
+                self._push(_TU_STR[t * 10 + u])
+
+    def _push(self, pair: str):
+        self.pairs += 1
+        self.pending.append(pair)
+        if len(self.pending) == self.lock_size:
+            self._close_lock(self._any, self._both, self._all3, self.pending)
+            self.locks += 1
+            self.pending = []
+
+    def feed_many(self, nums):
+        for num in nums:
+            self.feed(num)
+
+    @staticmethod
+    def _close_lock(any_planes, both_planes, all3_planes, pairs):
+        any_bits, both_bits, all3_bits = _lock_bits(pairs)
+        _add_bits(any_planes, any_bits)
+        _add_bits(both_planes, both_bits)
+        _add_bits(all3_planes, all3_bits)
+
+    def _planes(self) -> tuple[list[int], list[int], list[int], int]:
+        any_p, both_p, all3_p = list(self._any), list(self._both), list(self._all3)
+        total_locks = self.locks
+        if self.pending:
+            self._close_lock(any_p, both_p, all3_p, self.pending)
+            total_locks += 1
+        return any_p, both_p, all3_p, total_locks
+
+    def counts(self) -> tuple[list[int], list[int], list[int], int]:
+        """(any, both, all3, total_locks) รวมล็อคที่ยังไม่ครบด้วย"""
+        any_p, both_p, all3_p, total_locks = self._planes()
+        return _plane_counts(any_p), _plane_counts(both_p), _plane_counts(all3_p), total_locks
+
+    def recommend(self) -> tuple[str, str, str | None] | None:
+        """(ชุดหลัก 1, ชุดหลัก 2, ชุดเสริม) เหมือนที่ report() แนะนำ แต่ไม่ render ข้อความ
+        เลือกด้วยการเทียบ bit plane ตรงๆ ไม่แตกตัวนับ จึงถูกพอจะเรียกทุกล็อค (ใช้ใน backtest)"""
+        if not self.pairs:
+            return None
+        return _pick_combos(*self._planes())
+
+    def report(self) -> str | None:
+        if not self.rounds:
+            return None
+        if not self.pairs:
+            return f"พบ {self.rounds} ชุด แต่เป็นเลขเบิ้ลทั้งหมด จึงไม่มีข้อมูลสำหรับวิเคราะห์ (สูตร 1)"
+
+        any_p, both_p, all3_p, total_locks = self._planes()
+        results = _coverage_results(any_p, both_p, all3_p, total_locks)
+        last_lock_size = len(self.pending) or self.lock_size
+        return _render_formula_1(results, total_locks, self.pairs, last_lock_size, self.lock_size)
+
+    def to_dict(self) -> dict:
+        any_c, both_c, all3_c = _plane_counts(self._any), _plane_counts(self._both), _plane_counts(self._all3)
+        return {
+            "lock_size": self.lock_size, "rounds": self.rounds, "pairs": self.pairs,
+            "locks": self.locks, "pending": list(self.pending),
+            "any": any_c, "both": both_c, "all3": all3_c,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ComboAccumulator":
+        acc = cls(int(d["lock_size"]))
+        acc.rounds = int(d["rounds"])
+        acc.pairs = int(d["pairs"])
+        acc.locks = int(d["locks"])
+        acc.pending = [str(p) for p in d["pending"]]
+        acc._any = _counts_to_planes(d["any"])
+        acc._both = _counts_to_planes(d["both"])
+        acc._all3 = _counts_to_planes(d["all3"])
+        return acc
+
+def analyze_3_digit_combos(original_numbers_3d: list[str], lock_size=4):
+    acc = ComboAccumulator(lock_size)
+    acc.feed_many(original_numbers_3d)
+    return acc.report()
+
+def analyze_3_digit_combos_reference(original_numbers_3d: list[str], lock_size=4):
+    """ทางเดิม (วนทีละชุด/ทีละล็อคด้วย set) — เก็บไว้เทียบผลกับ analyze_3_digit_combos"""
+    if not original_numbers_3d:
+        return None
+
+    numbers_3d = [num for num in original_numbers_3d if len(num) == 3 and num.isdigit() and num[1] != num[2]]
+    if not numbers_3d:
+        return f"พบ {len(original_numbers_3d)} ชุด แต่เป็นเลขเบิ้ลทั้งหมด จึงไม่มีข้อมูลสำหรับวิเคราะห์ (สูตร 1)"
+
+    two_digit_pairs = [list(num[1:]) for num in numbers_3d]
+    locks = [two_digit_pairs[i:i + lock_size] for i in range(0, len(two_digit_pairs), lock_size)]
+    total_locks = len(locks)
+    if total_locks == 0:
+        return None
+
+    candidate_combos = [frozenset(c) for c in combinations(ALL_DIGITS, 3)]
+
+    results = []
+    for combo in candidate_combos:
+        any_hits = both_hits = all3_hits = 0
+        for lock in locks:
+            lock_digits = {d for pair in lock for d in pair}
+            if not combo.isdisjoint(lock_digits):
+                any_hits += 1
+            if combo.issubset(lock_digits):
+                all3_hits += 1
+            if any(set(pair).issubset(combo) for pair in lock):
+                both_hits += 1
+        results.append({
+            "combo_set": combo,
+            "combo_list": sorted(list(combo)),
+            "any": any_hits, "both": both_hits, "all3": all3_hits
+        })
+
+    last_lock_size = len(locks[-1]) if locks else 0
+    return _render_formula_1(results, total_locks, len(numbers_3d), last_lock_size, lock_size)
+
+# ──────────────────────────────────────────────────────────────────────
+# หลายขนาดล็อคพร้อมกัน
+LOCK_SIZE_RANGE = range(2, 13)
+
+def _round_bits(top3: str) -> tuple[int, int] | None:
+    """(digit mask, BOTH bits) ของหลักสิบ+หน่วย หรือ None ถ้าสูตร 1 ไม่ใช้รอบนี้ (เลขเบิ้ล/ไม่ใช่เลข 3 หลัก)"""
+    if not (len(top3) == 3 and top3.isdigit() and top3[1] != top3[2]):
+        return None
+    p = top3[1:]
+    m = _PAIR_MASK.get(p)
+    if m is None:
+        return _DIGIT_MASK.get(p[0], 0) | _DIGIT_MASK.get(p[1], 0), 0
+    return m, _PAIR_BOTH_BITS[p]
+
+# หลักสิบ*10 + หน่วย → ผลของ _round_bits (ใช้กับคอลัมน์ของ RoundArchive ไม่ต้องผ่านสตริง)
+_TU_STR = [f"{i:02d}" for i in range(100)]
+_TU_ROUND_BITS = [_round_bits("0" + p) for p in _TU_STR]
+
+class _SizeState:
+    __slots__ = ("fed", "pairs", "locks", "pending_mask", "pending_both", "pending_len", "any", "both", "all3")
+
+    def __init__(self):
+        self.fed = 0             # จำนวนรอบ (ของ results) ที่ป้อนแล้ว
+        self.pairs = 0
+        self.locks = 0
+        self.pending_mask = 0
+        self.pending_both = 0
+        self.pending_len = 0
+        self.any: list[int] = []
+        self.both: list[int] = []
+        self.all3: list[int] = []
+
+class MultiLockEngine:
+    """สูตร 1 + สูตร 2 ของทุกขนาดล็อคใน sizes จากข้อมูลชุดเดียว
+
+    ทุกรอบถูกแปลงเป็น (digit mask, BOTH bits) ครั้งเดียวตอน extend(); แต่ละขนาดล็อค
+    แค่ OR mask ของรอบในล็อคแล้วบวกเข้าตัวนับ bit-sliced ของตัวเอง (ไม่ parse/validate ซ้ำ)
+    report(size, upto) ได้ผลเหมือน analyze_parsed() ของรอบ 1..upto ที่ขนาดล็อคนั้นทุกไบต์
+    """
+
+    def __init__(self, sizes=LOCK_SIZE_RANGE):
+        self.sizes = tuple(sizes)
+        self.results: list[dict] = []
+        self._bits: list[tuple[int, int] | None] = []
+        self._states: dict[int, _SizeState] = {}
+
+    @classmethod
+    def from_parsed(cls, parsed: "ParsedNumbers", sizes=LOCK_SIZE_RANGE) -> "MultiLockEngine":
+        eng = cls(sizes)
+        if parsed.pairs:
+            eng.extend({"top3": t3, "bottom2": b2} for t3, b2 in parsed.pairs)
+        else:
+            # เลข 3 ตัวล้วน: มีแต่สูตร 1 (สูตร 2 ต้องใช้สองตัวล่าง)
+            eng.extend({"top3": t3} for t3 in parsed.singles)
+        return eng
+
+    def extend(self, results):
+        for r in results:
+            self.results.append(r)
+            self._bits.append(_round_bits(r["top3"]))
+
+    def sync(self, archive: RoundArchive):
+        """ใช้ RoundArchive เป็น results โดยตรง (ไม่คัดลอกเป็น dict) — แปลงเฉพาะรอบใหม่จากคอลัมน์หลัก
+        archive ตัวใหม่ (คลังถูกสร้างใหม่) → เริ่มนับใหม่"""
+        if self.results is not archive:
+            self.results, self._bits, self._states = archive, [], {}
+        n = len(self._bits)
+        self._bits.extend(_TU_ROUND_BITS[t * 10 + u] for t, u in zip(archive.t[n:], archive.u[n:]))
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def _state(self, size: int, upto: int) -> _SizeState:
+        st = self._states.get(size)
+        if st is None or st.fed > upto:
+            st = self._states[size] = _SizeState()
+        for rb in self._bits[st.fed:upto]:
+            if rb is None:
+                continue
+            st.pairs += 1
+            st.pending_mask |= rb[0]
+            st.pending_both |= rb[1]
+            st.pending_len += 1
+            if st.pending_len == size:
+                _add_bits(st.any, _ANY_BITS[st.pending_mask])
+                _add_bits(st.both, st.pending_both)
+                _add_bits(st.all3, _ALL3_BITS[st.pending_mask])
+                st.locks += 1
+                st.pending_mask = st.pending_both = st.pending_len = 0
+        st.fed = max(st.fed, upto)
+        return st
+
+    def _planes(self, st: _SizeState) -> tuple[list[int], list[int], list[int], int]:
+        any_p, both_p, all3_p = list(st.any), list(st.both), list(st.all3)
+        total_locks = st.locks
+        if st.pending_len:
+            _add_bits(any_p, _ANY_BITS[st.pending_mask])
+            _add_bits(both_p, st.pending_both)
+            _add_bits(all3_p, _ALL3_BITS[st.pending_mask])
+            total_locks += 1
+        return any_p, both_p, all3_p, total_locks
+
+    def _upto(self, upto: int | None) -> int:
+        return len(self.results) if upto is None else min(upto, len(self.results))
+
+    def formula_1(self, size: int, upto: int | None = None) -> str | None:
+        upto = self._upto(upto)
+        if not upto:
+            return None
+        st = self._state(size, upto)
+        if not st.pairs:
+            return f"พบ {upto} ชุด แต่เป็นเลขเบิ้ลทั้งหมด จึงไม่มีข้อมูลสำหรับวิเคราะห์ (สูตร 1)"
+        any_p, both_p, all3_p, total_locks = self._planes(st)
+        results = _coverage_results(any_p, both_p, all3_p, total_locks)
+        return _render_formula_1(results, total_locks, st.pairs, st.pending_len or size, size)
+
+    def formula_2(self, size: int, upto: int | None = None) -> str | None:
+        usable = (self._upto(upto) // size) * size
+        if not usable:
+            return None
+        if isinstance(self.results, RoundArchive):
+            return formula_2_archive(self.results, usable, size)
+        last_lock = self.results[usable - size:usable]
+        if "bottom2" not in last_lock[0]:
+            return None
+        return analyze_formula_2(last_lock, size)
+
+    def report(self, size: int, upto: int | None = None) -> str | None:
+        return join_reports([p for p in (self.formula_1(size, upto), self.formula_2(size, upto)) if p])
+
+    def summary(self, size: int, upto: int | None = None) -> dict:
+        """ตัวเลขย่อสำหรับ /compare: ล็อค, จำนวนชุดที่ครอบคลุม, ชุดแนะนำ, เลขวิ่ง"""
+        upto = self._upto(upto)
+        st = self._state(size, upto)
+        out = {"size": size, "rounds": upto, "locks": 0, "coverage": 0, "picks": None, "run": None}
+        if st.pairs:
+            any_p, both_p, all3_p, total_locks = self._planes(st)
+            out["locks"] = total_locks
+            out["coverage"] = _plane_equals(any_p, total_locks).bit_count()
+            out["picks"] = _pick_combos(any_p, both_p, all3_p, total_locks)
+        usable = (upto // size) * size
+        if usable and isinstance(self.results, RoundArchive):
+            out["run"] = formula_2_from_digits(self.results.digits(usable - 2), self.results.digits(usable - 1))
+        elif usable and "bottom2" in self.results[0]:
+            try:
+                out["run"] = formula_2_digits(self.results[usable - size:usable])
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
+        return out
+
+def render_compare(rows: list[dict], current: int | None = None) -> str:
+    """ตารางเทียบขนาดล็อค (ข้อความล้วน — ผู้เรียกห่อ <pre>)"""
+    lines = [f"{'ล็อค':>4} {'รอบ':>4} {'ล็อค#':>5} {'ครอบ':>4}  {'หลัก1':<5} {'หลัก2':<5} {'เสริม':<5} {'วิ่ง':<5}"]
+    for r in rows:
+        mark = "*" if r["size"] == current else " "
+        picks = r["picks"] or ("-", "-", None)
+        run = "".join(map(str, r["run"])) if r["run"] else "-"
+        lines.append(f"{r['size']:>3}{mark} {r['rounds']:>4} {r['locks']:>5} {r['coverage']:>4}  "
+                     f"{picks[0]:<5} {picks[1]:<5} {picks[2] or '-':<5} {run:<5}")
+    return "\n".join(lines)
+
+# ──────────────────────────────────────────────────────────────────────
+# หลายหลัก / หลายขนาดชุด — สูตร 1 แบบทั่วไป
+# เลือกหลักได้จาก h t u (สามตัวบน) และ bt bu (สองตัวล่าง), ขนาดชุด k = 2..5
+# (index ใน top3 + bottom2 ต่อกัน: h=0 t=1 u=2 bt=3 bu=4)
+# ชุดของทุก k อยู่ใน universe บิตเดียวกัน (45+120+210+252 = 627 บิต) ตารางต่อ digit mask
+# จึงให้ ANY/BOTH/ALL ของทุก k ในการ lookup ครั้งเดียว — เพิ่ม k ไม่เพิ่มรอบการวน
+POSITIONS = {"h": 0, "t": 1, "u": 2, "bt": 3, "bu": 4}
+POSITION_LABELS = {"h": "หลักร้อย", "t": "หลักสิบ", "u": "หลักหน่วย", "bt": "สิบล่าง", "bu": "หน่วยล่าง"}
+POSITION_ALIASES = {"top": ("h", "t", "u"), "b": ("bt", "bu"), "bottom": ("bt", "bu")}
+COMBO_SIZES = range(2, 6)
+
+class DigitMode(NamedTuple):
+    positions: tuple[str, ...]      # เรียงตามลำดับใน POSITIONS
+    k: int
+
+DEFAULT_DIGIT_MODE = DigitMode(("t", "u"), 3)      # = สูตร 1
+
+def parse_digit_mode(spec: str) -> DigitMode:
+    """"4 h t u" / "2 b" / "3" (หลักเริ่มต้น = t u) → DigitMode; รูปแบบผิดโยน ValueError"""
+    tokens = spec.replace(",", " ").lower().split()
+    if not tokens:
+        raise ValueError("ต้องระบุขนาดชุด")
+    k = int(tokens[0])
+    if k not in COMBO_SIZES:
+        raise ValueError(f"ขนาดชุดต้องอยู่ระหว่าง {COMBO_SIZES[0]}–{COMBO_SIZES[-1]}")
+    chosen = set()
+    for t in tokens[1:]:
+        if t in POSITION_ALIASES:
+            chosen.update(POSITION_ALIASES[t])
+        elif t in POSITIONS:
+            chosen.add(t)
+        else:
+            raise ValueError(f"ไม่รู้จักหลัก {t!r}")
+    positions = tuple(p for p in POSITIONS if p in chosen) or DEFAULT_DIGIT_MODE.positions
+    return DigitMode(positions, k)
+
+_K_COMBOS = {k: ["".join(c) for c in combinations(ALL_DIGITS, k)] for k in COMBO_SIZES}
+_K_OFFSET = {}
+_off = 0
+for _k in COMBO_SIZES:
+    _K_OFFSET[_k] = _off
+    _off += len(_K_COMBOS[_k])
+_K_UNIVERSE = (1 << _off) - 1
+_K_DIGIT_BITS = [
+    sum(1 << (_K_OFFSET[k] + i) for k in COMBO_SIZES for i, c in enumerate(_K_COMBOS[k]) if str(d) in c)
+    for d in range(10)
+]
+# ต่อ digit mask m: ANY = ชุดที่มีเลขใน m, SUPER = ชุดที่มีเลขของ m ครบ, SUB = ชุดที่อยู่ใน m ทั้งชุด
+_K_ANY = [0] * 1024
+_K_SUPER = [_K_UNIVERSE] * 1024
+for _m in range(1, 1024):
+    _low = _m & -_m
+    _K_ANY[_m] = _K_ANY[_m ^ _low] | _K_DIGIT_BITS[_low.bit_length() - 1]
+    _K_SUPER[_m] = _K_SUPER[_m ^ _low] & _K_DIGIT_BITS[_low.bit_length() - 1]
+_K_SUB = [_K_UNIVERSE & ~_K_ANY[1023 ^ _m] for _m in range(1024)]
+del _off, _k, _m, _low
+
+def _digit_labels(mode: DigitMode) -> dict:
+    if mode == DEFAULT_DIGIT_MODE:
+        return _F1_LABELS
+    focus = "+".join(POSITION_LABELS[p] for p in mode.positions)
+    return {
+        "none": f"ไม่พบชุดเลข {mode.k} ตัวที่ครอบคลุมทุกล็อค",
+        "title": f"📊 <b>สูตรหลายหลัก: ชุดเลข {mode.k} ตัว</b>",
+        "focus": f"โฟกัสที่ <b>{focus}</b>\n",
+        "both": "มีรอบที่เลขทุกหลักที่เลือกอยู่ในชุดเดียวกัน",
+        "all": f"ALL{mode.k}",
+        "all_desc": f"ทั้งล็อคมีตัวเลขครบทั้ง {mode.k} ตัวของชุดนั้น",
+        "picks": "ชุดแนะนำ:",
+    }
+
+class DigitComboEngine:
+    """ตัวนับ ANY/BOTH/ALL ของชุด k ตัว (ทุก k ใน COMBO_SIZES พร้อมกัน) บนหลักที่เลือก
+
+    กติกาเดียวกับ ComboAccumulator: รอบที่เลขในหลักที่เลือกซ้ำกันไม่ถูกนับ, ล็อคหนึ่ง = lock_size
+    รอบที่ใช้ได้, ล็อคสุดท้ายที่ไม่ครบถูกนับตอน report() — positions=("t","u") k=3 ได้ผลเหมือนสูตร 1 ทุกไบต์
+    """
+
+    def __init__(self, positions: tuple[str, ...], lock_size: int = 4):
+        self.positions = tuple(positions)
+        self.lock_size = lock_size
+        self._idx = tuple(POSITIONS[p] for p in self.positions)
+        self._needs_bottom = max(self._idx) >= 3
+        self.rounds = 0
+        self.pairs = 0           # รอบที่ใช้ได้
+        self.locks = 0
+        self.pending_len = 0
+        self.pending_mask = 0
+        self.pending_both = 0
+        self._any: list[int] = []
+        self._both: list[int] = []
+        self._all: list[int] = []
+
+    def feed(self, top3: str, bottom2: str | None = None):
+        self.rounds += 1
+        if not (len(top3) == 3 and top3.isdigit()):
+            return
+        if self._needs_bottom and not (bottom2 and len(bottom2) == 2 and bottom2.isdigit()):
+            return
+        digits = top3 + bottom2 if self._needs_bottom else top3
+        chars = {digits[i] for i in self._idx}
+        if len(chars) != len(self._idx):
+            return
+        self.pairs += 1
+        mask = 0
+        for c in chars:
+            mask |= _DIGIT_MASK.get(c, 0)
+        self.pending_mask |= mask
+        # เลขโดดที่ไม่ใช่ ASCII (เช่นเลขไทย) ไม่ทำให้รอบนั้นเข้าชุดใดได้ (เหมือน _lock_bits)
+        if mask.bit_count() == len(chars):
+            self.pending_both |= _K_SUPER[mask]
+        self.pending_len += 1
+        if self.pending_len == self.lock_size:
+            _add_bits(self._any, _K_ANY[self.pending_mask])
+            _add_bits(self._both, self.pending_both)
+            _add_bits(self._all, _K_SUB[self.pending_mask])
+            self.locks += 1
+            self.pending_len = self.pending_mask = self.pending_both = 0
+
+    def feed_results(self, results):
+        for r in results:
+            self.feed(r["top3"], r.get("bottom2"))
+
+    def _planes(self, k: int) -> tuple[list[int], list[int], list[int], int]:
+        any_p, both_p, all_p = list(self._any), list(self._both), list(self._all)
+        total_locks = self.locks
+        if self.pending_len:
+            _add_bits(any_p, _K_ANY[self.pending_mask])
+            _add_bits(both_p, self.pending_both)
+            _add_bits(all_p, _K_SUB[self.pending_mask])
+            total_locks += 1
+        off, width = _K_OFFSET[k], (1 << len(_K_COMBOS[k])) - 1
+        return ([(p >> off) & width for p in any_p], [(p >> off) & width for p in both_p],
+                [(p >> off) & width for p in all_p], total_locks)
+
+    def report(self, k: int) -> str | None:
+        mode = DigitMode(self.positions, k)
+        if not self.rounds:
+            return None
+        if not self.pairs:
+            if mode == DEFAULT_DIGIT_MODE:
+                return f"พบ {self.rounds} ชุด แต่เป็นเลขเบิ้ลทั้งหมด จึงไม่มีข้อมูลสำหรับวิเคราะห์ (สูตร 1)"
+            return f"พบ {self.rounds} ชุด แต่ไม่มีรอบที่ใช้ได้ (เลขในหลักที่เลือกซ้ำกัน/ไม่ครบ)"
+        any_p, both_p, all_p, total_locks = self._planes(k)
+        combos = _K_COMBOS[k]
+        results = _coverage_results(any_p, both_p, all_p, total_locks, combos, (1 << len(combos)) - 1)
+        return _render_formula_1(results, total_locks, self.pairs, self.pending_len or self.lock_size,
+                                 self.lock_size, _digit_labels(mode))
+
+def analyze_digit_modes(results: list[dict], modes: list[DigitMode], lock_size: int = 4) -> str | None:
+    """รายงานของหลาย mode จากการวนรอบครั้งเดียว (mode ที่ใช้หลักชุดเดียวกันใช้ engine ร่วมกัน)"""
+    engines = {m.positions: DigitComboEngine(m.positions, lock_size) for m in modes}
+    for r in results:
+        top3, bottom2 = r["top3"], r.get("bottom2")
+        for eng in engines.values():
+            eng.feed(top3, bottom2)
+    return join_reports([p for p in (engines[m.positions].report(m.k) for m in modes) if p])
+
+# ──────────────────────────────────────────────────────────────────────
+# Entry สำหรับข้อความ
+class ParsedNumbers(NamedTuple):
+    pairs: tuple[tuple[str, str], ...]   # (top3, bottom2) จากรูปแบบ "123 - 45"
+    singles: tuple[str, ...]             # เลข 3 ตัวล้วน (ใช้เมื่อไม่พบ pairs เลย)
+
+# ข้อความในกลุ่มส่วนใหญ่ไม่ใช่ผลหวย: ตัดทิ้งด้วย search ครั้งเดียว (ไม่มีเลขติดกัน 3 ตัว = ไม่มีอะไรให้ parse)
+# ข้อความที่ผ่านถูก parse รอบเดียวด้วย regex ที่รวม "123 - 45" กับ "123" ไว้ด้วยกัน
+# (ผลเหมือน findall ของสองรูปแบบเดิมแยกกัน: เจอคู่ใช้คู่, ไม่เจอเลยใช้เลข 3 ตัวล้วน)
+MAX_PARSE_ROUNDS = 5000
+_MAYBE_NUMBERS = re.compile(r"\d{3}")
+_NUMBER_TOKEN = re.compile(r"\b(\d{3})(?:\s*-\s*(\d{2})\b|\b)")
+
+def could_contain_results(text: str) -> bool:
+    return _MAYBE_NUMBERS.search(text) is not None
+
+def parse_numbers(text: str, max_rounds: int = MAX_PARSE_ROUNDS) -> ParsedNumbers | None:
+    """ใช้ไม่เกิน max_rounds รอบแรก (ข้อความยาวผิดปกติไม่ทำให้การวิเคราะห์บวม)"""
+    if not could_contain_results(text):
+        return None
+    # findall ของ regex เดียว: [(top3, bottom2 หรือ ""), ...] ตามลำดับในข้อความ
+    tokens = _NUMBER_TOKEN.findall(text)
+    pairs = [t for t in tokens if t[1]]
+    if pairs:
+        return ParsedNumbers(tuple(pairs[:max_rounds]), ())
+    if not tokens:
+        return None
+    return ParsedNumbers((), tuple(t[0] for t in tokens[:max_rounds]))
+
+def parsed_key(parsed: ParsedNumbers, lock_size: int) -> bytes:
+    """key ของผลวิเคราะห์: ผลขึ้นกับลำดับเลขที่ parse ได้ + lock_size เท่านั้น
+    (ข้อความต่างกันแต่เลขชุดเดียวกันได้ key เดียวกัน)"""
+    h = hashlib.blake2b(digest_size=16)
+    if parsed.pairs:
+        h.update(b"P%d|" % lock_size)
+        h.update("".join(t3 + b2 for t3, b2 in parsed.pairs).encode())
+    else:
+        h.update(b"S%d|" % lock_size)
+        h.update("".join(parsed.singles).encode())
+    return h.digest()
+
+def analyze_parsed(parsed: ParsedNumbers, lock_size: int = 4) -> str | None:
+    if parsed.pairs:
+        full_results_list = [{'top3': t3, 'bottom2': b2} for t3, b2 in parsed.pairs]
+        original_numbers_3d = [t3 for t3, _ in parsed.pairs]
+    else:
+        full_results_list = []
+        original_numbers_3d = list(parsed.singles)
+
+    parts = []
+    res1 = analyze_3_digit_combos(original_numbers_3d, lock_size)
+    if res1:
+        parts.append(res1)
+    res2 = analyze_formula_2(full_results_list, lock_size)
+    if res2:
+        parts.append(res2)
+
+    return join_reports(parts)
+
+def analyze_numbers(text: str, lock_size: int = 4) -> str | None:
+    parsed = parse_numbers(text)
+    if parsed is None:
+        return None
+    return analyze_parsed(parsed, lock_size)
+
+def compare_numbers(text: str, sizes=LOCK_SIZE_RANGE) -> list[dict] | None:
+    """summary ของทุกขนาดล็อคจากข้อความเดียว (parse ครั้งเดียว)"""
+    parsed = parse_numbers(text)
+    if parsed is None:
+        return None
+    eng = MultiLockEngine.from_parsed(parsed, sizes)
+    return [eng.summary(size) for size in eng.sizes]
+
+def analyze_digits_text(text: str, modes: list[DigitMode], lock_size: int = 4) -> str | None:
+    parsed = parse_numbers(text)
+    if parsed is None:
+        return None
+    if parsed.pairs:
+        rows = [{"top3": t3, "bottom2": b2} for t3, b2 in parsed.pairs]
+    else:
+        rows = [{"top3": t3} for t3 in parsed.singles]
+    return analyze_digit_modes(rows, modes, lock_size)
+
+REPORT_SEPARATOR = "\n\n" + "═" * 25 + "\n\n"
+
+def join_reports(parts: list[str]) -> str | None:
+    if not parts:
+        return None
+    return REPORT_SEPARATOR.join(parts)
@@ -0,0 +1,259 @@
+# backtest.py — ย้อนทดสอบสูตร 1 / สูตร 2 กับผลย้อนหลังหลายวัน
+#
+#   python backtest.py 90                      # 90 วันล่าสุด (ถึงเมื่อวาน) ทุกขนาดล็อค 2–10
+#   python backtest.py 30 --sizes 4,5 --end 2024-06-30
+#
+# ไม่ import Telegram/bot.py — ใช้จาก CLI ได้โดยไม่ต้องมี token
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from analysis import ComboAccumulator, formula_2_digits
+from dayparse import World264Day, World264StreamParser
+from fetcher import BASE_URL, DayFetcher, FETCH_STATS
+from rounds import RoundArchive, RoundStore
+
+try:
+    from zoneinfo import ZoneInfo
+    BKK = ZoneInfo("Asia/Bangkok")
+except Exception:
+    from datetime import timezone
+    BKK = timezone(timedelta(hours=7))
+
+BACKTEST_DIR = os.getenv("BACKTEST_DIR", os.path.join(os.environ.get("STATE_DIR", "/tmp"), "backtest"))
+BACKTEST_CONCURRENCY = int(os.getenv("BACKTEST_CONCURRENCY", "8"))
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+BACKTEST_MAX_DAYS = int(os.getenv("BACKTEST_MAX_DAYS", "365"))
+DEFAULT_SIZES = tuple(range(2, 11))
+
+# ชื่อสูตรที่ถูกวัด (ลำดับ = ลำดับคอลัมน์ในรายงาน)
+FORMULAS = ("F1-1", "F1-2", "F2")
+FORMULA_LABELS = {
+    "F1-1": "สูตร 1 ชุดหลัก 1",
+    "F1-2": "สูตร 1 ชุดหลัก 2",
+    "F2": "สูตร 2 เลขวิ่ง",
+}
+
+# ──────────────────────────────────────────────────────────────────────
+# Day cache บนดิสก์: คลังรอบ (rounds.py) 1 ไฟล์ต่อวัน เก็บเฉพาะ world264 — อ่านด้วย mmap ไม่ต้อง decode JSON
+# วันที่ผ่านไปแล้วไม่เปลี่ยนอีก จึงเก็บถาวร; วันนี้ไม่ลง cache
+# ไฟล์ {วัน}.json ของรุ่นก่อนยังอ่านได้ และถูกย้ายเข้าคลังตอนอ่านครั้งแรก
+def cache_path(d: date, cache_dir: str = BACKTEST_DIR) -> str:
+    return os.path.join(cache_dir, f"{d.isoformat()}.json")
+
+def load_cached_day(d: date, cache_dir: str = BACKTEST_DIR) -> World264Day | None:
+    store = RoundStore(cache_dir)
+    for key in store.keys(d):
+        arch = store.get(d, key)
+        if arch is not None:
+            return World264Day(key, arch)
+    try:
+        with open(cache_path(d, cache_dir), "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        day = World264Day(doc["key"], [
+            {"round": rnd, "top3": top3, "bottom2": bottom2} for rnd, top3, bottom2 in doc["rows"]
+        ])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning("[BACKTEST] bad cache file for %s: %s", d, e)
+        return None
+    day = save_cached_day(d, day, cache_dir)
+    try:
+        os.remove(cache_path(d, cache_dir))
+    except OSError:
+        pass
+    return day
+
+def save_cached_day(d: date, day: World264Day, cache_dir: str = BACKTEST_DIR) -> World264Day:
+    """เขียนลงคลัง แล้วคืน World264Day ที่ results เป็น RoundArchive"""
+    if not day.key:
+        return World264Day(day.key, RoundArchive.from_rows("", day.results))
+    return World264Day(day.key, RoundStore(cache_dir).sync(d, day.key, day.results))
+
+async def load_days(days: list[date], fetcher: DayFetcher, concurrency: int = BACKTEST_CONCURRENCY,
+                    cache_dir: str = BACKTEST_DIR) -> tuple[dict[date, World264Day], dict]:
+    """คืน ({วัน: World264Day}, สถิติ) — วันที่ไม่มีไฟล์/ดึงไม่ได้จะไม่อยู่ใน dict"""
+    stats = {"cached": 0, "fetched": 0, "missing": 0}
+    today = datetime.now(BKK).date()
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(d: date):
+        day = load_cached_day(d, cache_dir)
+        if day is not None:
+            stats["cached"] += 1
+            return d, day
+        async with sem:
+            fetched = await fetcher.fetch(d)
+        if fetched.status != 200 or fetched.data is None:
+            stats["missing"] += 1
+            return d, None
+        stats["fetched"] += 1
+        day = fetched.data
+        if d < today:
+            return d, save_cached_day(d, day, cache_dir)
+        return d, World264Day(day.key, RoundArchive.from_rows(day.key or "", day.results))
+
+    loaded = await asyncio.gather(*(_one(d) for d in days))
+    return {d: day for d, day in loaded if day is not None and day.results}, stats
+
+# ──────────────────────────────────────────────────────────────────────
+# Replay (รันใน worker process — ต้องเป็นฟังก์ชันระดับ module)
+def _round_hit(top3: str, digits: str) -> bool:
+    """รอบนี้เข้าไหมถ้าแทง 19 ประตูบนด้วยเลขใน digits (หลักสิบหรือหลักหน่วยของสามตัวบน)"""
+    return top3[1] in digits or top3[2] in digits
+
+def replay_day(rows: list[tuple[str, str]], sizes: tuple[int, ...]) -> dict:
+    """เล่นย้อนหนึ่งวันแบบเดียวกับ poller: ทุกครั้งที่ครบล็อค (usable = k × lock_size)
+    ดูคำแนะนำจากรอบ 1..usable แล้วตรวจกับล็อคถัดไป (usable+1 .. usable+lock_size)
+
+    rows = [(top3, bottom2), ...] เรียงตามรอบ
+    คืน {(formula, lock_size): [ล็อคที่มีคำแนะนำ, ล็อคที่เข้า, รอบที่ตรวจ, รอบที่เข้า]}
+    """
+    results = [{"top3": t3, "bottom2": b2} for t3, b2 in rows]
+    tops = [t3 for t3, _ in rows]
+    n = len(rows)
+    out = {}
+    for size in sizes:
+        tallies = {f: [0, 0, 0, 0] for f in FORMULAS}
+        acc = ComboAccumulator(size)
+        for usable in range(size, n - size + 1, size):
+            acc.feed_many(tops[usable - size:usable])
+            picks = {}
+            rec = acc.recommend()
+            if rec:
+                picks["F1-1"], picks["F1-2"] = rec[0], rec[1]
+            try:
+                picks["F2"] = "".join(map(str, formula_2_digits(results[usable - size:usable])))
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
+            following = tops[usable:usable + size]
+            for f, digits in picks.items():
+                hits = sum(1 for t3 in following if _round_hit(t3, digits))
+                t = tallies[f]
+                t[0] += 1
+                t[1] += hits > 0
+                t[2] += len(following)
+                t[3] += hits
+        for f, t in tallies.items():
+            out[(f, size)] = t
+    return out
+
+# ──────────────────────────────────────────────────────────────────────
+# Entry
+class BacktestReport(NamedTuple):
+    start: date
+    end: date
+    days_requested: int
+    days_loaded: int
+    rounds: int
+    sizes: tuple[int, ...]
+    tallies: dict            # {(formula, lock_size): [signals, lock_hits, rounds, round_hits]}
+    load_stats: dict
+    elapsed: float
+
+def date_range(days: int, end: date | None = None) -> list[date]:
+    end = end or datetime.now(BKK).date() - timedelta(days=1)
+    return [end - timedelta(days=i) for i in range(days - 1, -1, -1)]
+
+async def run_backtest(days: int, sizes: tuple[int, ...] = DEFAULT_SIZES, end: date | None = None,
+                       workers: int = BACKTEST_WORKERS, fetcher: DayFetcher | None = None,
+                       cache_dir: str = BACKTEST_DIR) -> BacktestReport:
+    started = time.perf_counter()
+    days = max(1, min(days, BACKTEST_MAX_DAYS))
+    dates = date_range(days, end)
+
+    own_fetcher = fetcher is None
+    if own_fetcher:
+        # แยกจาก fetcher ของ poller: ไม่เบียด ETag ของวันนี้ออกจาก cache, ไม่นับ 404 ของวันเก่าเป็น error
+        # ใน /status หรือ metrics และเก็บแค่แถว world264
+        fetcher = DayFetcher(BASE_URL, parser_factory=World264StreamParser,
+                             stats=dict.fromkeys(FETCH_STATS, 0), observe_metrics=False)
+    try:
+        loaded, load_stats = await load_days(dates, fetcher, cache_dir=cache_dir)
+    finally:
+        if own_fetcher:
+            await fetcher.aclose()
+
+    day_rows = [loaded[d].results.pairs() for d in dates if d in loaded]
+    tallies = {(f, s): [0, 0, 0, 0] for s in sizes for f in FORMULAS}
+    if day_rows:
+        loop = asyncio.get_running_loop()
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max(1, min(workers, len(day_rows))), mp_context=ctx) as pool:
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(pool, replay_day, rows, tuple(sizes)) for rows in day_rows
+            ))
+        for part in parts:
+            for k, t in part.items():
+                agg = tallies[k]
+                for i, v in enumerate(t):
+                    agg[i] += v
+
+    return BacktestReport(
+        start=dates[0], end=dates[-1], days_requested=days, days_loaded=len(day_rows),
+        rounds=sum(len(r) for r in day_rows), sizes=tuple(sizes), tallies=tallies,
+        load_stats=load_stats, elapsed=time.perf_counter() - started,
+    )
+
+def format_report(rep: BacktestReport) -> str:
+    """ตารางข้อความล้วน (bot ห่อด้วย <pre>)"""
+    lines = [
+        f"Backtest {rep.start.isoformat()} – {rep.end.isoformat()}",
+        f"มีข้อมูล {rep.days_loaded}/{rep.days_requested} วัน, {rep.rounds:,} รอบ "
+        f"(cache {rep.load_stats.get('cached', 0)}, ดึงใหม่ {rep.load_stats.get('fetched', 0)}, "
+        f"ไม่มีไฟล์ {rep.load_stats.get('missing', 0)}) ใช้เวลา {rep.elapsed:.1f}s",
+        "",
+        "เข้า = มีเลขแนะนำที่หลักสิบ/หน่วยของสามตัวบน (19 ประตูบน)",
+        "%รอบ = รอบในล็อคถัดไปที่เข้า, %ล็อค = ล็อคถัดไปเข้าอย่างน้อย 1 รอบ",
+        "",
+    ]
+    for f in FORMULAS:
+        lines.append(f"{FORMULA_LABELS[f]}")
+        lines.append(f"{'ล็อค':>4} {'สัญญาณ':>7} {'%รอบ':>6} {'%ล็อค':>6}")
+        for s in rep.sizes:
+            signals, lock_hits, rounds, round_hits = rep.tallies[(f, s)]
+            if not signals:
+                lines.append(f"{s:>4} {0:>7} {'-':>6} {'-':>6}")
+                continue
+            lines.append(f"{s:>4} {signals:>7} {round_hits / rounds:>6.1%} {lock_hits / signals:>6.1%}")
+        lines.append("")
+    # เลขสุ่ม 3 ตัว (ไม่ซ้ำกัน) เข้า 19 ประตูบนได้ราว 1 − 0.7² = 51% ต่อรอบ
+    lines.append("เทียบ: เลขสุ่ม 3 ตัว ≈ 51% ต่อรอบ")
+    return "\n".join(lines)
+
+def _parse_sizes(text: str) -> tuple[int, ...]:
+    sizes = set()
+    for part in text.split(","):
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            sizes.update(range(int(lo), int(hi) + 1))
+        elif part.strip():
+            sizes.add(int(part))
+    if not sizes or min(sizes) < 2:
+        raise argparse.ArgumentTypeError("lock sizes must be >= 2 (Formula 2 needs two rounds)")
+    return tuple(sorted(sizes))
+
+def main(argv: list[str] | None = None):
+    ap = argparse.ArgumentParser(description="Backtest Formula 1 / Formula 2 over past days")
+    ap.add_argument("days", type=int, nargs="?", default=30)
+    ap.add_argument("--sizes", type=_parse_sizes, default=DEFAULT_SIZES, help="เช่น 4 หรือ 2-10 หรือ 3,4,6")
+    ap.add_argument("--end", type=date.fromisoformat, default=None, help="วันสุดท้าย (ค่าเริ่มต้น: เมื่อวาน)")
+    ap.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    ap.add_argument("--cache-dir", default=BACKTEST_DIR)
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    rep = asyncio.run(run_backtest(args.days, args.sizes, args.end, args.workers, cache_dir=args.cache_dir))
+    print(format_report(rep))
+
+if __name__ == "__main__":
+    main()
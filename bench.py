@@ -0,0 +1,256 @@
+# bench.py — benchmark ของ hot path (วิเคราะห์ / แยกผลจากไฟล์รายวัน)
+#
+# ทางที่ production ใช้: *StreamParser (ไฟล์รายวัน, body เดียวกับ extract_all_results_sorted),
+# poll_lock (ตัวนับสะสมต่อล็อคของ poller), MultiLockEngine.compare (/compare, /setlocks)
+#
+#   python bench.py                  # รันทั้งหมด เทียบกับ baseline ถ้ามี (ถดถอยเกิน threshold → exit 1)
+#   python bench.py --save           # บันทึกผลรอบนี้เป็น baseline ใหม่
+#   python bench.py --quick -k analyze_numbers
+#
+# ข้อมูลทั้งหมดสร้างขึ้นเอง (seed คงที่) ไม่ต้องต่อเน็ต และไม่ import bot.py
+# baseline ผูกกับเครื่องที่รัน — ให้ save บนเครื่องเดียวกับที่จะเทียบ
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import tracemalloc
+from statistics import quantiles
+from typing import Callable, NamedTuple
+
+from analysis import (
+    analyze_numbers, analyze_3_digit_combos, analyze_formula_2, parse_numbers,
+    analyze_digit_modes, DigitMode, COMBO_SIZES,
+    ComboAccumulator, MultiLockEngine, LOCK_SIZE_RANGE, formula_2_archive,
+)
+from dayparse import pick_world264_key, extract_all_results_sorted, World264StreamParser, GamesStreamParser
+from rounds import RoundArchive
+
+BENCH_BASELINE = os.getenv("BENCH_BASELINE", ".bench_baseline.json")
+ROUND_COUNTS = (10, 100, 1000, 10000)
+QUICK_ROUND_COUNTS = (10, 1000)
+LOCK_SIZES = tuple(range(2, 11))
+QUICK_LOCK_SIZES = (2, 4, 10)
+
+# ──────────────────────────────────────────────────────────────────────
+# ข้อมูลสังเคราะห์
+def make_rounds(n: int, seed: int = 264) -> list[dict]:
+    rnd = random.Random(seed)
+    return [
+        {"round": i, "top3": f"{rnd.randrange(1000):03d}", "bottom2": f"{rnd.randrange(100):02d}"}
+        for i in range(1, n + 1)
+    ]
+
+def make_day(n: int, seed: int = 264, other_groups: int = 12) -> dict:
+    """ไฟล์รายวันแบบเดียวกับ S3: หลายกลุ่มหวย, กลุ่ม world264 หนึ่งกลุ่ม, ลำดับ key ไม่เรียง"""
+    rnd = random.Random(seed)
+
+    def _group(lotto_type: str, subtype: str, count: int) -> dict:
+        rounds = {}
+        order = list(range(1, count + 1))
+        rnd.shuffle(order)
+        for i in order:
+            rounds[f"{lotto_type}{subtype}{i:05d}"] = {
+                "round_number": str(i),
+                "lotto_type": lotto_type,
+                "lotto_subtype": subtype,
+                "status": "done",
+                "result": {"top_three": f"{rnd.randrange(1000):03d}", "bottom_two": f"{rnd.randrange(100):02d}"},
+                "created_at": "2024-01-01T00:00:00+07:00",
+            }
+        return rounds
+
+    day = {f"{t:02d}{s:02d}": _group(f"{t:02d}", f"{s:02d}", max(1, n // 4))
+           for t, s in ((2 + g // 4, g % 4 + 1) for g in range(other_groups))}
+    day["0122"] = _group("01", "22", n)
+    return day
+
+def make_archive_file(results: list[dict]) -> str:
+    """ไฟล์คลังรอบ (rounds.py) ใน temp dir สำหรับวัดเวลา load ตอนรีสตาร์ท"""
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-rounds-"), f"{len(results)}.rounds")
+    RoundArchive.from_rows("0122", results, path).flush()
+    return path
+
+def stream_parse(factory, body: bytes, chunk: int = 65536):
+    """แบบที่ DayFetcher ทำ: ป้อน body ทีละ chunk แล้ว close()"""
+    parser = factory()
+    for i in range(0, len(body), chunk):
+        parser.feed(body[i:i + chunk])
+    return parser.close()
+
+def poll_lock(saved: dict, arch: RoundArchive, ls: int):
+    """ต้นทุนต่อล็อคของ poller (bot.analyze_day_incremental): counters จาก state → เติมล็อคใหม่ → รายงาน → state"""
+    acc = ComboAccumulator.from_dict(saved)
+    usable = (len(arch) // ls) * ls
+    acc.feed_tu(arch.t[acc.rounds:usable], arch.u[acc.rounds:usable])
+    report = acc.report(), formula_2_archive(arch, usable, ls)
+    acc.to_dict()
+    return report
+
+def engine_compare(arch: RoundArchive):
+    """/compare และ /setlocks หลังรีสตาร์ท: engine ใหม่จากคลัง แล้วทุกขนาดล็อค"""
+    eng = MultiLockEngine(LOCK_SIZE_RANGE)
+    eng.sync(arch)
+    return [eng.summary(size) for size in LOCK_SIZE_RANGE]
+
+# ข้อความคุยทั่วไปในกลุ่ม (มีตัวเลขบ้างแต่ไม่ใช่ผลหวย)
+CHATTER = "สวัสดีครับ วันนี้ไปกินข้าวร้านเดิมนะ เจอกัน 7 โมง โอนแล้ว 50 บาท ok?"
+
+def make_text(n: int, seed: int = 264) -> str:
+    """ข้อความแบบที่ผู้ใช้วาง: "  12: 427 - 25" ทีละบรรทัด"""
+    return "\n".join(f"{r['round']:>3}: {r['top3']} - {r['bottom2']}" for r in make_rounds(n, seed))
+
+# ──────────────────────────────────────────────────────────────────────
+# Cases
+class Case(NamedTuple):
+    name: str
+    rounds: int
+    fn: Callable[[], object]
+
+def build_cases(round_counts=ROUND_COUNTS, lock_sizes=LOCK_SIZES) -> list[Case]:
+    cases = [Case("parse_numbers/chatter", 1, lambda: parse_numbers(CHATTER))]
+    for n in round_counts:
+        text = make_text(n)
+        results = make_rounds(n)
+        nums = [r["top3"] for r in results]
+        day = make_day(n)
+        key = pick_world264_key(day)
+        body = json.dumps(day).encode()
+        arch = RoundArchive.from_rows("0122", results)
+        for ls in lock_sizes:
+            cases.append(Case(f"analyze_numbers/n={n}/lock={ls}", n,
+                              lambda text=text, ls=ls: analyze_numbers(text, ls)))
+            cases.append(Case(f"analyze_3_digit_combos/n={n}/lock={ls}", n,
+                              lambda nums=nums, ls=ls: analyze_3_digit_combos(nums, ls)))
+            cases.append(Case(f"analyze_formula_2/n={n}/lock={ls}", n,
+                              lambda results=results, ls=ls: analyze_formula_2(results, ls)))
+            usable = (n // ls) * ls
+            if usable > ls:
+                # ทั้งวันถึงล็อคก่อนหน้าอยู่ใน counters แล้ว เหลือเติมล็อคสุดท้าย
+                prev = ComboAccumulator(ls)
+                prev.feed_tu(arch.t[:usable - ls], arch.u[:usable - ls])
+                cases.append(Case(f"poll_lock/n={n}/lock={ls}", ls,
+                                  lambda saved=prev.to_dict(), arch=arch, ls=ls: poll_lock(saved, arch, ls)))
+        cases.append(Case(f"parse_numbers/n={n}", n, lambda text=text: parse_numbers(text)))
+        # ทุก k บนหลักชุดเดียว = วนรอบครั้งเดียว (เทียบกับ analyze_3_digit_combos ที่ k=3 อย่างเดียว)
+        all_k = [DigitMode(("t", "u"), k) for k in COMBO_SIZES]
+        cases.append(Case(f"analyze_digit_modes/n={n}/k=2-5", n,
+                          lambda results=results, modes=all_k: analyze_digit_modes(results, modes, 4)))
+        path = make_archive_file(results)
+        cases.append(Case(f"RoundArchive.load/n={n}", n, lambda path=path: RoundArchive.load(path)))
+        cases.append(Case(f"MultiLockEngine.compare/n={n}", n, lambda arch=arch: engine_compare(arch)))
+        cases.append(Case(f"World264StreamParser/n={n}", n,
+                          lambda body=body: stream_parse(World264StreamParser, body)))
+        cases.append(Case(f"GamesStreamParser/n={n}", n, lambda body=body: stream_parse(GamesStreamParser, body)))
+        # ทางเดิมครบวง (decode ทั้งก้อน + เลือกกลุ่ม + แยกแถว) — เทียบตรงกับ *StreamParser
+        cases.append(Case(f"json.loads+extract/n={n}", n, lambda body=body: extract_all_results_sorted(
+            doc := json.loads(body), pick_world264_key(doc))))
+        cases.append(Case(f"extract_all_results_sorted/n={n}", n,
+                          lambda day=day, key=key: extract_all_results_sorted(day, key)))
+        cases.append(Case(f"pick_world264_key/n={n}", n, lambda day=day: pick_world264_key(day)))
+    return cases
+
+# ──────────────────────────────────────────────────────────────────────
+# วัดผล
+def measure(case: Case, min_time: float, min_calls: int = 5, max_calls: int = 100_000) -> dict:
+    case.fn()                                   # warm-up (import cache, regex compile ฯลฯ)
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_calls or (time.perf_counter() < deadline and len(samples) < max_calls):
+        t0 = time.perf_counter()
+        case.fn()
+        samples.append(time.perf_counter() - t0)
+
+    # peak memory แยกรอบ (tracemalloc ทำให้ช้าลง จึงไม่ปนกับเวลา)
+    tracemalloc.start()
+    case.fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(samples)
+    q = quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    return {
+        "calls": len(samples),
+        "p50_us": q[49] * 1e6,
+        "p95_us": q[94] * 1e6,
+        "p99_us": q[98] * 1e6,
+        "rounds_per_s": case.rounds * len(samples) / total if total else 0.0,
+        "peak_kb": peak / 1024,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """เทียบ p50 และ peak memory กับ baseline; คืนรายการที่ถดถอยเกิน threshold"""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ("p50_us", "peak_kb"):
+            # ค่าเล็กมาก (ไม่กี่ µs / KB) แกว่งตามสัญญาณรบกวน ไม่นับ
+            floor = 5.0 if metric == "p50_us" else 16.0
+            if base[metric] < floor:
+                continue
+            ratio = cur[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append(f"{name} {metric}: {base[metric]:.1f} → {cur[metric]:.1f} (+{ratio - 1:.0%})")
+    return regressions
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark analysis and day-file extraction hot paths")
+    ap.add_argument("--quick", action="store_true", help="รันชุดเล็ก (n=10,1000 / lock=2,4,10)")
+    ap.add_argument("-k", "--filter", default="", help="รันเฉพาะ case ที่ชื่อมีข้อความนี้")
+    ap.add_argument("--min-time", type=float, default=None, help="เวลาวัดขั้นต่ำต่อ case (วินาที)")
+    ap.add_argument("--baseline", default=BENCH_BASELINE)
+    ap.add_argument("--save", action="store_true", help="บันทึกผลเป็น baseline (รวมกับของเดิม)")
+    ap.add_argument("--threshold", type=float, default=0.25, help="ถดถอยได้ไม่เกินกี่ส่วน (0.25 = 25%%)")
+    ap.add_argument("--json", dest="json_out", help="เขียนผลดิบเป็น JSON")
+    args = ap.parse_args(argv)
+
+    if args.quick:
+        cases = build_cases(QUICK_ROUND_COUNTS, QUICK_LOCK_SIZES)
+    else:
+        cases = build_cases()
+    cases = [c for c in cases if args.filter in c.name]
+    min_time = args.min_time if args.min_time is not None else (0.05 if args.quick else 0.2)
+
+    results = {}
+    print(f"{'case':<44} {'calls':>7} {'p50 µs':>10} {'p95 µs':>10} {'p99 µs':>10} {'rounds/s':>12} {'peak KB':>9}")
+    for case in cases:
+        r = measure(case, min_time)
+        results[case.name] = r
+        print(f"{case.name:<44} {r['calls']:>7} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f} "
+              f"{r['p99_us']:>10.1f} {r['rounds_per_s']:>12,.0f} {r['peak_kb']:>9.1f}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    status = 0
+    if baseline and not args.save:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%} vs {args.baseline}:")
+            for line in regressions:
+                print("  " + line)
+            status = 1
+        else:
+            print(f"\n✅ no regressions beyond {args.threshold:.0%} vs {args.baseline}")
+
+    if args.save:
+        merged = {**baseline, **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "machine": platform.platform(),
+                       "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"), "results": merged}, f, indent=1)
+        print(f"\nbaseline saved to {args.baseline} ({len(results)} cases)")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,39 @@
 import os
-import re
-import json
+import html
+import hashlib
 import time
 import asyncio
-import httpx
 import logging
-from itertools import combinations
 from datetime import date, datetime, timedelta
 
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram import Update
-from telegram.error import RetryAfter, TimedOut, Conflict as TgConflict
+from telegram.error import Conflict as TgConflict
 from telegram.constants import ParseMode
 
+from analysis import (
+    formula_2_archive, ComboAccumulator, join_reports,
+    ParsedNumbers, parse_numbers, parsed_key, analyze_parsed, could_contain_results,
+    MultiLockEngine, LOCK_SIZE_RANGE, compare_numbers, render_compare,
+    parse_digit_mode, analyze_digit_modes, analyze_digits_text,
+)
+from cache import LRUCache
+from fetcher import BASE_URL, DayFetcher, FETCH_STATS
+from dayparse import GamesStreamParser, GameDay, WORLD264_GAME
+from scheduler import PollScheduler
+from broadcast import Broadcaster, DeliveryResult, BROADCAST_STATS
+from workers import AnalysisPool, PoolBusy, MAX_ANALYZE_CHARS
+from state import StateStore
+from rounds import RoundArchive
+from lease import Lease
+import metrics
+from backtest import run_backtest, format_report, BACKTEST_MAX_DAYS
+from logsetup import setup_logging, Lazy, KeyedRateLimiter, dropped_records
+
 # ──────────────────────────────────────────────────────────────────────
 # Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
+# ผ่านคิวไปเธรด listener (handler ไม่รอ I/O) — LOG_FORMAT=json|text, LOG_LEVEL
+setup_logging()
 
 # Heartbeat ให้ server.py /healthz ใช้ตรวจชีพจร
 LAST_HEARTBEAT: float = 0.0
@@ -52,232 +66,105 @@ STATE_DIR = os.environ.get("STATE_DIR", "/tmp")
 os.makedirs(STATE_DIR, exist_ok=True)
 
 # ──────────────────────────────────────────────────────────────────────
-# State per-day (กันส่งซ้ำหลังรีสตาร์ท)
-def state_file_for(d: date) -> str:
-    return os.path.join(STATE_DIR, f".world264_state_{d.isoformat()}.json")
+# State per-day (กันส่งซ้ำหลังรีสตาร์ท) — SQLite ใน STATE_DIR, อ่านจาก cache ในหน่วยความจำ
+state_store = StateStore(STATE_DIR)
+
+# instance เดียว (leader) เท่านั้นที่ poll Telegram / S3 และ broadcast — lease อยู่ใน SQLite เดียวกัน
+leader = Lease(state_store.path)
 
 def load_state(d: date) -> dict:
-    path = state_file_for(d)
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {"last_processed_round_count": 0}
-
-def save_state(d: date, state: dict):
-    path = state_file_for(d)
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False)
-    except Exception as e:
-        logging.error(f"[STATE_SAVE_ERROR] {e}")
+    return state_store.get(d)
+
+def save_state(d: date, state: dict, game: str | None = None):
+    """game=gid: บันทึกเฉพาะ state["games"][gid] (ไม่ serialize state ของเกมอื่น)"""
+    state_store.save(d, state, game=game)
 
 # ──────────────────────────────────────────────────────────────────────
 # Data Fetching
-BASE_URL = "https://ltx-s3-prod.s3.ap-southeast-1.amazonaws.com/lotto-result-list/{d}.json"
-
-async def fetch_daily_data_async(d: date) -> dict | None:
-    url = BASE_URL.format(d=d.strftime("%Y-%m-%d"))
-    try:
-        async with httpx.AsyncClient(timeout=15, follow_redirects=True) as c:
-            r = await c.get(url)
-            if r.status_code == 200:
-                return r.json()
-            logging.warning(f"[FETCH] {url} -> {r.status_code}")
-    except Exception as e:
-        logging.error(f"[FETCH_ERROR] Failed to fetch {url}: {e}")
-    return None
-
-def pick_world264_key(day_data: dict) -> str | None:
-    best_key = None
-    best_len = -1
-    for gk, rounds in (day_data or {}).items():
-        if not isinstance(rounds, dict) or not rounds:
-            continue
-        sample = next(iter(rounds.values()), {})
-        if sample.get("lotto_type") == "01" and sample.get("lotto_subtype") == "22":
-            l = len(rounds)
-            if l > best_len:
-                best_key, best_len = gk, l
-    if best_key:
-        return best_key
-    return "0122" if day_data and "0122" in day_data else None
-
-def extract_all_results_sorted(day_data: dict, world_key: str) -> list[dict]:
-    world_data = day_data.get(world_key)
-    if not isinstance(world_data, dict):
-        return []
-
-    def _round_num(v):
-        try:
-            return int(v.get("round_number", 0))
-        except Exception:
-            return 0
-
-    all_records = sorted(
-        [v for v in world_data.values() if isinstance(v, dict)],
-        key=_round_num
-    )
-
-    results_list = []
-    for rec in all_records:
-        res = rec.get("result") or {}
-        top3 = res.get("top_three")
-        bottom2 = res.get("bottom_two")
-        if isinstance(top3, str) and len(top3) == 3 and top3.isdigit() and \
-           isinstance(bottom2, str) and len(bottom2) == 2 and bottom2.isdigit():
-            try:
-                round_num = int(rec.get("round_number", 0))
-            except Exception:
-                round_num = 0
-            results_list.append({"round": round_num, "top3": top3, "bottom2": bottom2})
-    return results_list
+# client ตัวเดียวตลอดอายุ Application (เปิดใน post_init, ปิดใน post_shutdown)
+# body ถูก parse แบบ streaming ครั้งเดียวได้ทุกเกม → fetched.data เป็น DayGames
+# (.key/.results = world264 เหมือน World264Day, .games = ทุกเกม)
+# แล้วต่อท้ายเข้าคลังรอบ (state_store.rounds) — จากนั้นทุกเกมใช้ RoundArchive แทน list ของ dict
+day_fetcher = DayFetcher(BASE_URL, parser_factory=GamesStreamParser)
 
 # ──────────────────────────────────────────────────────────────────────
-# Analysis
-def analyze_formula_2(results: list[dict], lock_size: int = 4) -> str | None:
-    if not results:
-        return None
-    usable = (len(results) // lock_size) * lock_size
-    if usable == 0:
-        return None
-
-    last_lock = results[usable - lock_size: usable]
-    try:
-        r3 = last_lock[-2]
-        r4 = last_lock[-1]
-        t3_r3, b2_r3 = r3['top3'], r3['bottom2']
-        t3_r4, b2_r4 = r4['top3'], r4['bottom2']
-
-        digit1 = (int(t3_r3[0]) + int(t3_r4[0])) % 10
-        digit2 = (int(t3_r4[2]) + int(b2_r4[0])) % 10
-        digit3 = (int(b2_r3[1]) + int(b2_r4[1])) % 10
-
-        run_digits = f"{digit1}-{digit2}-{digit3}"
-
-        report = []
-        report.append("📊 <b>สูตร 2 (หาเลขวิ่ง)</b>")
-        report.append("─" * 20)
-        report.append(f"วิเคราะห์จากล็อค {lock_size} รอบล่าสุด:")
-
-        block_lines = []
-        for r in last_lock:
-            prefix = f"{r.get('round', ''):>3}: " if r.get('round') else ""
-            block_lines.append(f"<code>{prefix}{r['top3']} - {r['bottom2']}</code>")
-        report.append("\n".join(block_lines))
-
-        report.append(f"\n→ <b>ผลลัพธ์:</b> <code>{run_digits}</code> (แนะนำวิ่งบน 19 ประตู)")
-        return "\n".join(report)
-
-    except (KeyError, IndexError, TypeError, ValueError) as e:
-        logging.error(f"[ERROR] Formula 2 failed: {e}")
-        return None
-
-def analyze_3_digit_combos(original_numbers_3d: list[str], lock_size=4):
-    if not original_numbers_3d:
-        return None
+# Broadcast — ทุกการส่งหลายกลุ่มผ่านตัวนี้ (rate limit / retry ร่วมกัน)
+def _mark_broadcast(chat_id: str):
+    global LAST_BROADCAST
+    LAST_BROADCAST = time.time()
+    t = metrics.boot_mark("first_broadcast")
+    if t is not None:
+        logging.info("[BOOT] first broadcast %.1fs after start", t)
+
+broadcaster = Broadcaster(on_sent=_mark_broadcast)
+
+# BROADCAST_MODE=new (ค่าเริ่มต้น): ส่งข้อความใหม่ทุกล็อค
+# BROADCAST_MODE=live: แต่ละแชทมีข้อความวิเคราะห์เดียวต่อเกมต่อวัน ล็อคใหม่ edit ข้อความนั้น
+#   และไม่เรียก API เลยถ้ารายงานที่ render แล้วเหมือนที่แชทนั้นเห็นอยู่ (แต่ edit ไม่มีแจ้งเตือน)
+BROADCAST_MODE = os.getenv("BROADCAST_MODE", "new").lower()
+LIVE_MODE = BROADCAST_MODE == "live"
+
+def report_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+async def broadcast_report(bot, text: str, live: dict | None) -> list[DeliveryResult]:
+    """ส่งรายงานของล็อคไปทุกแชท
+
+    live = state["live"] ของเกมนั้น {chat_id: [message_id, digest]} (None = โหมด new)
+    แชทที่ digest ตรงกับรายงานนี้ถือว่าส่งแล้ว (attempts=0) ไม่ต้องเรียก API"""
+    if live is None:
+        return await broadcaster.send_all(bot, CHAT_IDS, text, parse_mode=ParseMode.HTML)
+    digest = report_digest(text)
+    unchanged = [DeliveryResult(cid, True, 0, None, live[cid][0])
+                 for cid in CHAT_IDS if cid in live and live[cid][1] == digest]
+    pending = [cid for cid in CHAT_IDS if cid not in live or live[cid][1] != digest]
+    BROADCAST_STATS["unchanged"] += len(unchanged)
+    deliveries = await broadcaster.send_all(bot, pending, text, edit={cid: live[cid][0] for cid in pending if cid in live},
+                                            parse_mode=ParseMode.HTML)
+    for d in deliveries:
+        if d.ok and d.message_id is not None:
+            live[d.chat_id] = [d.message_id, digest]
+    return unchanged + deliveries
 
-    numbers_3d = [num for num in original_numbers_3d if len(num) == 3 and num.isdigit() and num[1] != num[2]]
-    if not numbers_3d:
-        return f"พบ {len(original_numbers_3d)} ชุด แต่เป็นเลขเบิ้ลทั้งหมด จึงไม่มีข้อมูลสำหรับวิเคราะห์ (สูตร 1)"
+# ──────────────────────────────────────────────────────────────────────
+# งานวิเคราะห์จากข้อความผู้ใช้ รันใน worker pool (ไม่บล็อก poller / คำสั่งอื่น)
+analysis_pool = AnalysisPool()
 
-    two_digit_pairs = [list(num[1:]) for num in numbers_3d]
-    locks = [two_digit_pairs[i:i + lock_size] for i in range(0, len(two_digit_pairs), lock_size)]
-    total_locks = len(locks)
-    if total_locks == 0:
-        return None
+# ผลวิเคราะห์ล่าสุด key ด้วยเลขที่ parse ได้ + lock_size (ข้อความที่ forward ซ้ำได้ผลทันที)
+result_cache = LRUCache(int(os.getenv("RESULT_CACHE_SIZE", "256")))
+_MISS = object()
 
-    all_digits = "0123456789"
-    candidate_combos = [frozenset(c) for c in combinations(all_digits, 3)]
-
-    results = []
-    for combo in candidate_combos:
-        any_hits = both_hits = all3_hits = 0
-        for lock in locks:
-            lock_digits = {d for pair in lock for d in pair}
-            if not combo.isdisjoint(lock_digits):
-                any_hits += 1
-            if combo.issubset(lock_digits):
-                all3_hits += 1
-            if any(set(pair).issubset(combo) for pair in lock):
-                both_hits += 1
-        results.append({
-            "combo_set": combo,
-            "combo_list": sorted(list(combo)),
-            "any": any_hits, "both": both_hits, "all3": all3_hits
-        })
-
-    full_coverage = [r for r in results if r["any"] == total_locks]
-    if not full_coverage:
-        return f"ไม่พบชุดเลข 3 ตัวที่ครอบคลุมทุกล็อค ({total_locks}/{total_locks})"
-
-    sorted_combos = sorted(full_coverage, key=lambda x: (x["both"], x["all3"]), reverse=True)
-
-    total_rounds = len(numbers_3d)
-    last_lock_size = len(locks[-1]) if locks else 0
-    last_lock_info = ""
-    if total_locks > 0 and last_lock_size != lock_size:
-        last_lock_info = f" (ล็อค {total_locks} มี {last_lock_size} รอบ)"
-
-    report = []
-    report.append(f"📊 <b>สูตร 1: วิเคราะห์ชุดเลข 3 ตัว</b>")
-    report.append(f"จากรอบ 1–{total_rounds} (ล็อค 1–{total_locks}{last_lock_info})")
-    report.append("โฟกัสที่ <b>หลักสิบ+หลักหน่วย</b> ของสามตัวบนเท่านั้น\n")
-    report.append("วัด 3 เกณฑ์ต่อ “ล็อค”:\n"
-                  "<b>ANY</b> = มีเลขชุดปรากฏอย่างน้อย 1 ตัว\n"
-                  "<b>BOTH</b> = มีรอบที่เลขสองหลักท้ายเข้าคู่ในชุดเดียวกัน\n"
-                  "<b>ALL3</b> = ทั้งล็อคมีตัวเลขครบทั้ง 3 ตัวของชุดนั้น\n")
-
-    best_all3 = max(sorted_combos, key=lambda x: x['all3'])
-    best_both = max(sorted_combos, key=lambda x: x['both'])
-
-    report.append("\n<b>ชุดแนะนำ (สำหรับรูด 19 ประตูบน):</b>")
-    report.append(f"<b>ชุดหลัก 1: {'-'.join(best_all3['combo_list'])}</b> — ครอบคลุมทุกล็อค และ ALL3 สูงสุด ({best_all3['all3']}/{total_locks})")
-    report.append(f"<b>ชุดหลัก 2: {'-'.join(best_both['combo_list'])}</b> — ครอบคลุมทุกล็อค และ BOTH สูงสุด ({best_both['both']}/{total_locks})")
-
-    supplement = next((c for c in sorted_combos if c['combo_set'] not in [best_all3['combo_set'], best_both['combo_set']]), None)
-    if supplement:
-        report.append(f"<b>ชุดเสริม: {'-'.join(supplement['combo_list'])}</b> — BOTH {supplement['both']}/{total_locks} ดีมาก")
-
-    other_options = []
-    recommended_sets = {best_all3['combo_set'], best_both['combo_set']}
-    if supplement:
-        recommended_sets.add(supplement['combo_set'])
-    for r in sorted_combos:
-        if r['combo_set'] not in recommended_sets:
-            other_options.append("".join(r['combo_list']))
-        if len(other_options) >= 3:
-            break
-    if other_options:
-        report.append(f"\n<b>ทางเลือกที่ยังดี:</b> {', '.join(other_options)}")
-
-    return "\n".join(report)
-
-def analyze_numbers(text: str, lock_size: int = 4) -> str | None:
-    pairs = re.findall(r"\b(\d{3})\s*-\s*(\d{2})\b", text)
-    full_results_list = [{'top3': t3, 'bottom2': b2} for t3, b2 in pairs]
-
-    if pairs:
-        original_numbers_3d = [t3 for t3, _ in pairs]
-    else:
-        original_numbers_3d = re.findall(r"\b(\d{3})\b", text)
-        if not original_numbers_3d:
-            return None
-
-    parts = []
-    res1 = analyze_3_digit_combos(original_numbers_3d, lock_size)
-    if res1:
-        parts.append(res1)
-    res2 = analyze_formula_2(full_results_list, lock_size)
-    if res2:
-        parts.append(res2)
-
-    if not parts:
+async def analyze_text_cached(text: str, size: int) -> str | None:
+    parsed = parse_numbers(text)
+    if parsed is None:
         return None
-    separator = "\n\n" + "═" * 25 + "\n\n"
-    return separator.join(parts)
+    key = parsed_key(parsed, size)
+    result = result_cache.get(key, _MISS)
+    if result is _MISS:
+        result = await analysis_pool.run(analyze_parsed, parsed, size)
+        result_cache.put(key, result)
+    return result
+
+# รายงานที่ render แล้วต่อล็อค key (วัน, เกม, ขนาดล็อค, รอบ) — poller, /setlocks, /report ใช้ข้อความเดียวกัน
+lock_reports = LRUCache(int(os.getenv("LOCK_REPORT_CACHE_SIZE", "64")))
+
+def cached_lock_report(d: date, game: str, size: int, usable: int, render) -> str | None:
+    """render() ถูกเรียกเฉพาะครั้งแรกของล็อคนั้น"""
+    key = (d, game, size, usable)
+    report = lock_reports.get(key, _MISS)
+    if report is _MISS:
+        report = render()
+        lock_reports.put(key, report)
+    return report
+
+def world264_report(d: date, size: int, usable: int) -> str | None:
+    """รายงานล็อคของ world264 จาก day_engine (update_day_engine แล้ว) — ไม่ render ซ้ำถ้าเคยทำแล้ว"""
+    return cached_lock_report(d, WORLD264_GAME, size, usable, lambda: day_engine.report(size, usable))
+
+def prime_result_cache(pairs: list[tuple[str, str]], size: int, report: str | None):
+    """ให้ /analyze ของรอบชุดเดียวกับที่ poller เพิ่งวิเคราะห์ ได้ผลจาก cache ทันที (pairs = RoundArchive.pairs())"""
+    parsed = ParsedNumbers(tuple(pairs), ())
+    result_cache.put(parsed_key(parsed, size), report)
 
 # ──────────────────────────────────────────────────────────────────────
 # Handlers
@@ -285,16 +172,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
     text = update.message.text
-    result = analyze_numbers(text, lock_size)
+    if not could_contain_results(text):
+        return                      # ข้อความคุยทั่วไป: จบที่ regex search ครั้งเดียว
+    chat_id = update.message.chat.id
+    if len(text) > MAX_ANALYZE_CHARS:
+        logging.info("[MANUAL_REPLY] Chat %s: message too long (%d chars), skipped", chat_id, len(text),
+                     extra={"chat_id": chat_id})
+        return
+    try:
+        result = await analyze_text_cached(text, lock_size)
+    except PoolBusy as e:
+        # PoolBroken (worker ตาย, pool สร้างใหม่แล้ว) เป็น PoolBusy ด้วย — ข้ามเหมือนกัน
+        logging.warning("[MANUAL_REPLY] Chat %s: analysis pool unavailable (%s), skipped",
+                        chat_id, type(e).__name__, extra={"chat_id": chat_id})
+        return
+    except asyncio.TimeoutError:
+        return
     if result:
-        logging.info(f"[MANUAL_REPLY] Chat {update.message.chat.id}")
+        logging.info("[MANUAL_REPLY] Chat %s", chat_id, extra={"chat_id": chat_id})
         await update.message.reply_text(result, parse_mode=ParseMode.HTML)
 
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     err = context.error
     if isinstance(err, TgConflict):
-        logging.warning("[ERROR] Conflict: another getUpdates is running; backing off 60s")
-        await asyncio.sleep(60)
+        # ชนกันช่วงสั้นๆ ตอนสลับ leader — updater ลองใหม่เอง ไม่ต้องหน่วง handler
+        logging.warning("[ERROR] Conflict: another getUpdates is running (leader=%s)", leader.is_leader)
         return
     logging.exception("[ERROR] Unhandled exception", exc_info=err)
 
@@ -305,7 +207,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1️⃣ วิเคราะห์ในกลุ่ม: ส่งข้อความที่มีผลเลขรูปแบบ <code>123 - 45</code>\n"
         "2️⃣ ส่งเข้ากลุ่มหลัก: ใช้ <code>/analyze <ผลเลข></code>\n"
         "3️⃣ ใช้กับข้อความเก่า: ตอบกลับแล้วพิมพ์ <code>/analyze</code>\n\n"
-        f"<b>คำสั่งอื่นๆ:</b>\n/setlocks N (ปัจจุบัน: {lock_size})\n/status",
+        f"<b>คำสั่งอื่นๆ:</b>\n/setlocks N (ปัจจุบัน: {lock_size})\n/status\n"
+        "/report — ผลวิเคราะห์ล็อคล่าสุดของวันนี้\n"
+        "/compare — เทียบทุกขนาดล็อค\n"
+        "/digits 4 h t u — ชุดเลข k ตัว (2–5) บนหลักที่เลือก\n"
+        "/backtest N — ย้อนทดสอบสูตร N วันล่าสุด",
         parse_mode=ParseMode.HTML
     )
 
@@ -315,10 +221,124 @@ async def setlocks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         size = int(context.args[0])
         if size <= 0:
             raise ValueError
-        lock_size = size
-        await update.message.reply_text(f"✅ ตั้งค่าล็อคใหม่ = {lock_size} รอบ")
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ ใช้คำสั่งแบบนี้: /setlocks 4")
+        return
+    lock_size = size
+
+    # ผลของวันนี้ที่ขนาดใหม่คำนวณจาก engine ในหน่วยความจำทันที (ไม่ดึง/parse ใหม่)
+    extra = ""
+    if day_engine is not None and len(day_engine):
+        usable = (len(day_engine) // size) * size
+        if usable:
+            prime_result_cache(day_engine.results.pairs(0, usable), size,
+                               world264_report(_day_engine_date, size, usable))
+            extra = "\n" + _summary_line(day_engine.summary(size, usable))
+    await update.message.reply_text(f"✅ ตั้งค่าล็อคใหม่ = {lock_size} รอบ{extra}")
+
+async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/report — รายงานล็อคล่าสุดของวันนี้: ข้อความเดียวกับที่ broadcast (จาก cache ต่อล็อค ไม่วิเคราะห์ซ้ำ)"""
+    today = datetime.now(BKK).date()
+    usable = 0
+    if day_engine is not None and _day_engine_date == today:
+        usable = (len(day_engine) // lock_size) * lock_size
+    report = world264_report(today, lock_size, usable) if usable else None
+    if report is None:
+        await update.message.reply_text(f"⏳ วันนี้ยังไม่ครบล็อคแรก ({lock_size} รอบ)")
+        return
+    await update.message.reply_text(report, parse_mode=ParseMode.HTML)
+
+def _summary_line(sm: dict) -> str:
+    picks = sm["picks"]
+    run = "-".join(map(str, sm["run"])) if sm["run"] else "-"
+    if not picks:
+        return f"รอบ 1–{sm['rounds']} ({sm['locks']} ล็อค): ไม่มีชุดที่ครอบคลุมทุกล็อค, เลขวิ่ง {run}"
+    return (f"รอบ 1–{sm['rounds']} ({sm['locks']} ล็อค): ชุดหลัก {'-'.join(picks[0])} / "
+            f"{'-'.join(picks[1])}, เลขวิ่ง {run}")
+
+async def compare_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/compare — เทียบทุกขนาดล็อคของผลวันนี้ หรือของข้อความที่ตอบกลับ/แนบมา"""
+    text = None
+    if update.message.reply_to_message and update.message.reply_to_message.text:
+        text = update.message.reply_to_message.text
+    elif context.args:
+        text = " ".join(context.args)
+
+    if text is not None:
+        if len(text) > MAX_ANALYZE_CHARS:
+            await update.message.reply_text(f"⚠️ ข้อความยาวเกินไป (สูงสุด {MAX_ANALYZE_CHARS:,} ตัวอักษร)")
+            return
+        try:
+            rows = await analysis_pool.run(compare_numbers, text)
+        except PoolBusy:
+            await update.message.reply_text("⏳ คิววิเคราะห์เต็ม ลองใหม่อีกครั้งในอีกสักครู่")
+            return
+        except asyncio.TimeoutError:
+            await update.message.reply_text("⚠️ วิเคราะห์นานเกินไป ลองส่งข้อมูลให้สั้นลง")
+            return
+        title = "ข้อความที่ส่งมา"
+    else:
+        if day_engine is None or not len(day_engine):
+            await update.message.reply_text("⚠️ ยังไม่มีผลของวันนี้ — ตอบกลับข้อความที่มีผลเลขด้วย /compare แทนได้")
+            return
+        # แต่ละขนาดดูเฉพาะรอบที่ครบล็อคแล้ว (แบบเดียวกับที่ poller จะส่ง)
+        n = len(day_engine)
+        rows = [day_engine.summary(size, (n // size) * size) for size in day_engine.sizes]
+        title = f"ผลวันนี้ {n} รอบ"
+    if not rows:
+        await update.message.reply_text("⚠️ ไม่พบรูปแบบ <code>123 - 45</code>", parse_mode=ParseMode.HTML)
+        return
+    await update.message.reply_text(
+        f"📊 <b>เทียบขนาดล็อค</b> ({title}, * = ปัจจุบัน)\n"
+        "ล็อค# = จำนวนล็อค, ครอบ = ชุดที่ครอบคลุมทุกล็อค (จาก 120)\n"
+        f"<pre>{html.escape(render_compare(rows, lock_size))}</pre>",
+        parse_mode=ParseMode.HTML,
+    )
+
+_DIGITS_HELP = (
+    "⚠️ <b>วิธีใช้:</b> <code>/digits k [หลัก...]</code>\n"
+    "k = ขนาดชุด 2–5, หลัก: h t u (สามตัวบน) bt bu (สองตัวล่าง), top = h t u, b = bt bu\n"
+    "เช่น <code>/digits 3 t u</code> (= สูตร 1), <code>/digits 4 h t u</code>, "
+    "<code>/digits 2 b; 3 top</code> (หลาย mode คั่นด้วย ;)\n"
+    "ใช้กับผลวันนี้ หรือตอบกลับข้อความที่มีผลเลข"
+)
+
+async def digits_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/digits — สูตร 1 แบบเลือกหลัก/ขนาดชุด ของผลวันนี้ หรือของข้อความที่ตอบกลับ"""
+    spec = " ".join(context.args or [])
+    try:
+        modes = [parse_digit_mode(part) for part in spec.split(";") if part.strip()]
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ {html.escape(str(e))}\n\n{_DIGITS_HELP}", parse_mode=ParseMode.HTML)
+        return
+    if not modes:
+        await update.message.reply_text(_DIGITS_HELP, parse_mode=ParseMode.HTML)
+        return
+
+    reply = update.message.reply_to_message
+    if reply and reply.text:
+        if len(reply.text) > MAX_ANALYZE_CHARS:
+            await update.message.reply_text(f"⚠️ ข้อความยาวเกินไป (สูงสุด {MAX_ANALYZE_CHARS:,} ตัวอักษร)")
+            return
+        try:
+            result = await analysis_pool.run(analyze_digits_text, reply.text, modes, lock_size)
+        except PoolBusy:
+            await update.message.reply_text("⏳ คิววิเคราะห์เต็ม ลองใหม่อีกครั้งในอีกสักครู่")
+            return
+        except asyncio.TimeoutError:
+            await update.message.reply_text("⚠️ วิเคราะห์นานเกินไป ลองส่งข้อมูลให้สั้นลง")
+            return
+    else:
+        if day_engine is None or not len(day_engine):
+            await update.message.reply_text("⚠️ ยังไม่มีผลของวันนี้ — ตอบกลับข้อความที่มีผลเลขด้วย /digits แทนได้")
+            return
+        # รอบที่ครบล็อคแล้วเท่านั้น (แบบเดียวกับที่ poller ส่ง); ทุก mode วนรอบครั้งเดียว
+        usable = (len(day_engine) // lock_size) * lock_size
+        result = analyze_digit_modes(day_engine.results[:usable], modes, lock_size) if usable else None
+    if result is None:
+        await update.message.reply_text("⚠️ ไม่พบรูปแบบ <code>123 - 45</code>", parse_mode=ParseMode.HTML)
+        return
+    await update.message.reply_text(result, parse_mode=ParseMode.HTML)
 
 async def analyze_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text_to_analyze = None
@@ -336,7 +356,17 @@ async def analyze_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    result = analyze_numbers(text_to_analyze, lock_size)
+    if len(text_to_analyze) > MAX_ANALYZE_CHARS:
+        await update.message.reply_text(f"⚠️ ข้อความยาวเกินไป (สูงสุด {MAX_ANALYZE_CHARS:,} ตัวอักษร)")
+        return
+    try:
+        result = await analyze_text_cached(text_to_analyze, lock_size)
+    except PoolBusy:
+        await update.message.reply_text("⏳ คิววิเคราะห์เต็ม ลองใหม่อีกครั้งในอีกสักครู่")
+        return
+    except asyncio.TimeoutError:
+        await update.message.reply_text("⚠️ วิเคราะห์นานเกินไป ลองส่งข้อมูลให้สั้นลง")
+        return
     if result is None:
         await update.message.reply_text("⚠️ ไม่พบรูปแบบ <code>123 - 45</code>", parse_mode=ParseMode.HTML)
         return
@@ -346,20 +376,8 @@ async def analyze_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("ℹ️ ไม่ได้ตั้งค่า TELEGRAM_CHAT_IDS", parse_mode=ParseMode.HTML)
         return
 
-    sent = 0
-    for cid in CHAT_IDS:
-        try:
-            await context.bot.send_message(chat_id=cid, text=result, parse_mode=ParseMode.HTML)
-            global LAST_BROADCAST
-            LAST_BROADCAST = time.time()
-            sent += 1
-            await asyncio.sleep(0.25)
-        except RetryAfter as e:
-            await asyncio.sleep(int(getattr(e, "retry_after", 2)) + 1)
-        except TimedOut:
-            await asyncio.sleep(1)
-        except Exception as e:
-            logging.error(f"[BROADCAST_ERR] {cid}: {e}")
+    deliveries = await broadcaster.send_all(context.bot, CHAT_IDS, result, parse_mode=ParseMode.HTML)
+    sent = sum(1 for d in deliveries if d.ok)
     await update.message.reply_text(f"✅ ส่งผลไปยัง {sent}/{len(CHAT_IDS)} กลุ่มแล้ว")
 
 async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -376,112 +394,479 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     today = datetime.now(BKK).date()
     state = load_state(today)
     last_cnt = int(state.get("last_processed_round_count", 0))
+    cadence = poll_scheduler.cadence()
+    cadence_txt = f"~{cadence / 60:.1f} นาที/รอบ" if cadence else "ยังไม่ทราบ"
+    pool = analysis_pool.snapshot()
+    cache = result_cache.snapshot()
+    reports = lock_reports.snapshot()
+    history = state_store.lock_history(today, limit=1)
+    if history:
+        h = history[0]
+        last_lock_txt = f"รอบ {h['usable']} (ล็อค {h['lock_size']}) {h['status']} {h['sent']}/{h['targets']}"
+    else:
+        last_lock_txt = "-"
+    games = state.get("games", {})
+    # รอบล่าสุด / ขนาดคลัง อ่านจากคลังรอบตรงๆ (ไม่ดึงหรือ parse ไฟล์รายวัน)
+    world = day_engine.results if day_engine is not None and _day_engine_date == today else None
+    if world is not None and len(world):
+        i = len(world) - 1
+        latest_txt = f"#{world.rounds[i]} <code>{world.top3(i)} - {world.bottom2(i)}</code>"
+    else:
+        latest_txt = "-"
+    arch_groups, arch_rounds, arch_bytes = state_store.rounds.day_stats(today)
     await update.message.reply_text(
         f"📅 <b>สถานะวันนี้</b> ({today.isoformat()})\n"
         f"• ขนาดล็อค: <b>{lock_size}</b>\n"
-        f"• รอบล่าสุดที่บันทึก: <b>{last_cnt}</b>\n"
-        f"• ล็อคล่าสุดสมบูรณ์: <b>{last_cnt // lock_size}</b> ล็อค",
+        f"• รอบล่าสุดที่บันทึก: <b>{last_cnt}</b> (ผลล่าสุด {latest_txt})\n"
+        f"• ล็อคล่าสุดสมบูรณ์: <b>{last_cnt // lock_size}</b> ล็อค\n"
+        f"• ส่งล็อคล่าสุด: {last_lock_txt}\n"
+        f"• instance: {'leader' if leader.is_leader else 'standby'} (token {leader.token or '-'})\n"
+        f"• เกมอื่นที่ติดตาม: <b>{len(games)}</b> เกม (GAMES={html.escape(GAMES)})\n"
+        f"• คลังรอบวันนี้: {arch_rounds} รอบ / {arch_groups} กลุ่ม ({arch_bytes / 1024:.1f} KB)\n"
+        f"• ดึงข้อมูล: <b>{FETCH_STATS['requests']}</b> ครั้ง "
+        f"(ไม่เปลี่ยน {FETCH_STATS['not_modified']}, {FETCH_STATS['bytes'] // 1024} KB)\n"
+        f"• จังหวะออกผล: <b>{cadence_txt}</b> (poll วันนี้ {poll_scheduler.fetches_today} ครั้ง)\n"
+        f"• คิววิเคราะห์: รัน {pool['running']} / รอ {pool['queued']} "
+        f"(เสร็จ {pool['completed']}, เฉลี่ย {pool['run_time_avg'] * 1000:.0f} ms, "
+        f"ปฏิเสธ {pool['rejected']}, timeout {pool['timeouts']})\n"
+        f"• cache ผลวิเคราะห์: {cache['size']}/{cache['maxsize']} "
+        f"(hit {cache['hits']}, miss {cache['misses']}, {cache['hit_rate']:.0%})\n"
+        f"• รายงานต่อล็อค: {reports['size']} (hit {reports['hits']}, miss {reports['misses']})\n"
+        f"• โหมดส่ง: <b>{BROADCAST_MODE}</b> (ส่งใหม่ {BROADCAST_STATS['sent']}, แก้ {BROADCAST_STATS['edited']}, "
+        f"ไม่เปลี่ยน {BROADCAST_STATS['unchanged']})",
         parse_mode=ParseMode.HTML
     )
 
+_backtest_running = False
+
+async def backtest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _backtest_running
+    try:
+        days = int(context.args[0]) if context.args else 30
+        if days <= 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(f"⚠️ ใช้คำสั่งแบบนี้: /backtest 30 (สูงสุด {BACKTEST_MAX_DAYS} วัน)")
+        return
+    if _backtest_running:
+        await update.message.reply_text("⏳ กำลังรัน backtest อยู่ รอให้เสร็จก่อน")
+        return
+
+    _backtest_running = True
+    try:
+        await update.message.reply_text(f"⏳ กำลังย้อนทดสอบ {min(days, BACKTEST_MAX_DAYS)} วัน…")
+        rep = await run_backtest(days)
+    except Exception as e:
+        logging.exception("[BACKTEST] failed")
+        await update.message.reply_text(f"⚠️ backtest ล้มเหลว: {e}")
+        return
+    finally:
+        _backtest_running = False
+    logging.info("[BACKTEST] %s/%s days in %.1fs", rep.days_loaded, rep.days_requested, rep.elapsed)
+    await update.message.reply_text(f"<pre>{html.escape(format_report(rep))}</pre>", parse_mode=ParseMode.HTML)
+
 async def ping_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("pong ✅")
     if CHAT_IDS:
-        for cid in CHAT_IDS:
-            try:
-                await context.bot.send_message(chat_id=cid, text="🔔 ping test from bot")
-                global LAST_BROADCAST
-                LAST_BROADCAST = time.time()
-                await asyncio.sleep(0.2)
-            except Exception as e:
-                logging.error(f"[PING_BROADCAST_ERR] {e}")
-
-async def update_logger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        deliveries = await broadcaster.send_all(context.bot, CHAT_IDS, "🔔 ping test from bot")
+        for d in deliveries:
+            if not d.ok:
+                logging.error("[PING_BROADCAST_ERR] %s: %s", d.chat_id, d.error)
+
+# dump update ดิบ: logger แยก ("updates", ปิดได้ด้วย UPDATE_LOG_LEVEL=WARNING)
+# จำกัดต่อแชทไม่เกิน UPDATE_LOG_PER_MIN ครั้ง/นาที; to_json ทำในเธรด listener ตอนเขียนจริงเท่านั้น
+update_log = logging.getLogger("updates")
+update_log.setLevel(os.getenv("UPDATE_LOG_LEVEL", "INFO").upper())
+_update_log_limiter = KeyedRateLimiter(float(os.getenv("UPDATE_LOG_PER_MIN", "6")), per=60.0)
+
+def _update_dump(update: Update) -> str:
     try:
-        update_json = update.to_json()
-        logging.info(f"[DEBUG] Update: {update_json[:1200]}...")
+        return update.to_json()[:1200]
     except Exception as e:
-        logging.warning(f"[DEBUG] Could not log update: {e}")
+        return f"<unserializable update: {e}>"
+
+async def update_logger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update_log.isEnabledFor(logging.INFO):
+        return
+    chat = update.effective_chat
+    chat_id = chat.id if chat else None
+    allowed, suppressed = _update_log_limiter.allow(chat_id)
+    if allowed:
+        update_log.info("[UPDATE] %s", Lazy(_update_dump, update),
+                        extra={"chat_id": chat_id, "update_id": update.update_id, "suppressed": suppressed})
+
+# ──────────────────────────────────────────────────────────────────────
+# Incremental analysis — ตัวนับสูตร 1 เก็บไว้ใน state ของวัน (key "formula1")
+def analyze_day_incremental(state: dict, all_results: RoundArchive, usable: int, lock_size: int) -> str | None:
+    """วิเคราะห์รอบ 1..usable โดยเติมเฉพาะรอบใหม่เข้าตัวนับที่เก็บไว้ (all_results = RoundArchive)
+
+    ผลเหมือน analyze_numbers() ของข้อความ "top3 - bottom2" รอบ 1..usable ทุกไบต์
+    ถ้า lock_size เปลี่ยน ข้อมูลของวันหดลง หรือรอบที่นับไปแล้วไม่ตรงกับคลัง (ต้นทางแก้ผลย้อนหลัง
+    → คลังถูกสร้างใหม่; เทียบด้วย fingerprint ที่เก็บคู่กับตัวนับ) จะนับใหม่ตั้งแต่รอบแรก
+    """
+    acc = None
+    saved = state.get("formula1")
+    if saved:
+        try:
+            acc = ComboAccumulator.from_dict(saved)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning("[STATE] formula1 counters unreadable, rebuilding: %s", e)
+    if acc is None or acc.lock_size != lock_size or acc.rounds > usable:
+        acc = None
+    elif saved.get("source") != all_results.fingerprint(acc.rounds):
+        logging.info("[STATE] formula1 counters were built from superseded rows, rebuilding")
+        acc = None
+    if acc is None:
+        acc = ComboAccumulator(lock_size)
+
+    with metrics.ANALYSIS_SECONDS.time(formula="formula1"):
+        acc.feed_tu(all_results.t[acc.rounds:usable], all_results.u[acc.rounds:usable])
+        res1 = acc.report()
+    state["formula1"] = {**acc.to_dict(), "source": all_results.fingerprint(acc.rounds)}
+
+    with metrics.ANALYSIS_SECONDS.time(formula="formula2"):
+        res2 = formula_2_archive(all_results, usable, lock_size)
+    return join_reports([p for p in (res1, res2) if p])
+
+# ──────────────────────────────────────────────────────────────────────
+# ผลของวันนี้ทุกขนาดล็อค (ในหน่วยความจำ) — ใช้กับ /compare และ /setlocks
+day_engine: MultiLockEngine | None = None
+_day_engine_date: date | None = None
+
+def update_day_engine(d: date, results: RoundArchive):
+    """เติมเฉพาะรอบใหม่ (engine อ่านคลังรอบตรงๆ); วันใหม่หรือคลังถูกสร้างใหม่ → engine ใหม่"""
+    global day_engine, _day_engine_date
+    eng = day_engine
+    if eng is not None and eng.results is not results:
+        # คลังถูกสร้างใหม่ (แก้ผลย้อนหลัง) → รายงานที่ render ไว้อาจไม่ตรงแล้ว
+        lock_reports.clear()
+    if eng is None or d != _day_engine_date:
+        eng = MultiLockEngine(LOCK_SIZE_RANGE)
+    eng.sync(results)
+    day_engine, _day_engine_date = eng, d
+
+# ──────────────────────────────────────────────────────────────────────
+# Warm-up — คืนสภาพจาก snapshot ของวันนี้ก่อน poll แรก (รันนอก event loop ได้)
+# fetcher ได้ ETag เดิม (ไม่เปลี่ยน = 304), day_engine ได้รอบเดิม, poll แรกเหลือแค่ delta
+_warmed = False
+
+def warm_up():
+    global _warmed, _last_poll_key
+    if _warmed:
+        return
+    t0 = time.perf_counter()
+    today = datetime.now(BKK).date()
+    state = load_state(today)
+    if poll_scheduler.day is None:
+        poll_scheduler.restore(state.get("scheduler"))
+    snap = state_store.load_snapshot(today)
+    if snap is None:
+        logging.info("[BOOT] no snapshot for today; first poll starts cold")
+    else:
+        etag, last_modified, day = snap
+        if not isinstance(day.results, RoundArchive):
+            # snapshot รุ่นก่อน (แถวเป็น JSON) → ย้ายเข้าคลังรอบครั้งเดียว แล้วเขียน snapshot แบบ meta ทับ
+            day = state_store.rounds.sync_day(today, day)
+            state_store.save_snapshot(today, day, etag, last_modified)
+        day_fetcher.seed(today, etag, last_modified, day)
+        usable = (len(day.results) // lock_size) * lock_size if day.key else 0
+        if day.key:
+            update_day_engine(today, day.results)
+        if usable <= int(state.get("last_processed_round_count", 0)):
+            # snapshot ถูกเขียนหลังวิเคราะห์ครบทุกเกมแล้ว → ได้ 304 ก็ไม่มีอะไรต้องทำ
+            _last_poll_key = (today, lock_size)
+        if usable:
+            prime_result_cache(day.results.pairs(0, usable), lock_size, world264_report(today, lock_size, usable))
+        logging.info("[BOOT] restored snapshot: %s rounds, %s games in %.0f ms",
+                     len(day.results), len(day.games), (time.perf_counter() - t0) * 1000)
+    # ตั้งธงเมื่อสำเร็จเท่านั้น — พังกลางทาง (SQLite ล็อค, snapshot เสีย) ครั้งหน้าจะลองใหม่
+    _warmed = True
+    metrics.boot_mark("warm_up")
+
+# token ของ lease ที่ takeover เสร็จแล้ว — poll_job เทียบกับ leader.token ทุกครั้ง
+# (ไม่ใช้ leader.on_acquired: callback นั้นรันในเธรดของ lease ขณะที่ poll / handler บน event loop
+#  กำลังแก้ day_engine, cache และ state อยู่ และ is_leader เป็น True ไปก่อน callback แล้ว)
+_active_token: int | None = None
+
+def _take_over(token: int):
+    """เพิ่งได้เป็น leader (รันบน event loop ก่อน poll แรกของ token นี้):
+    state ใน cache อาจเก่า (leader เดิมเขียนไปแล้ว) → อ่านใหม่ทั้งหมด แล้วค่อยเริ่ม poll"""
+    global _warmed, _last_poll_key, _active_token
+    logging.info("[LEADER] taking over with token %s", token)
+    state_store.invalidate()
+    poll_scheduler.day = None
+    _warmed = False
+    _last_poll_key = None
+    warm_up()
+    _active_token = token
 
 # ──────────────────────────────────────────────────────────────────────
-# Poller (ทุก 60 วิ) — ยิงเมื่อมี “ล็อคเต็มใหม่” เท่านั้น
+# Poller — ยิงเมื่อมี “ล็อคเต็มใหม่” เท่านั้น
+# เวลาตื่นแต่ละครั้งกำหนดโดย poll_scheduler (เรียนรู้จังหวะออกผลของวัน)
+_last_poll_key: tuple | None = None
+poll_scheduler = PollScheduler()
+
+# เกมอื่นในไฟล์เดียวกัน (นอกจาก world264): GAMES=none (ค่าเริ่มต้น) | all | รายการ game id เช่น 02-01,03-05
+# ต้องเปิดเอง — อัปเกรดแล้วห้องเดิมไม่ควรได้ทุกเกมในไฟล์โดยไม่ได้ขอ
+GAMES = os.getenv("GAMES", "none").strip().lower()
+_GAME_SET = {g.strip() for g in GAMES.split(",") if g.strip()}
+
+def game_enabled(gid: str) -> bool:
+    if GAMES == "all":
+        return True
+    if GAMES in ("", "none"):
+        return False
+    return gid in _GAME_SET
+
 async def poll_and_analyze(context: ContextTypes.DEFAULT_TYPE):
-    global LAST_HEARTBEAT, LAST_BROADCAST
+    global LAST_HEARTBEAT, _last_poll_key
     LAST_HEARTBEAT = time.time()  # heartbeat ทุกครั้งที่ job ตื่น
 
     today = datetime.now(BKK).date()
     state = load_state(today)
-    last_processed_round_count = int(state.get("last_processed_round_count", 0))
 
     logging.info("[POLL] Checking for new results...")
-    daily_data = await fetch_daily_data_async(today)
-    if not daily_data:
+    fetched = await day_fetcher.fetch(today)
+    day = fetched.data
+    if day is None:
         logging.warning("[POLL] Failed to fetch daily data.")
         return
+    if fetched.changed:
+        # แถวที่ decode ใหม่ → ต่อท้ายคลังรอบ (เขียนเฉพาะรอบใหม่ลงไฟล์); 304 ครั้งถัดไปได้คลังจาก fetcher เลย
+        day = state_store.rounds.sync_day(today, day)
+        day_fetcher.seed(today, fetched.etag, fetched.last_modified, day)
+    if poll_scheduler.day is None:
+        poll_scheduler.restore(state.get("scheduler"))
+    poll_scheduler.observe(today, len(day.results))
+    # 304 และ lock_size เดิม → ไม่มีอะไรเปลี่ยน ข้าม decode/วิเคราะห์ทั้งหมด
+    poll_key = (today, lock_size)
+    if not fetched.changed and poll_key == _last_poll_key:
+        logging.info("[POLL] Not modified since last poll.")
+        return
+    _last_poll_key = poll_key
 
-    world_key = pick_world264_key(daily_data)
-    if not world_key:
+    # ไฟล์ถูก decode ครั้งเดียวแล้ว (GamesStreamParser) — แตกงานเฉพาะเกมที่มีล็อคใหม่
+    # เกมที่ไม่เปลี่ยนเสียแค่การเทียบจำนวนรอบ
+    pipelines = []
+    if day.key:
+        pipelines.append(poll_world264(context, today, state, day.results))
+    else:
         logging.warning("[POLL] Could not determine world_key for today.")
-        return
 
-    all_results = extract_all_results_sorted(daily_data, world_key)
+    game_states = state.setdefault("games", {})
+    for gid, game in day.games.items():
+        if gid == WORLD264_GAME or game.key == day.key or not game_enabled(gid):
+            continue
+        usable = (len(game.results) // lock_size) * lock_size
+        last = int(game_states.get(gid, {}).get("last_processed_round_count", 0))
+        if usable and usable > last:
+            pipelines.append(poll_game(context, today, state, gid, game, usable))
+    await asyncio.gather(*pipelines)
+    if fetched.changed:
+        state_store.save_snapshot(today, day, fetched.etag, fetched.last_modified)
+
+def _retry_next_poll():
+    """poll ถัดไปวิเคราะห์ใหม่แม้ไฟล์ไม่เปลี่ยน (304)"""
+    global _last_poll_key
+    _last_poll_key = None
+
+async def poll_world264(context: ContextTypes.DEFAULT_TYPE, today: date, state: dict, all_results: list[dict]):
+    last_processed_round_count = int(state.get("last_processed_round_count", 0))
+    update_day_engine(today, all_results)
     current_round_count = len(all_results)
     usable = (current_round_count // lock_size) * lock_size
 
-    logging.info(f"[POLL] Rounds: {current_round_count} (was {last_processed_round_count}), usable={usable}, lock_size={lock_size}")
+    logging.info("[POLL] Rounds: %d (was %d), usable=%d, lock_size=%d",
+                 current_round_count, last_processed_round_count, usable, lock_size,
+                 extra={"game": WORLD264_GAME, "rounds": current_round_count, "usable": usable})
 
     if usable == 0:
         logging.info("[POLL] Not enough rounds to complete a full lock yet.")
         return
 
     if usable > last_processed_round_count:
-        logging.info(f"[POLL] New full lock up to {usable}. Analyzing...")
-        text_to_analyze = "\n".join([f"{r['top3']} - {r['bottom2']}" for r in all_results[:usable]])
-
-        result = analyze_numbers(text_to_analyze, lock_size)
-        if result and CHAT_IDS:
-            logging.info(f"[POLL] Broadcasting analysis to {len(CHAT_IDS)} chats...")
-            for cid in CHAT_IDS:
-                try:
-                    await context.bot.send_message(chat_id=cid, text=result, parse_mode=ParseMode.HTML)
-                    LAST_BROADCAST = time.time()
-                    logging.info(f"[POLL] ✅ sent to {cid}")
-                    await asyncio.sleep(0.25)
-                except RetryAfter as e:
-                    wait_s = int(getattr(e, "retry_after", 2)) + 1
-                    logging.warning(f"[POLL] rate-limited, wait {wait_s}s")
-                    await asyncio.sleep(wait_s)
-                except TimedOut:
-                    logging.warning("[POLL] timed out, retry brief sleep")
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    logging.error(f"[POLL] ❌ error to {cid}: {e}")
+        logging.info("[POLL] New full lock up to %d. Analyzing...", usable)
+        result = cached_lock_report(today, WORLD264_GAME, lock_size, usable,
+                                    lambda: analyze_day_incremental(state, all_results, usable, lock_size))
+        prime_result_cache(all_results.pairs(0, usable), lock_size, result)
 
+        # บันทึกว่าล็อคนี้ "กำลังส่ง" ก่อนส่งจริง: crash กลางทางแล้วรีสตาร์ทจะไม่ส่งซ้ำ
         state["last_processed_round_count"] = usable
-        save_state(today, state)
+        state["scheduler"] = poll_scheduler.to_dict()
+        targets = len(CHAT_IDS) if result else 0
+        if not state_store.begin_lock(today, lock_size, usable, all_results[usable - lock_size:usable],
+                                      result, targets, state, fence=leader.fence):
+            # ไม่ได้บันทึก (ถูก fence / SQLite พัง) → ยังไม่นับว่าทำล็อคนี้แล้ว
+            state["last_processed_round_count"] = last_processed_round_count
+            _retry_next_poll()
+            return
+
+        if result and CHAT_IDS:
+            logging.info("[POLL] Broadcasting analysis to %d chats...", len(CHAT_IDS))
+            live = state.setdefault("live", {}) if LIVE_MODE else None
+            deliveries = await broadcast_report(context.bot, result, live)
+            for d in deliveries:
+                if d.ok:
+                    logging.info("[POLL] ✅ %s %s (attempts=%d)", "edited" if d.edited else "sent", d.chat_id,
+                                 d.attempts, extra={"chat_id": d.chat_id})
+                else:
+                    logging.error("[POLL] ❌ error to %s: %s", d.chat_id, d.error, extra={"chat_id": d.chat_id})
+            state_store.finish_lock(today, lock_size, usable, deliveries)
+            if live is not None:
+                save_state(today, state)
     else:
         logging.info("[POLL] No new full lock to analyze.")
 
+async def poll_game(context: ContextTypes.DEFAULT_TYPE, today: date, state: dict,
+                    gid: str, game: GameDay, usable: int):
+    """เกมอื่นนอกจาก world264: state แยกต่อเกมใน state["games"][gid]
+
+    poller ตื่นตามจังหวะของ world264 — เกมที่ออกถี่กว่าอาจครบหลายล็อคระหว่าง poll
+    จึงส่งทุกล็อคที่ยังไม่ได้ส่งตามลำดับ (เกมที่เพิ่งเห็นครั้งแรกของวันเริ่มที่ล็อคล่าสุด
+    เหมือน world264 ตอนเริ่ม ไม่ไล่ส่งย้อนทั้งวัน)"""
+    games = state["games"]
+    if gid in games:
+        last = int(games[gid].get("last_processed_round_count", 0))
+        upto = list(range((last // lock_size + 1) * lock_size, usable + 1, lock_size))
+    else:
+        upto = [usable]
+    if len(upto) > 1:
+        logging.info("[POLL] game %s: catching up %d locks", gid, len(upto), extra={"game": gid})
+    for u in upto:
+        if not await poll_game_lock(context, today, state, gid, game, u):
+            return
+
+async def poll_game_lock(context: ContextTypes.DEFAULT_TYPE, today: date, state: dict,
+                         gid: str, game: GameDay, usable: int) -> bool:
+    """วิเคราะห์และส่งล็อคที่จบที่รอบ usable ของเกม gid — False = บันทึกไม่ได้ (poll หน้าลองใหม่)"""
+    gstate = state["games"].setdefault(gid, {"last_processed_round_count": 0})
+    logging.info("[POLL] game %s: new full lock up to %d (%d rounds)", gid, usable, len(game.results),
+                 extra={"game": gid, "rounds": len(game.results), "usable": usable})
+    result = analyze_day_incremental(gstate, game.results, usable, lock_size)
+    if result:
+        result = f"🎲 <b>เกม {gid}</b> (กลุ่ม {html.escape(game.key)})\n\n{result}"
+
+    last = gstate["last_processed_round_count"]
+    gstate["last_processed_round_count"] = usable
+    targets = len(CHAT_IDS) if result else 0
+    if not state_store.begin_lock(today, lock_size, usable, game.results[usable - lock_size:usable],
+                                  result, targets, state, game=gid, fence=leader.fence):
+        gstate["last_processed_round_count"] = last
+        _retry_next_poll()
+        return False
+
+    if result and CHAT_IDS:
+        live = gstate.setdefault("live", {}) if LIVE_MODE else None
+        deliveries = await broadcast_report(context.bot, result, live)
+        for d in deliveries:
+            if not d.ok:
+                logging.error("[POLL] ❌ game %s error to %s: %s", gid, d.chat_id, d.error,
+                              extra={"game": gid, "chat_id": d.chat_id})
+        state_store.finish_lock(today, lock_size, usable, deliveries, game=gid)
+        if live is not None:
+            save_state(today, state, game=gid)
+    return True
+
+async def poll_job(context: ContextTypes.DEFAULT_TYPE):
+    """รัน poll หนึ่งครั้ง แล้วนัดครั้งถัดไปตามที่ scheduler คำนวณ (แม้ poll จะพัง)"""
+    token = leader.token
+    if token is None or not leader.is_leader:
+        # standby (webhook ยังรับคำสั่งได้): ไม่ poll / ไม่ broadcast — เช็คใหม่ทุกรอบ heartbeat ของ lease
+        context.job_queue.run_once(poll_job, when=leader.renew, name="poll")
+        return
+    try:
+        # ทุกอย่างอยู่ใน try: takeover พัง (เช่น SQLite ถูกล็อคชั่วคราว) ต้องไม่ทำให้ job หายไปเงียบๆ —
+        # finally นัดรอบหน้าเสมอ แล้ว _active_token ที่ยังไม่ตรงจะพา takeover มาลองใหม่
+        if token != _active_token:
+            _take_over(token)
+        if poll_scheduler.next_due is not None:
+            metrics.POLL_LAG_SECONDS.observe(max(0.0, time.time() - poll_scheduler.next_due))
+        with metrics.POLL_SECONDS.time():
+            await poll_and_analyze(context)
+    finally:
+        t = metrics.boot_mark("first_poll")
+        if t is not None:
+            logging.info("[BOOT] first poll done %.1fs after start", t)
+        delay = poll_scheduler.next_delay(lock_size)
+        context.job_queue.run_once(poll_job, when=delay, name="poll")
+        logging.info("[POLL] next poll in %.0fs (cadence=%s)", delay, poll_scheduler.cadence())
+
+async def heartbeat_job(context: ContextTypes.DEFAULT_TYPE):
+    # poll อาจหลับนานกว่า HB_MAX_AGE — เติม heartbeat ตราบที่ poller ยังตื่นตามนัด
+    global LAST_HEARTBEAT
+    if poll_scheduler.on_track():
+        LAST_HEARTBEAT = time.time()
+
 # ──────────────────────────────────────────────────────────────────────
 # Entry
-def main():
-    logging.info("Booting Telegram bot…")
+# โหมดรับ update: webhook (Telegram POST มาที่ server.py บน loop ของ uvicorn)
+# หรือ polling (เธรดแยก, ทางสำรอง) — BOT_MODE=webhook|polling
+# ค่าเริ่มต้น: webhook ถ้ารู้ URL สาธารณะ (WEBHOOK_URL หรือ RENDER_EXTERNAL_URL ที่ Render ตั้งให้)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL") or ""
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# secret_token ที่ Telegram ส่งกลับมาใน header; ไม่ตั้งก็สร้างจาก token (คงที่ข้ามรีสตาร์ท)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_BASE_URL else "polling").lower()
+# poll แรกหลัง boot (วินาที) — warm_up() ทำให้ poll แรกถูก จึงไม่ต้องรอนาน
+FIRST_POLL_DELAY = float(os.getenv("FIRST_POLL_DELAY", "1"))
+# ปลายทาง Bot API: ค่าเริ่มต้น api.telegram.org — ชี้ไป Local Bot API Server หรือ Bot API ปลอมของ loadtest.py ได้
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+def webhook_url() -> str:
+    return WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH
+
+def build_application(mode: str = BOT_MODE) -> Application:
+    """สร้าง Application พร้อม handler/job ทั้งหมด
+    polling: main() เรียก run_polling เอง / webhook: server.py เป็นคน initialize/start และป้อน update"""
 
-    # ลบ webhook อัตโนมัติ กันชน/กัน pending updates
     async def _post_init(app: Application):
-        try:
-            await app.bot.delete_webhook(drop_pending_updates=True)
-            logging.info("[INIT] webhook removed (drop pending updates)")
-        except Exception as e:
-            logging.warning(f"[INIT] delete_webhook failed: {e}")
-
-    app = (
+        if mode == "webhook":
+            # ไม่ drop pending: update ที่ค้างระหว่าง redeploy จะถูกส่งมาให้ instance ใหม่
+            try:
+                await app.bot.set_webhook(
+                    url=webhook_url(),
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                logging.info("[INIT] webhook set to %s", webhook_url())
+            except Exception as e:
+                logging.error("[INIT] set_webhook failed: %s", e)
+        else:
+            # ลบ webhook อัตโนมัติ กันชน/กัน pending updates
+            try:
+                await app.bot.delete_webhook(drop_pending_updates=True)
+                logging.info("[INIT] webhook removed (drop pending updates)")
+            except Exception as e:
+                logging.warning("[INIT] delete_webhook failed: %s", e)
+        await day_fetcher.start()
+        t = metrics.boot_mark("telegram_started")
+        if t is not None:
+            logging.info("[BOOT] telegram %s ready %.1fs after start; phases=%s", mode, t, metrics.BOOT_TIMINGS)
+
+    async def _post_shutdown(app: Application):
+        await day_fetcher.aclose()
+        analysis_pool.shutdown()
+        state_store.close()
+
+    builder = (
         Application
         .builder()
         .token(TOKEN)
         .post_init(_post_init)   # สำคัญ
-        .build()
+        .post_shutdown(_post_shutdown)
     )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if mode == "webhook":
+        builder = builder.updater(None)   # update มาจาก server.py ไม่ต้องมี getUpdates
+    app = builder.build()
+
+    # /metrics (server.py) อ่านค่าสดตอน scrape
+    metrics.HANDLER_QUEUE.set_function(app.update_queue.qsize)
+    metrics.ANALYSIS_PENDING.set_function(lambda: analysis_pool.pending)
+    metrics.LAST_HEARTBEAT.set_function(lambda: LAST_HEARTBEAT)
+    metrics.LAST_BROADCAST.set_function(lambda: LAST_BROADCAST)
+    metrics.LOG_DROPPED.set_function(dropped_records)
 
     # Debug logger
     app.add_handler(MessageHandler(filters.ALL, update_logger), group=-1)
@@ -490,7 +875,9 @@ def main():
     job_queue = app.job_queue
     if not job_queue:
         raise RuntimeError("JobQueue not available. Install: pip install 'python-telegram-bot[job-queue]'")
-    job_queue.run_repeating(poll_and_analyze, interval=60, first=10)
+    poll_scheduler.next_due = time.time() + FIRST_POLL_DELAY
+    job_queue.run_once(poll_job, when=FIRST_POLL_DELAY, name="poll")
+    job_queue.run_repeating(heartbeat_job, interval=30, first=1)
 
     # Commands
     app.add_handler(CommandHandler("start", start))
@@ -498,13 +885,30 @@ def main():
     app.add_handler(CommandHandler("analyze", analyze_cmd))
     app.add_handler(CommandHandler("id", get_id))
     app.add_handler(CommandHandler("status", status_cmd))
+    app.add_handler(CommandHandler("report", report_cmd))
     app.add_handler(CommandHandler("ping", ping_cmd))
+    app.add_handler(CommandHandler("backtest", backtest_cmd, block=False))
+    app.add_handler(CommandHandler("compare", compare_cmd))
+    app.add_handler(CommandHandler("digits", digits_cmd))
 
     # Text handler
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message, block=False))
 
     # 👇 ลงทะเบียน error handler (แก้ปัญหา No error handlers are registered)
     app.add_error_handler(on_error)
+    return app
+
+def main():
+    logging.info("Booting Telegram bot…")
+    warm_up()
+    leader.start()
+    if not leader.wait(timeout=leader.renew * 2):
+        logging.info("[LEADER] standby: %s waiting for lease…", leader.holder)
+        leader.wait()
+    app = build_application("polling")
+    # เสีย lease → หยุด run_polling (server.py จะวนกลับมารอ lease ใหม่)
+    loop = asyncio.get_event_loop()
+    leader.on_lost = lambda: loop.call_soon_threadsafe(app.stop_running)
 
     logging.info("🤖 Bot is starting run_polling (thread mode)…")
     # รันในเธรด (จาก server.py) ปิด signal handler และทิ้งคิวเก่าทั้งหมด
@@ -513,6 +917,7 @@ def main():
         drop_pending_updates=True,
         allowed_updates=Update.ALL_TYPES,
     )
+    leader.on_lost = None
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+# broadcast.py — ส่งข้อความไปหลายกลุ่มพร้อมกันภายใต้ rate limit ของ Telegram
+import time
+import asyncio
+import logging
+from typing import Callable, NamedTuple
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest
+
+from metrics import SEND_SECONDS, DELIVERY_SECONDS, SEND_RETRIES, SEND_FAILURES, SENT
+
+# ขีดจำกัดของ Bot API: ~30 ข้อความ/วินาทีรวม, 1 ข้อความ/วินาทีต่อแชท,
+# และ 20 ข้อความ/นาทีต่อกลุ่ม
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST = 1.0, 1
+GROUP_CHAT_RATE, GROUP_CHAT_BURST = 20 / 60, 3
+
+BROADCAST_STATS = {
+    "sent": 0,
+    "retries": 0,
+    "failed": 0,
+    "edited": 0,        # โหมด live: แก้ข้อความเดิมแทนส่งใหม่
+    "edit_fallback": 0, # แก้ไม่ได้ (ข้อความถูกลบ ฯลฯ) → ส่งใหม่แทน
+    "unchanged": 0,     # โหมด live: รายงานเหมือนที่แชทเห็นอยู่ ไม่เรียก API (นับโดย bot.broadcast_report)
+}
+
+class TokenBucket:
+    """token bucket แบบจองคิว: reserve() หักโทเคนทันที (ติดลบได้) แล้วคืนเวลาที่ต้องรอ
+    ผู้มาก่อนได้ก่อนเสมอ และไม่ต้องใช้ asyncio.Lock (ใช้ข้าม event loop ได้)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        self._tokens -= 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(wait, self._blocked_until - now)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """ห้ามส่งอีก seconds วินาที (เช่นหลังโดน RetryAfter)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class DeliveryResult(NamedTuple):
+    chat_id: str
+    ok: bool
+    attempts: int
+    error: str | None = None
+    message_id: int | None = None
+    edited: bool = False
+
+def _not_modified(e: BadRequest) -> bool:
+    """edit ด้วยข้อความเดิมทุกไบต์ — Telegram ตอบ BadRequest แต่ข้อความในแชทถูกต้องอยู่แล้ว"""
+    return "message is not modified" in str(e).lower()
+
+class Broadcaster:
+    """กระจายข้อความไปทุกแชทพร้อมกัน: แต่ละแชทรอ token ของตัวเอง + token รวม
+    RetryAfter → รอตามที่ Telegram บอกแล้วส่งใหม่, TimedOut/NetworkError → backoff แล้วส่งใหม่
+    Forbidden/BadRequest → เลิก (ส่งซ้ำก็ไม่ผ่าน)
+
+    edit={chat_id: message_id} — แชทที่มีใน dict จะ edit_message_text ข้อความนั้นแทนการส่งใหม่
+    (ใช้ rate limit ชุดเดียวกัน); edit ไม่ได้ด้วย BadRequest อื่น → ส่งเป็นข้อความใหม่ในรอบถัดไป"""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, max_attempts: int = 5,
+                 on_sent: Callable[[str], None] | None = None):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.max_attempts = max_attempts
+        self.on_sent = on_sent
+        self._chat_buckets: dict[str, TokenBucket] = {}
+
+    def _bucket_for(self, chat_id: str) -> TokenBucket:
+        b = self._chat_buckets.get(chat_id)
+        if b is None:
+            if str(chat_id).startswith("-"):
+                b = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            else:
+                b = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            self._chat_buckets[chat_id] = b
+        return b
+
+    async def send_all(self, bot, chat_ids: list[str], text: str, edit: dict[str, int] | None = None,
+                       **kwargs) -> list[DeliveryResult]:
+        edit = edit or {}
+        return list(await asyncio.gather(*(self.send(bot, cid, text, edit.get(cid), **kwargs) for cid in chat_ids)))
+
+    async def send(self, bot, chat_id: str, text: str, edit_message_id: int | None = None,
+                   **kwargs) -> DeliveryResult:
+        started = time.perf_counter()
+        result = await self._send(bot, chat_id, text, edit_message_id, **kwargs)
+        DELIVERY_SECONDS.observe(time.perf_counter() - started, chat_id=chat_id)
+        if result.ok:
+            SENT.inc(chat_id=chat_id)
+        else:
+            SEND_FAILURES.inc(chat_id=chat_id)
+        return result
+
+    async def _send(self, bot, chat_id: str, text: str, edit_message_id: int | None = None,
+                    **kwargs) -> DeliveryResult:
+        chat_bucket = self._bucket_for(chat_id)
+        backoff = 1.0
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                if edit_message_id is not None:
+                    msg = await bot.edit_message_text(text=text, chat_id=chat_id, message_id=edit_message_id, **kwargs)
+                else:
+                    msg = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                ra = getattr(e, "retry_after", 2) or 2
+                wait_s = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+                chat_bucket.pause(wait_s + 0.5)
+                error = f"RetryAfter {wait_s:.0f}s"
+                logging.warning("[BROADCAST] %s rate-limited, retry in %.0fs", chat_id, wait_s)
+            except BadRequest as e:
+                if edit_message_id is not None:
+                    if _not_modified(e):
+                        BROADCAST_STATS["edited"] += 1
+                        return DeliveryResult(chat_id, True, attempt, None, edit_message_id, True)
+                    # ข้อความเดิมถูกลบ / แก้ไม่ได้แล้ว → ส่งใหม่
+                    BROADCAST_STATS["edit_fallback"] += 1
+                    logging.warning("[BROADCAST] %s cannot edit message %s (%s), sending new",
+                                    chat_id, edit_message_id, e)
+                    edit_message_id = None
+                    error = f"{type(e).__name__}: {e}"
+                    continue
+                # BadRequest เป็น subclass ของ NetworkError แต่ส่งซ้ำก็ไม่ผ่าน
+                BROADCAST_STATS["failed"] += 1
+                logging.error("[BROADCAST_ERR] %s: %s", chat_id, e)
+                return DeliveryResult(chat_id, False, attempt, f"{type(e).__name__}: {e}")
+            except (TimedOut, NetworkError) as e:
+                chat_bucket.pause(backoff)
+                backoff *= 2
+                error = f"{type(e).__name__}: {e}"
+                logging.warning("[BROADCAST] %s %s, retrying", chat_id, error)
+            except Exception as e:
+                # Forbidden (ถูกเตะออกจากกลุ่ม) ฯลฯ
+                BROADCAST_STATS["failed"] += 1
+                logging.error("[BROADCAST_ERR] %s: %s", chat_id, e)
+                return DeliveryResult(chat_id, False, attempt, f"{type(e).__name__}: {e}")
+            else:
+                edited = edit_message_id is not None
+                BROADCAST_STATS["edited" if edited else "sent"] += 1
+                if self.on_sent:
+                    self.on_sent(chat_id)
+                return DeliveryResult(chat_id, True, attempt, None,
+                                      getattr(msg, "message_id", edit_message_id), edited)
+            finally:
+                SEND_SECONDS.observe(time.perf_counter() - t0, chat_id=chat_id)
+            if attempt < self.max_attempts:
+                BROADCAST_STATS["retries"] += 1
+                SEND_RETRIES.inc(chat_id=chat_id, reason=error.split(" ", 1)[0].rstrip(":"))
+
+        BROADCAST_STATS["failed"] += 1
+        logging.error("[BROADCAST_ERR] %s: giving up after %s attempts (%s)", chat_id, self.max_attempts, error)
+        return DeliveryResult(chat_id, False, self.max_attempts, error)
@@ -0,0 +1,402 @@
+# dayparse.py — แยกผล world264 (lotto_type 01 / subtype 22) ออกจากไฟล์รายวัน
+import re
+import json
+import codecs
+from typing import NamedTuple
+
+WORLD264_TYPE = ("01", "22")
+FALLBACK_KEY = "0122"
+
+def game_id(lotto_type: str, lotto_subtype: str) -> str:
+    return f"{lotto_type}-{lotto_subtype}"
+
+WORLD264_GAME = game_id(*WORLD264_TYPE)
+
+# เลขรอบต้องใส่ array("H") ของ rounds.RoundArchive ได้
+MAX_ROUND = 0xFFFF
+
+def is_ascii_digits(s, n: int) -> bool:
+    """str ยาว n ตัวที่เป็น 0-9 ล้วน (str.isdigit() ยอมรับเลขไทย/ยูนิโค้ดอย่าง '๑๒๓' ด้วย)"""
+    return isinstance(s, str) and len(s) == n and all("0" <= c <= "9" for c in s)
+
+# ──────────────────────────────────────────────────────────────────────
+# ทางเดิม: ทำงานกับเอกสารที่ decode ทั้งก้อนแล้ว
+def pick_world264_key(day_data: dict) -> str | None:
+    best_key = None
+    best_len = -1
+    for gk, rounds in (day_data or {}).items():
+        if not isinstance(rounds, dict) or not rounds:
+            continue
+        sample = next(iter(rounds.values()), {})
+        if sample.get("lotto_type") == "01" and sample.get("lotto_subtype") == "22":
+            l = len(rounds)
+            if l > best_len:
+                best_key, best_len = gk, l
+    if best_key:
+        return best_key
+    return "0122" if day_data and "0122" in day_data else None
+
+def _round_num(v) -> int:
+    try:
+        return int(v.get("round_number", 0))
+    except Exception:
+        return 0
+
+def _compact(rec: dict) -> dict | None:
+    res = rec.get("result") or {}
+    top3 = res.get("top_three")
+    bottom2 = res.get("bottom_two")
+    if is_ascii_digits(top3, 3) and is_ascii_digits(bottom2, 2):
+        round_no = _round_num(rec)
+        if 0 <= round_no <= MAX_ROUND:
+            return {"round": round_no, "top3": top3, "bottom2": bottom2}
+    return None
+
+def extract_all_results_sorted(day_data: dict, world_key: str) -> list[dict]:
+    world_data = day_data.get(world_key)
+    if not isinstance(world_data, dict):
+        return []
+
+    all_records = sorted(
+        [v for v in world_data.values() if isinstance(v, dict)],
+        key=_round_num
+    )
+
+    results_list = []
+    for rec in all_records:
+        row = _compact(rec)
+        if row:
+            results_list.append(row)
+    return results_list
+
+class GameDay(NamedTuple):
+    key: str                 # group key ในไฟล์
+    lotto_type: str
+    lotto_subtype: str
+    results: list[dict]
+
+def extract_games(day_data: dict) -> dict[str, GameDay]:
+    """ทุกเกมในไฟล์: game id ("01-22") -> กลุ่มที่มีรอบมากที่สุดของ lotto_type/subtype นั้น
+    (กติกาเดียวกับ pick_world264_key แต่ใช้กับทุกเกม)"""
+    best: dict[str, tuple[int, str, str, str]] = {}
+    for gk, rounds in (day_data or {}).items():
+        if not isinstance(rounds, dict) or not rounds:
+            continue
+        sample = next(iter(rounds.values()), {})
+        if not isinstance(sample, dict):
+            continue
+        t, st = sample.get("lotto_type"), sample.get("lotto_subtype")
+        if not isinstance(t, str) or not isinstance(st, str):
+            continue
+        gid = game_id(t, st)
+        if gid not in best or len(rounds) > best[gid][0]:
+            best[gid] = (len(rounds), gk, t, st)
+    return {
+        gid: GameDay(gk, t, st, extract_all_results_sorted(day_data, gk))
+        for gid, (_, gk, t, st) in best.items()
+    }
+
+# ──────────────────────────────────────────────────────────────────────
+# Streaming: อ่านทีละ chunk, decode ทีละ "รอบ" แล้วเก็บไว้แค่ 3 field
+class World264Day(NamedTuple):
+    key: str | None
+    results: list[dict]      # เหมือน extract_all_results_sorted(day_data, key)
+
+class _NeedMore(Exception):
+    pass
+
+_WS = re.compile(r"[ \t\n\r]*")
+_WS_CHARS = " \t\n\r"
+
+class World264StreamParser:
+    """Parser แบบ push: feed(bytes) ไปเรื่อยๆ แล้ว close() ได้ World264Day
+
+    หน่วยความจำที่ใช้ = buffer ของรอบที่กำลังอ่าน + แถวสั้นๆ ของกลุ่มที่เข้าเกณฑ์
+    (กลุ่มที่ดีที่สุดตอนนี้ และกลุ่มที่กำลังอ่าน) — ไม่สร้าง dict ของทั้งเอกสาร
+    ผลเหมือน pick_world264_key + extract_all_results_sorted บนเอกสารเดียวกัน
+    """
+
+    _COMPACT_AT = 1 << 16
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._final = False
+        self._state = "doc"
+        # กลุ่มที่กำลังอ่าน
+        self._gkey = None
+        self._g_len = 0
+        self._g_keep = False
+        self._g_qualifies = False
+        self._g_rows: list = []
+        # ผลที่ดีที่สุด
+        self._best_key = None
+        self._best_len = -1
+        self._best_rows: list = []
+        self._fallback_rows: list | None = None
+        self._fallback_seen = False
+
+    # ── input ──
+    def feed(self, chunk: bytes):
+        self._buf += self._decoder.decode(chunk)
+        self._run()
+
+    def close(self) -> World264Day:
+        self._buf += self._decoder.decode(b"", final=True)
+        self._final = True
+        self._run()
+        if self._state != "done":
+            raise ValueError("truncated or malformed day file")
+        if self._buf[self._pos:].strip(_WS_CHARS):
+            # มีอะไรต่อท้ายเอกสาร — json.loads ก็ไม่ยอม ("Extra data")
+            raise ValueError(f"extra data after day file at offset {self._pos}")
+        return self.result()
+
+    def result(self) -> World264Day:
+        if self._best_key:
+            key, rows = self._best_key, self._best_rows
+        elif self._fallback_seen:
+            key, rows = FALLBACK_KEY, self._fallback_rows or []
+        else:
+            return World264Day(None, [])
+        rows.sort(key=lambda r: r[0])
+        return World264Day(key, [r[1] for r in rows])
+
+    # ── tokenizer helpers ──
+    def _skip_ws(self):
+        buf, pos, n = self._buf, self._pos, len(self._buf)
+        while pos < n and buf[pos] in " \t\r\n":
+            pos += 1
+        self._pos = pos
+        if pos >= n:
+            raise _NeedMore
+
+    def _peek(self) -> str:
+        self._skip_ws()
+        return self._buf[self._pos]
+
+    def _expect(self, ch: str):
+        if self._peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {self._pos}")
+        self._pos += 1
+
+    def _value(self):
+        self._skip_ws()
+        try:
+            val, end = self._json.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if self._final:
+                raise
+            raise _NeedMore
+        # ค่าที่ชนขอบ buffer (เช่นตัวเลข) อาจยังอ่านไม่จบ
+        if end >= len(self._buf) and not self._final:
+            raise _NeedMore
+        self._pos = end
+        return val
+
+    # ── state machine ──
+    def _run(self):
+        while self._state != "done":
+            mark = self._pos
+            try:
+                if self._step() is False:
+                    break
+            except _NeedMore:
+                self._pos = mark
+                break
+        if self._pos > self._COMPACT_AT:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+    def _step(self):
+        st = self._state
+        if st == "doc":
+            if self._peek() != "{":
+                self._value()          # เอกสารไม่ใช่ object → ไม่มีกลุ่มใดเลย
+                self._state = "done"
+                return
+            self._pos += 1
+            self._state = "group_key_or_end"
+        elif st == "group_key_or_end":
+            if self._peek() == "}":
+                self._pos += 1
+                self._state = "done"
+                return
+            self._state = "group_key"
+        elif st == "group_key":
+            self._gkey = self._value()
+            self._expect(":")
+            self._state = "group_value"
+        elif st == "group_value":
+            if self._peek() != "{":
+                self._value()
+                self._end_group(is_dict=False)
+                self._state = "group_sep"
+                return
+            self._pos += 1
+            self._g_len = 0
+            self._g_keep = False
+            self._g_rows = []
+            self._state = "round_key_or_end"
+        elif st == "round_key_or_end":
+            if self._peek() == "}":
+                self._pos += 1
+                self._end_group(is_dict=True)
+                self._state = "group_sep"
+                return
+            self._state = "rounds"
+        elif st == "rounds":
+            return self._rounds()
+        elif st == "group_sep":
+            ch = self._peek()
+            self._pos += 1
+            if ch == ",":
+                self._state = "group_key"
+            elif ch == "}":
+                self._state = "done"
+            else:
+                raise ValueError(f"unexpected {ch!r} at offset {self._pos - 1}")
+
+    def _rounds(self) -> bool:
+        """อ่าน `"key": {...},` ต่อกันให้มากที่สุดใน buffer ด้วยลูปเดียว
+        คืน False เมื่อข้อมูลหมดกลางรอบ (_pos ค้างไว้ที่ต้นรอบนั้น)"""
+        buf, ws, decode = self._buf, _WS.match, self._json.raw_decode
+        pos = self._pos
+        while True:
+            try:
+                p = pos if buf[pos] not in _WS_CHARS else ws(buf, pos).end()
+                _, p = decode(buf, p)
+                if buf[p] != ":":
+                    p = ws(buf, p).end()
+                    if buf[p] != ":":
+                        raise ValueError(f"expected ':' at offset {p}")
+                p += 1
+                if buf[p] in _WS_CHARS:
+                    p = ws(buf, p).end()
+                rec, p = decode(buf, p)
+                sep = buf[p]
+                if sep in _WS_CHARS:
+                    p = ws(buf, p).end()
+                    sep = buf[p]
+            except (json.JSONDecodeError, IndexError):
+                if self._final:
+                    raise ValueError(f"truncated or malformed round at offset {pos}")
+                self._pos = pos
+                return False
+            if self._g_keep or not self._g_len:
+                self._on_round(rec)
+            else:
+                self._g_len += 1
+            pos = p + 1
+            if sep == "}":
+                self._pos = pos
+                self._end_group(is_dict=True)
+                self._state = "group_sep"
+                return True
+            if sep != ",":
+                raise ValueError(f"unexpected {sep!r} at offset {p}")
+
+    def _on_round(self, rec):
+        if self._g_len == 0:
+            sample = rec if isinstance(rec, dict) else {}
+            qualifies = (sample.get("lotto_type"), sample.get("lotto_subtype")) == WORLD264_TYPE
+            self._g_qualifies = qualifies
+            # กลุ่ม "0122" เก็บไว้เผื่อไม่มีกลุ่มใดเข้าเกณฑ์เลย
+            self._g_keep = qualifies or (self._gkey == FALLBACK_KEY and not self._best_key)
+        self._g_len += 1
+        if self._g_keep and isinstance(rec, dict):
+            row = _compact(rec)
+            if row:
+                # (sort key, row) — sort แบบ stable ตามลำดับในไฟล์เหมือนทางเดิม
+                self._g_rows.append((_round_num(rec), row))
+
+    def _end_group(self, is_dict: bool):
+        if self._gkey == FALLBACK_KEY:
+            self._fallback_seen = True
+            self._fallback_rows = self._g_rows if is_dict else []
+        if is_dict and self._g_len and self._g_qualifies and self._g_len > self._best_len:
+            self._best_key, self._best_len, self._best_rows = self._gkey, self._g_len, self._g_rows
+            self._fallback_rows = None
+        self._g_rows = []
+        self._g_len = 0
+        self._g_qualifies = False
+
+class DayGames(NamedTuple):
+    key: str | None          # world264 เหมือน World264Day (โค้ดเดิมใช้ .key/.results ได้ตามเดิม)
+    results: list[dict]
+    games: dict[str, GameDay]   # เหมือน extract_games(เอกสารทั้งก้อน)
+
+class GamesStreamParser(World264StreamParser):
+    """เหมือน World264StreamParser แต่เก็บแถวของทุกกลุ่ม แล้วเลือกกลุ่มใหญ่สุดต่อเกม
+    decode ไฟล์ครั้งเดียวได้ทุกเกม (close() คืน DayGames)"""
+
+    def __init__(self):
+        super().__init__()
+        self._g_type = None
+        # game id -> (จำนวน record, group key, type, subtype, rows)
+        self._games: dict[str, tuple[int, str, str, str, list]] = {}
+
+    def _on_round(self, rec):
+        first = self._g_len == 0
+        if first:
+            sample = rec if isinstance(rec, dict) else {}
+            t, st = sample.get("lotto_type"), sample.get("lotto_subtype")
+            self._g_type = (t, st) if isinstance(t, str) and isinstance(st, str) else None
+        super()._on_round(rec)
+        if first and not self._g_keep:
+            # กลุ่มที่ world264 ไม่สนใจ: เก็บแถวเองตั้งแต่รอบแรก
+            self._g_keep = True
+            if isinstance(rec, dict):
+                row = _compact(rec)
+                if row:
+                    self._g_rows.append((_round_num(rec), row))
+
+    def _end_group(self, is_dict: bool):
+        if is_dict and self._g_len and self._g_type is not None:
+            gid = game_id(*self._g_type)
+            cur = self._games.get(gid)
+            if cur is None or self._g_len > cur[0]:
+                self._games[gid] = (self._g_len, self._gkey, *self._g_type, self._g_rows)
+        self._g_type = None
+        super()._end_group(is_dict)
+
+    def result(self) -> DayGames:
+        w = super().result()
+        games = {}
+        for gid, (_, gk, t, st, rows) in self._games.items():
+            ordered = sorted(rows, key=lambda r: r[0])
+            games[gid] = GameDay(gk, t, st, [r[1] for r in ordered])
+        return DayGames(w.key, w.results, games)
+
+def parse_world264(data: bytes) -> World264Day:
+    p = World264StreamParser()
+    p.feed(data)
+    return p.close()
+
+def parse_games(data: bytes) -> DayGames:
+    p = GamesStreamParser()
+    p.feed(data)
+    return p.close()
+
+# ──────────────────────────────────────────────────────────────────────
+# snapshot (state.py เก็บ DayGames ล่าสุดไว้ warm-up หลังรีสตาร์ท) — แถวเป็น [round, top3, bottom2]
+def _pack_rows(rows: list[dict]) -> list[list]:
+    return [[r["round"], r["top3"], r["bottom2"]] for r in rows]
+
+def _unpack_rows(rows: list[list]) -> list[dict]:
+    return [{"round": rnd, "top3": top3, "bottom2": bottom2} for rnd, top3, bottom2 in rows]
+
+def day_games_to_dict(day: DayGames) -> dict:
+    return {
+        "key": day.key,
+        "rows": _pack_rows(day.results),
+        "games": {gid: [g.key, g.lotto_type, g.lotto_subtype, _pack_rows(g.results)]
+                  for gid, g in day.games.items()},
+    }
+
+def day_games_from_dict(doc: dict) -> DayGames:
+    return DayGames(doc["key"], _unpack_rows(doc["rows"]), {
+        gid: GameDay(gk, t, st, _unpack_rows(rows)) for gid, (gk, t, st, rows) in doc["games"].items()
+    })
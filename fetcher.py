@@ -0,0 +1,152 @@
+# fetcher.py — ดึงไฟล์ผลรายวันจาก S3 ด้วย client เดียวตลอดอายุบอท
+import os
+import json
+import time
+import logging
+from datetime import date
+from typing import NamedTuple
+
+import httpx
+
+from metrics import FETCH_SECONDS, FETCH_BYTES, FETCH_RESPONSES, DECODE_SECONDS
+
+BASE_URL = os.getenv(
+    "LOTTO_BASE_URL",
+    "https://ltx-s3-prod.s3.ap-southeast-1.amazonaws.com/lotto-result-list/{d}.json",
+)
+
+# ตัวนับสะสม (แสดงใน /status)
+FETCH_STATS = {
+    "requests": 0,
+    "ok": 0,
+    "not_modified": 0,   # cache hit (304)
+    "errors": 0,
+    "bytes": 0,
+}
+
+class DayFetch(NamedTuple):
+    status: int | None      # HTTP status หรือ None ถ้าเชื่อมต่อไม่ได้
+    data: object | None     # ผลจาก parser (หรือ dict ทั้งเอกสาร), จาก cache ถ้า 304
+    changed: bool           # False = ไม่มีอะไรใหม่ ไม่ต้องวิเคราะห์ซ้ำ
+    etag: str | None = None
+    last_modified: str | None = None
+
+class DayFetcher:
+    """ดึงไฟล์รายวันด้วย httpx.AsyncClient ตัวเดียว (keep-alive / HTTP/2)
+    พร้อม revalidate ด้วย ETag / Last-Modified — ได้ 304 ก็ไม่ต้อง decode JSON ใหม่
+
+    parser_factory: คลาสที่มี feed(bytes)/close() (เช่น dayparse.World264StreamParser)
+    จะ parse ไปพร้อมกับที่ body ไหลเข้ามา; ถ้าเป็น None จะ decode JSON ทั้งก้อน
+
+    stats: dict ตัวนับของ fetcher นี้ (ค่าเริ่มต้น FETCH_STATS ของ poller ที่ /status แสดง)
+    observe_metrics=False: ไม่นับเข้า metrics ของ Prometheus (เช่น fetcher ของ backtest)"""
+
+    MAX_CACHED_DAYS = 3
+
+    def __init__(self, base_url: str = BASE_URL, timeout: float = 15, http2: bool = True,
+                 parser_factory=None, stats: dict | None = None, observe_metrics: bool = True):
+        self.base_url = base_url
+        self.stats = FETCH_STATS if stats is None else stats
+        self.observe_metrics = observe_metrics
+        self.parser_factory = parser_factory
+        self.timeout = timeout
+        self.http2 = http2
+        self._client: httpx.AsyncClient | None = None
+        # url -> (etag, last_modified, data)
+        self._cache: dict[str, tuple[str | None, str | None, object]] = {}
+
+    def url_for(self, d: date) -> str:
+        return self.base_url.format(d=d.strftime("%Y-%m-%d"))
+
+    async def start(self):
+        if self._client is not None:
+            return
+        limits = httpx.Limits(max_keepalive_connections=4, keepalive_expiry=120)
+        try:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, follow_redirects=True, limits=limits, http2=self.http2,
+            )
+        except ImportError:
+            # ไม่มีแพ็กเกจ h2 → ใช้ HTTP/1.1 keep-alive แทน
+            logging.warning("[FETCH] h2 not installed; falling back to HTTP/1.1")
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True, limits=limits)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, d: date) -> DayFetch:
+        if self._client is None:
+            await self.start()
+        url = self.url_for(d)
+        cached = self._cache.get(url)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        self.stats["requests"] += 1
+        started = time.perf_counter()
+        try:
+            async with self._client.stream("GET", url, headers=headers) as r:
+                if r.status_code == 304 and cached:
+                    self.stats["not_modified"] += 1
+                    self.stats["bytes"] += r.num_bytes_downloaded
+                    self._observe("304", started, r.num_bytes_downloaded)
+                    return DayFetch(304, cached[2], False)
+                if r.status_code == 200:
+                    data = await self._parse(r)
+                    self.stats["ok"] += 1
+                    self.stats["bytes"] += r.num_bytes_downloaded
+                    self._observe("200", started, r.num_bytes_downloaded)
+                    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+                    self._remember(url, etag, last_modified, data)
+                    return DayFetch(200, data, True, etag, last_modified)
+            self.stats["errors"] += 1
+            self._observe(str(r.status_code), started, r.num_bytes_downloaded)
+            logging.warning("[FETCH] %s -> %s", url, r.status_code)
+            return DayFetch(r.status_code, None, False)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self._observe("error", started, 0)
+            logging.error("[FETCH_ERROR] Failed to fetch %s: %s", url, e)
+            return DayFetch(None, None, False)
+
+    def _observe(self, status: str, started: float, nbytes: int):
+        if not self.observe_metrics:
+            return
+        FETCH_SECONDS.observe(time.perf_counter() - started, status=status)
+        FETCH_BYTES.observe(nbytes)
+        FETCH_RESPONSES.inc(status=status)
+
+    async def _parse(self, r: httpx.Response):
+        # นับเฉพาะเวลา CPU ที่ใช้ decode (ไม่รวมเวลารอ network ระหว่าง chunk)
+        if self.parser_factory is None:
+            body = await r.aread()
+            with DECODE_SECONDS.time():
+                return json.loads(body)
+        parser = self.parser_factory()
+        spent = 0.0
+        async for chunk in r.aiter_bytes():
+            t0 = time.perf_counter()
+            parser.feed(chunk)
+            spent += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        data = parser.close()
+        DECODE_SECONDS.observe(spent + time.perf_counter() - t0)
+        return data
+
+    def seed(self, d: date, etag: str | None, last_modified: str | None, data):
+        """ใส่ของที่เคยดึงไว้ (เช่น snapshot จากดิสก์) — fetch ครั้งแรกหลังรีสตาร์ทจะได้ 304 ถ้าไม่เปลี่ยน"""
+        self._remember(self.url_for(d), etag, last_modified, data)
+
+    def _remember(self, url: str, etag: str | None, last_modified: str | None, data):
+        self._cache.pop(url, None)
+        if etag or last_modified:
+            self._cache[url] = (etag, last_modified, data)
+        while len(self._cache) > self.MAX_CACHED_DAYS:
+            self._cache.pop(next(iter(self._cache)))
@@ -0,0 +1,193 @@
+# lease.py — เลือก instance เดียวที่ poll Telegram / S3 และ broadcast (ตอน deploy ซ้อนกัน)
+#
+# lease อยู่ในไฟล์ SQLite เดียวกับ state (STATE_DIR ต้องแชร์กันระหว่าง instance)
+# - leader ต่ออายุทุก renew วินาที; หมดอายุ (ttl) แล้ว standby ยึดต่อได้
+# - ปิดแบบปกติจะ release ทันที → standby รับช่วงภายใน renew วินาที
+# - fencing token เพิ่มทุกครั้งที่เปลี่ยนเจ้าของ: StateStore.begin_lock ตรวจ token ใน transaction
+#   เดียวกับที่บันทึกล็อค leader เก่าที่ค้าง (GC pause / เครื่องช้า) จึงส่งซ้ำไม่ได้
+import os
+import time
+import uuid
+import atexit
+import socket
+import sqlite3
+import logging
+import threading
+
+LEASE_TTL = float(os.getenv("LEASE_TTL", "10"))
+LEASE_RENEW = float(os.getenv("LEASE_RENEW", "2"))
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leader_lease (
+    name    TEXT PRIMARY KEY,
+    holder  TEXT NOT NULL,
+    token   INTEGER NOT NULL,     -- fencing token: +1 ทุกครั้งที่เปลี่ยนเจ้าของ
+    expires REAL NOT NULL,        -- time.time()
+    updated REAL NOT NULL
+);
+"""
+
+def token_is_current(db: sqlite3.Connection, name: str, token: int) -> bool:
+    """ใช้ภายใน transaction ของผู้เรียก — True ถ้ายังไม่มีใครยึด lease ต่อจาก token นี้"""
+    row = db.execute("SELECT token FROM leader_lease WHERE name = ?", (name,)).fetchone()
+    return row is not None and row[0] == token
+
+class Lease:
+    """lease แบบ heartbeat ในเธรดพื้นหลัง
+
+    is_leader   — ถือ lease อยู่และยังไม่หมดอายุตามนาฬิกาของเราเอง
+    fence       — (name, token) ส่งให้ StateStore.begin_lock
+    wait()      — บล็อกจนได้เป็น leader (ใช้ก่อน run_polling)
+    on_acquired / on_lost — callback (เรียกจากเธรดของ lease)
+    """
+
+    def __init__(self, path: str, name: str = "bot", ttl: float = LEASE_TTL, renew: float = LEASE_RENEW,
+                 holder: str | None = None):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.renew = renew
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.token: int | None = None
+        self.on_acquired = None
+        self.on_lost = None
+        self.stats = {"acquired": 0, "lost": 0, "errors": 0}
+        self._valid_until = 0.0          # time.monotonic()
+        self._held = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._conn: sqlite3.Connection | None = None
+        self._atexit = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    @property
+    def fence(self) -> tuple[str, int]:
+        return self.name, (self.token if self.is_leader else 0)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leader-lease", daemon=True)
+        self._thread.start()
+        if not self._atexit:
+            # start() ถูกเรียกซ้ำได้ (server.run_bot เรียก bot.main() ใหม่หลังเสีย lease) — ลงทะเบียนครั้งเดียว
+            atexit.register(self.release)
+            self._atexit = True
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._held.wait(timeout)
+
+    def release(self):
+        """หยุด heartbeat แล้วคืน lease ทันที (standby ไม่ต้องรอ ttl)"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.renew + 1)
+        if self.token is not None:
+            try:
+                self._db.execute("UPDATE leader_lease SET expires = 0, updated = ? WHERE name = ? AND holder = ?",
+                                 (time.time(), self.name, self.holder))
+                logging.info("[LEADER] released lease %s (token %s)", self.name, self.token)
+            except sqlite3.Error as e:
+                logging.warning("[LEADER] release failed: %s", e)
+            self._lose()
+
+    # ── ภายใน ──
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=self.renew)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(LEASE_SCHEMA)
+            self._conn = db
+        return self._conn
+
+    def _try_acquire(self) -> int | None:
+        """คืน token ถ้าได้/ต่ออายุ lease, 0 ถ้าคนอื่นถืออยู่, None ถ้า SQLite มีปัญหา"""
+        now = time.time()
+        db = self._db
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT holder, token, expires FROM leader_lease WHERE name = ?",
+                             (self.name,)).fetchone()
+            if row is None:
+                token = 1
+            elif row[0] == self.holder:
+                token = row[1]
+            elif row[2] > now:
+                db.execute("COMMIT")
+                return 0
+            else:
+                token = row[1] + 1
+            db.execute("INSERT OR REPLACE INTO leader_lease (name, holder, token, expires, updated) "
+                       "VALUES (?, ?, ?, ?, ?)", (self.name, self.holder, token, now + self.ttl, now))
+            db.execute("COMMIT")
+            return token
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            self.stats["errors"] += 1
+            logging.warning("[LEADER] lease %s heartbeat failed: %s", self.name, e)
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            token = self._try_acquire()
+            if token:
+                was_leader = self.token is not None
+                # เผื่อหนึ่งรอบ renew: ถือว่าหมดก่อนที่ standby จะเห็นว่าหมดจริง
+                self._valid_until = started + self.ttl - self.renew
+                self.token = token
+                if not was_leader:
+                    self.stats["acquired"] += 1
+                    logging.info("[LEADER] %s is leader of %s (token %s)", self.holder, self.name, token)
+                    self._held.set()
+                    self._callback(self.on_acquired)
+            elif self.token is not None and (token == 0 or time.monotonic() >= self._valid_until):
+                logging.warning("[LEADER] %s lost lease %s (token %s)", self.holder, self.name, self.token)
+                self._lose()
+            self._stop.wait(self.renew)
+
+    def _lose(self):
+        if self.token is None:
+            return
+        self.token = None
+        self._valid_until = 0.0
+        self._held.clear()
+        self.stats["lost"] += 1
+        self._callback(self.on_lost)
+
+    @staticmethod
+    def _callback(fn):
+        if fn is None:
+            return
+        try:
+            fn()
+        except Exception:
+            logging.exception("[LEADER] callback failed")
+
+if __name__ == "__main__":
+    # ทดสอบในเครื่อง: เปิดสองเทอร์มินัลด้วย STATE_DIR เดียวกัน แล้ว Ctrl-C / kill -9 ตัวที่เป็น leader
+    #   STATE_DIR=/tmp/lease-test python lease.py
+    import signal
+    from state import StateStore
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    signal.signal(signal.SIGTERM, lambda *_: exit(0))
+    lease = Lease(StateStore(os.environ.get("STATE_DIR", "/tmp")).path)
+    lease.start()
+    try:
+        while True:
+            logging.info("%s: %s token=%s", lease.holder, "leader" if lease.is_leader else "standby", lease.token)
+            time.sleep(lease.renew)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,512 @@
+# loadtest.py — โหลดเทสต์ครบวงแบบ offline: S3 ปลอม → poll → วิเคราะห์ → broadcast → Bot API ปลอม
+#
+#   python loadtest.py                 # 200 แชท, 24 รอบ, เร็วกว่าจริง 60 เท่า (~2 นาที)
+#   python loadtest.py --quick         # ชุดเล็กสำหรับ CI (~20 วินาที)
+#   python loadtest.py --chats 500 --flood 2000 --retry-after-rate 0.05 --json loadtest.json
+#   python loadtest.py --quick --live  # BROADCAST_MODE=live: edit ข้อความเดิมของแต่ละแชทแทนส่งใหม่
+#
+# - S3 ปลอม: ไฟล์รายวันที่ "ออกผล" ทีละรอบตามนาฬิกาเร่ง ตอบ 304 ตาม ETag เหมือน S3
+# - Bot API ปลอม: บันทึกทุก sendMessage, สุ่มตอบ 429 (RetryAfter) และค้างนานเกิน read timeout (TimedOut)
+#   request ที่ค้างถือว่าถึงปลายทางแล้ว (แบบ Telegram จริง) → retry หลัง timeout ซ้ำได้ จึงนับแยกไว้
+#   editMessageText ด้วยข้อความเดิม → 400 "message is not modified" เหมือนของจริง
+# - บอทรันจริงทั้งตัว (Application + JobQueue + PollScheduler + Broadcaster + AnalysisPool + StateStore)
+#   แค่ชี้ LOTTO_BASE_URL / TELEGRAM_API_URL มาที่เซิร์ฟเวอร์ปลอม และย่อเวลาของ scheduler ตามอัตราเร่ง
+#
+# วัด: เวลาจากรอบที่ปิดล็อคออก → ข้อความถึงแต่ละแชท, fetch ต่อวัน, ข้อความที่หาย/ซ้ำ,
+#      เวลาตอบข้อความผู้ใช้ระหว่าง flood
+# ผิดพลาด (หาย / ซ้ำโดยไม่มี timeout / ข้อความที่ไม่ควรมี) → exit 1
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from statistics import quantiles
+from typing import NamedTuple
+from urllib.parse import parse_qs
+
+from analysis import analyze_numbers
+
+LOADTEST_TOKEN = "123456:loadtest"
+ROUND_CADENCE = 300.0            # world264 ออกผลทุก ~5 นาที (เวลาจริง)
+FLOOD_USER_BASE = 10**9          # chat id ของผู้ใช้ที่ส่งข้อความ flood (แชทส่วนตัว)
+ADMIN_CHAT = FLOOD_USER_BASE - 1
+
+# ──────────────────────────────────────────────────────────────────────
+# ข้อมูลสังเคราะห์
+def make_rounds(n: int, rnd: random.Random) -> list[tuple[str, str]]:
+    return [(f"{rnd.randrange(1000):03d}", f"{rnd.randrange(100):02d}") for _ in range(n)]
+
+def results_text(rounds: list[tuple[str, str]], sep: str = "\n") -> str:
+    return sep.join(f"{t} - {b}" for t, b in rounds)
+
+class Lock(NamedTuple):
+    game: str          # "world264" หรือ key ของกลุ่มเกม
+    usable: int
+    closed_at: float   # time.perf_counter() ที่รอบปิดล็อคออก
+
+# ──────────────────────────────────────────────────────────────────────
+# S3 ปลอม
+class FakeS3(ThreadingHTTPServer):
+    """ไฟล์รายวันแบบเดียวกับ S3: รอบที่ i ออกตอน start + i * step (วินาทีจริงหลังเร่งแล้ว)"""
+
+    daemon_threads = True
+
+    def __init__(self, games: dict[str, list[tuple[str, str]]], step: float):
+        super().__init__(("127.0.0.1", 0), _S3Handler)
+        self.games = games               # key ของกลุ่ม ("0122", "0201" …) -> รอบทั้งหมดของวัน
+        self.step = step
+        self.started = time.perf_counter()
+        self.stats: dict[str, Counter] = defaultdict(Counter)    # path -> {200, 304, bytes}
+        self._lock = threading.Lock()
+        self._bodies: dict[int, bytes] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/lotto-result-list/{{d}}.json"
+
+    def published_at(self, round_no: int) -> float:
+        return self.started + round_no * self.step
+
+    def visible(self) -> int:
+        n = int((time.perf_counter() - self.started) / self.step)
+        return min(n, max(len(r) for r in self.games.values()))
+
+    def body(self, n: int) -> bytes:
+        with self._lock:
+            b = self._bodies.get(n)
+            if b is None:
+                doc = {}
+                for key, rounds in self.games.items():
+                    doc[key] = {
+                        f"{key}{i:05d}": {
+                            "round_number": str(i), "lotto_type": key[:2], "lotto_subtype": key[2:],
+                            "status": "done", "result": {"top_three": t, "bottom_two": b2},
+                        }
+                        for i, (t, b2) in enumerate(rounds[:n], 1)
+                    }
+                doc["0999"] = {"0999-1": {"lotto_type": "09", "lotto_subtype": "99", "round_number": "1"}}
+                b = self._bodies[n] = json.dumps(doc).encode()
+            return b
+
+class _S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        s3: FakeS3 = self.server
+        n = s3.visible()
+        etag = f'"r{n}"'
+        if self.headers.get("If-None-Match") == etag:
+            s3.stats[self.path][304] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = s3.body(n)
+        s3.stats[self.path][200] += 1
+        s3.stats[self.path]["bytes"] += len(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(time.time() - (time.perf_counter() - s3.published_at(n)),
+                                                     usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# ──────────────────────────────────────────────────────────────────────
+# Bot API ปลอม
+class Receipt(NamedTuple):
+    t: float
+    chat_id: int
+    text: str
+    late: bool         # ค้างเกิน timeout แล้วค่อยถึง (ผู้ส่งเห็นเป็น TimedOut)
+
+class FakeBotApi(ThreadingHTTPServer):
+    """/bot<token>/<method> — ตอบพอให้ python-telegram-bot ทำงานได้, บันทึก sendMessage ทุกครั้ง"""
+
+    daemon_threads = True
+
+    def __init__(self, retry_after_rate: float, timeout_rate: float, stall: float, seed: int):
+        super().__init__(("127.0.0.1", 0), _BotApiHandler)
+        self.retry_after_rate = retry_after_rate
+        self.timeout_rate = timeout_rate
+        self.stall = stall
+        self.receipts: list[Receipt] = []
+        self.injected = Counter()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.calls = Counter()
+        self._messages: dict[tuple[int, int], str] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def roll(self) -> str | None:
+        with self._lock:
+            x = self._rnd.random()
+        if x < self.retry_after_rate:
+            return "retry_after"
+        if x < self.retry_after_rate + self.timeout_rate:
+            return "timeout"
+        return None
+
+    def record(self, chat_id: int, text: str, late: bool) -> int:
+        with self._lock:
+            self._message_id += 1
+            self.receipts.append(Receipt(time.perf_counter(), chat_id, text, late))
+            self._messages[(chat_id, self._message_id)] = text
+            return self._message_id
+
+    def edit(self, chat_id: int, message_id: int, text: str, late: bool) -> str | None:
+        """คืนคำอธิบาย error แบบ Bot API หรือ None ถ้าแก้สำเร็จ"""
+        with self._lock:
+            old = self._messages.get((chat_id, message_id))
+            if old is None:
+                return "Bad Request: message to edit not found"
+            if old == text:
+                return "Bad Request: message is not modified: specified new message content and reply markup " \
+                       "are exactly the same as a current content and reply markup of the message"
+            self._messages[(chat_id, message_id)] = text
+            self.receipts.append(Receipt(time.perf_counter(), chat_id, text, late))
+            return None
+
+class _BotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        api: FakeBotApi = self.server
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(raw or b"{}")
+        else:
+            params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        method = self.path.rsplit("/", 1)[-1].lower()
+
+        if method == "getme":
+            self._reply({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "loadtest",
+                                                "username": "loadtest_bot"}})
+        elif method in ("sendmessage", "editmessagetext"):
+            chat_id = int(params.get("chat_id", 0))
+            text = params.get("text", "")
+            fault = api.roll()
+            if fault == "retry_after":
+                api.injected["retry_after"] += 1
+                self._reply({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}, status=429)
+                return
+            if fault == "timeout":
+                api.injected["timeout"] += 1
+                time.sleep(api.stall)
+            api.calls[method] += 1
+            if method == "editmessagetext":
+                message_id = int(params.get("message_id", 0))
+                error = api.edit(chat_id, message_id, text, fault == "timeout")
+                if error:
+                    self._reply({"ok": False, "error_code": 400, "description": error}, status=400)
+                    return
+            else:
+                message_id = api.record(chat_id, text, fault == "timeout")
+            self._reply({"ok": True, "result": {
+                "message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            }})
+        else:
+            # setWebhook / deleteWebhook / ฯลฯ
+            self._reply({"ok": True, "result": True})
+
+    do_GET = do_POST
+
+    def _reply(self, doc: dict, status: int = 200):
+        body = json.dumps(doc).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass            # ผู้ส่ง timeout ไปก่อนแล้ว
+
+    def log_message(self, *args):
+        pass
+
+# ──────────────────────────────────────────────────────────────────────
+# สรุปผล
+def _pct(samples: list[float]) -> dict:
+    if not samples:
+        return {"n": 0}
+    q = quantiles(samples, n=100, method="inclusive") if len(samples) > 1 else samples * 99
+    return {"n": len(samples), "p50_s": q[49], "p95_s": q[94], "p99_s": q[98], "max_s": max(samples)}
+
+def _fmt_pct(p: dict) -> str:
+    if not p["n"]:
+        return "n=0"
+    return f"n={p['n']} p50={p['p50_s']:.2f}s p95={p['p95_s']:.2f}s p99={p['p99_s']:.2f}s max={p['max_s']:.2f}s"
+
+def _lock_text(text: str) -> str:
+    # broadcast ของเกมอื่นมีหัว "🎲 เกม …" นำหน้าผลวิเคราะห์
+    if text.startswith("🎲"):
+        return text.split("\n\n", 1)[-1]
+    return text
+
+def summarize(api: FakeBotApi, s3: FakeS3, chats: list[int], locks: dict[str, list[Lock]],
+              manual: dict[str, int], flood: dict[int, tuple[float, str]], pool_rejected: int) -> dict:
+    chat_set = set(chats)
+    got: dict[tuple[int, str], list[Receipt]] = defaultdict(list)
+    flood_replies: dict[int, list[Receipt]] = defaultdict(list)
+    unexpected = []
+    for r in api.receipts:
+        if r.chat_id in chat_set:
+            key = _lock_text(r.text)
+            if key in locks or key in manual:
+                got[(r.chat_id, key)].append(r)
+            else:
+                unexpected.append(r)
+        elif r.chat_id in flood:
+            flood_replies[r.chat_id].append(r)
+        elif r.chat_id != ADMIN_CHAT:
+            unexpected.append(r)
+
+    latencies, per_lock = [], []
+    dropped = duplicated = explained = skipped = 0
+    for text, lock_list in locks.items():
+        lock, expected = lock_list[0], len(lock_list)   # ผลซ้ำกันข้ามล็อคแทบเป็นไปไม่ได้ แต่นับให้ถูก
+        received = [got.get((c, text), []) for c in chats]
+        reached = sum(1 for rs in received if rs)
+        if not reached:
+            skipped += expected
+            per_lock.append({"game": lock.game, "usable": lock.usable, "reached": 0})
+            continue
+        lat = [rs[0].t - lock.closed_at for rs in received if rs]
+        latencies += lat
+        for rs in received:
+            dropped += max(0, expected - len(rs))
+            extra = max(0, len(rs) - expected)
+            duplicated += extra
+            explained += min(extra, sum(1 for r in rs if r.late))
+        per_lock.append({"game": lock.game, "usable": lock.usable, "reached": reached,
+                         "first_s": min(lat), "last_s": max(lat)})
+
+    manual_dropped = 0
+    for text, count in manual.items():
+        for c in chats:
+            manual_dropped += max(0, count - len(got.get((c, text), [])))
+
+    reply_lat, wrong_replies = [], 0
+    for uid, (sent_at, expected) in flood.items():
+        rs = flood_replies.get(uid)
+        if not rs:
+            continue
+        if rs[0].text != expected:
+            wrong_replies += 1
+        reply_lat.append(rs[0].t - sent_at)
+
+    fetch = Counter()
+    for c in s3.stats.values():
+        fetch.update(c)
+    rounds = s3.visible()
+    return {
+        "chats": len(chats),
+        "locks": per_lock,
+        "delivery_latency": _pct(latencies),
+        "dropped": dropped,
+        "duplicated": duplicated,
+        "duplicated_after_timeout": explained,
+        "skipped_locks": skipped,
+        "unexpected": len(unexpected),
+        "manual_broadcasts": sum(manual.values()),
+        "manual_dropped": manual_dropped,
+        "fetches": {"total": fetch[200] + fetch[304], "ok": fetch[200], "not_modified": fetch[304],
+                    "bytes": fetch["bytes"], "rounds": rounds,
+                    "per_day": (fetch[200] + fetch[304]) * 264 / max(1, rounds)},
+        "flood": {"sent": len(flood), "replied": len(reply_lat), "wrong": wrong_replies,
+                  "pool_rejected": pool_rejected, "reply_latency": _pct(reply_lat)},
+        "injected": dict(api.injected),
+        "sends": len(api.receipts),
+        "api_calls": dict(api.calls),
+    }
+
+# ──────────────────────────────────────────────────────────────────────
+# รัน
+def _update(update_id: int, chat_id: int, text: str) -> dict:
+    msg = {"message_id": update_id, "date": int(time.time()), "text": text,
+           "chat": {"id": chat_id, "type": "private"},
+           "from": {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"}}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": msg}
+
+async def run(args) -> dict:
+    import bot                                   # หลังตั้ง ENV แล้วเท่านั้น
+    from telegram import Update
+    from scheduler import PollScheduler
+
+    rnd = random.Random(args.seed)
+    step = ROUND_CADENCE / args.speed
+    games = {"0122": make_rounds(args.rounds, rnd)}
+    for i in range(args.games):
+        games[f"02{i + 1:02d}"] = make_rounds(args.rounds, rnd)
+    s3 = FakeS3(games, step)
+    api = FakeBotApi(args.retry_after_rate, args.timeout_rate, args.stall, args.seed)
+    for srv in (s3, api):
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    bot.day_fetcher.base_url = s3.url
+    bot.TELEGRAM_API_URL = api.url
+
+    # scheduler ทำงานบนเวลาจริง → ย่อทุกค่าคงที่ตามอัตราเร่ง (จำนวน fetch ต่อวันจึงเทียบกับของจริงได้)
+    base = PollScheduler()
+    sched = PollScheduler(*(v / args.speed for v in (
+        base.base_interval, base.burst_interval, base.lead, base.idle_interval, base.idle_after)))
+    for attr in ("MIN_CADENCE", "MAX_CADENCE", "PRECISE_WINDOW"):
+        setattr(sched, attr, getattr(PollScheduler, attr) / args.speed)
+    bot.poll_scheduler = sched
+
+    # ผลที่ควรได้: ทุกล็อคที่ครบ (ทุกเกม) → analyze_numbers ของรอบ 1..usable
+    locks: dict[str, list[Lock]] = defaultdict(list)
+    for key, rounds in games.items():
+        for usable in range(bot.lock_size, len(rounds) + 1, bot.lock_size):
+            text = analyze_numbers(results_text(rounds[:usable]), bot.lock_size)
+            if text:
+                locks[text].append(Lock("world264" if key == "0122" else key, usable, s3.published_at(usable)))
+
+    bot.leader.start()
+    bot.leader.wait()
+    app = bot.build_application("webhook")
+    await app.initialize()
+    await app.start()
+    rejected0 = bot.analysis_pool.stats["rejected"]
+
+    flood: dict[int, tuple[float, str]] = {}
+    manual: Counter = Counter()
+    update_id = 0
+    try:
+        # flood: ผู้ใช้จำนวนมากส่งผลเลขพร้อมกันหลังล็อคที่ 2 ปิด (ช่วงที่ poller กำลัง broadcast)
+        await asyncio.sleep(max(0.0, s3.published_at(2 * bot.lock_size) + 0.05 - time.perf_counter()))
+        texts = [results_text(make_rounds(args.flood_rounds, rnd)) for _ in range(max(1, args.flood // 4))]
+        for i in range(args.flood):
+            text = rnd.choice(texts) if rnd.random() < args.flood_repeat else \
+                results_text(make_rounds(args.flood_rounds, rnd))
+            update_id += 1
+            uid = FLOOD_USER_BASE + i
+            flood[uid] = (time.perf_counter(), analyze_numbers(text, bot.lock_size))
+            await app.update_queue.put(Update.de_json(_update(update_id, uid, text), app.bot))
+        for _ in range(args.analyze):
+            text = results_text(make_rounds(args.flood_rounds, rnd), sep=" ")
+            update_id += 1
+            manual[analyze_numbers(text, bot.lock_size)] += 1
+            await app.update_queue.put(Update.de_json(_update(update_id, ADMIN_CHAT, f"/analyze {text}"), app.bot))
+
+        # รอจนรอบสุดท้ายออก แล้วรอให้ทุกล็อคถึงครบทุกแชท (หรือจนหมดเวลา drain)
+        await asyncio.sleep(max(0.0, s3.published_at(args.rounds) - time.perf_counter()))
+        want = sum(len(v) for v in locks.values()) * len(bot.CHAT_IDS) + sum(manual.values()) * len(bot.CHAT_IDS)
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline:
+            delivered = sum(1 for r in api.receipts if r.chat_id < ADMIN_CHAT)
+            if delivered >= want:
+                break
+            await asyncio.sleep(0.2)
+        await asyncio.sleep(0.5)         # เผื่อ request ที่ค้าง (timeout) กำลังจะถึง
+    finally:
+        await app.stop()
+        await app.shutdown()
+        bot.leader.release()
+        s3.shutdown()
+        api.shutdown()
+
+    chats = [int(c) for c in bot.CHAT_IDS]
+    return summarize(api, s3, chats, locks, manual, flood, bot.analysis_pool.stats["rejected"] - rejected0)
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Offline end-to-end load test with fake S3 and fake Bot API")
+    ap.add_argument("--quick", action="store_true", help="ชุดเล็กสำหรับ CI (50 แชท, 12 รอบ, เร่ง 300 เท่า)")
+    ap.add_argument("--chats", type=int, default=None, help="จำนวนแชทปลายทาง (ครึ่งหนึ่งเป็นกลุ่ม)")
+    ap.add_argument("--rounds", type=int, default=None, help="จำนวนรอบที่ออกระหว่างเทสต์")
+    ap.add_argument("--speed", type=float, default=None, help="เร่งนาฬิกากี่เท่า (รอบจริงทุก 300 วินาที)")
+    ap.add_argument("--games", type=int, default=1, help="จำนวนเกมอื่นในไฟล์เดียวกันนอกจาก world264")
+    ap.add_argument("--lock-size", type=int, default=4)
+    ap.add_argument("--flood", type=int, default=None, help="จำนวนข้อความผลเลขจากผู้ใช้ที่ส่งพร้อมกัน")
+    ap.add_argument("--flood-rounds", type=int, default=40, help="จำนวนรอบต่อข้อความ flood")
+    ap.add_argument("--flood-repeat", type=float, default=0.5, help="สัดส่วนข้อความ flood ที่ซ้ำกัน (forward)")
+    ap.add_argument("--analyze", type=int, default=2, help="จำนวนคำสั่ง /analyze (แต่ละครั้ง broadcast ทุกแชท)")
+    ap.add_argument("--retry-after-rate", type=float, default=0.02, help="สัดส่วน sendMessage ที่ตอบ 429")
+    ap.add_argument("--timeout-rate", type=float, default=0.005, help="สัดส่วน sendMessage ที่ค้างเกิน timeout")
+    ap.add_argument("--stall", type=float, default=6.0, help="ค้างกี่วินาที (read timeout ของบอท = 5)")
+    ap.add_argument("--drain", type=float, default=60.0, help="รอส่งค้างหลังรอบสุดท้ายไม่เกินกี่วินาที")
+    ap.add_argument("--live", action="store_true", help="BROADCAST_MODE=live (edit ข้อความเดิมของแต่ละแชท)")
+    ap.add_argument("--seed", type=int, default=264)
+    ap.add_argument("--json", dest="json_out", help="เขียนผลเป็น JSON")
+    args = ap.parse_args(argv)
+    quick = args.quick
+    args.chats = args.chats or (50 if quick else 200)
+    args.rounds = args.rounds or (12 if quick else 24)
+    args.speed = args.speed or (300.0 if quick else 60.0)
+    args.flood = args.flood if args.flood is not None else (100 if quick else 500)
+
+    chats = [str(-(10**12) - i) if i % 2 else str(10**6 + i) for i in range(args.chats)]
+    env = {
+        "TELEGRAM_BOT_TOKEN": LOADTEST_TOKEN,
+        "TELEGRAM_CHAT_IDS": ",".join(chats),
+        "WEBHOOK_URL": "http://127.0.0.1",
+        "STATE_DIR": tempfile.mkdtemp(prefix="loadtest-"),
+        "LOCK_SIZE": str(args.lock_size),
+        "FIRST_POLL_DELAY": "0.1",
+        "BROADCAST_MODE": "live" if args.live else "new",
+        "GAMES": "all",                  # เกมอื่นปิดเป็นค่าเริ่มต้น — loadtest ตรวจทุกเกมในไฟล์
+    }
+    os.environ.update(env)
+    # 429/timeout ที่ฉีดเข้าไปทำให้ reply ของ handler พัง (ไม่มี retry) → log ERROR ตามปกติ ปิดไว้ไม่ให้กลบรายงาน
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    os.environ.setdefault("UPDATE_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FORMAT", "text")
+
+    t0 = time.perf_counter()
+    report = asyncio.run(run(args))
+    report["wall_s"] = time.perf_counter() - t0
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+    f = report["fetches"]
+    fl = report["flood"]
+    print(f"chats={report['chats']} rounds={f['rounds']} speed={args.speed:g}x sends={report['sends']} "
+          f"api_calls={report['api_calls']} injected={report['injected']} wall={report['wall_s']:.1f}s")
+    print(f"delivery latency (round out → chat): {_fmt_pct(report['delivery_latency'])}")
+    for lk in report["locks"]:
+        if lk["reached"]:
+            print(f"  {lk['game']:<9} lock@{lk['usable']:<4} {lk['reached']}/{report['chats']} chats "
+                  f"first={lk['first_s']:.2f}s last={lk['last_s']:.2f}s")
+        else:
+            print(f"  {lk['game']:<9} lock@{lk['usable']:<4} never broadcast (poller skipped it)")
+    print(f"fetches: {f['total']} ({f['ok']} ok, {f['not_modified']} not modified, {f['bytes']:,} bytes) "
+          f"≈ {f['per_day']:.0f}/day")
+    print(f"flood: {fl['sent']} messages, {fl['replied']} replied, {fl['pool_rejected']} rejected (pool busy), "
+          f"{fl['sent'] - fl['replied'] - fl['pool_rejected']} lost, {fl['wrong']} wrong; "
+          f"reply latency {_fmt_pct(fl['reply_latency'])}")
+    print(f"/analyze: {report['manual_broadcasts']} broadcasts, {report['manual_dropped']} chat deliveries missing")
+    print(f"dropped={report['dropped']} duplicated={report['duplicated']} "
+          f"(after timeout {report['duplicated_after_timeout']}) skipped_locks={report['skipped_locks']} "
+          f"unexpected={report['unexpected']}")
+
+    problems = report["dropped"] + report["manual_dropped"] + report["unexpected"] + fl["wrong"] + \
+        (report["duplicated"] - report["duplicated_after_timeout"])
+    if problems:
+        print("\n❌ deliveries lost, duplicated without a timeout, or wrong")
+        return 1
+    print("\n✅ every lock reached every chat once (apart from retries after timeouts)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
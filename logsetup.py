@@ -0,0 +1,125 @@
+# logsetup.py — logging แบบไม่บล็อก: ผู้เรียกแค่ใส่ record ลงคิว, เธรด listener เป็นคน format/เขียน
+#
+# - LOG_FORMAT=json (ค่าเริ่มต้น) หนึ่งบรรทัดต่อ record: ts, level, logger, tag ("[POLL]" → "POLL"), msg + extra
+#   LOG_FORMAT=text ได้รูปแบบเดิมของ basicConfig
+# - record ไม่ถูก format ฝั่งผู้เรียก: ใช้ logging.info("... %s", x) แล้ว str(x) เกิดในเธรด listener
+#   (Lazy(fn) เลื่อนงานแพงอย่าง to_json ไปทำตอนเขียนจริง และไม่ทำเลยถ้า level ปิดอยู่)
+# - คิวเต็ม (stderr ค้าง) → ทิ้ง record แล้วนับไว้ ไม่ให้ handler ต้องรอ I/O
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from collections import OrderedDict
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# attribute มาตรฐานของ LogRecord — ที่เหลือถือเป็น extra=... ของผู้เรียก
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+class Lazy:
+    """ค่าที่คำนวณตอน format เท่านั้น: logging.debug("%s", Lazy(update.to_json))"""
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.fn(*self.args))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        msg = record.getMessage()
+        doc = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        if msg.startswith("[") and "]" in msg[:24]:
+            end = msg.index("]")
+            doc["tag"] = msg[1:end]
+            msg = msg[end + 1:].lstrip()
+        doc["msg"] = msg
+        for k, v in record.__dict__.items():
+            if k not in _RECORD_ATTRS and not k.startswith("_"):
+                doc[k] = v
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            doc["exc"] = record.exc_text
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # ไม่ format ที่นี่ (QueueHandler ปกติ format ในเธรดผู้เรียก) — คิวอยู่ในโปรเซสเดียวกัน ส่ง record ไปตรงๆ
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+_listener: logging.handlers.QueueListener | None = None
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """ตั้ง root logger ครั้งเดียว (เรียกซ้ำได้)"""
+    global _listener
+    if _listener is not None:
+        return
+    out = logging.StreamHandler(sys.stderr)
+    out.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    q: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_NonBlockingQueueHandler(q))
+    root.setLevel(level)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(q, out, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)      # เขียน record ที่ค้างในคิวให้หมดก่อนออก
+
+def dropped_records() -> int:
+    return _NonBlockingQueueHandler.dropped
+
+class KeyedRateLimiter:
+    """ไม่เกิน rate ครั้งต่อ per วินาทีต่อ key (token bucket) — ใช้คุม log ที่ถี่ตามแชท
+
+    allow(key) → (ผ่านไหม, จำนวนที่ถูกทิ้งไปตั้งแต่ครั้งที่ผ่านล่าสุด)"""
+
+    def __init__(self, rate: float, per: float = 60.0, max_keys: int = 1024):
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()   # key -> [tokens, last, suppressed]
+
+    def allow(self, key, now: float | None = None) -> tuple[bool, int]:
+        if self.rate <= 0:
+            return False, 0
+        now = time.monotonic() if now is None else now
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = [self.rate, now, 0]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            b[0] = min(self.rate, b[0] + (now - b[1]) * self.rate / self.per)
+            b[1] = now
+        if b[0] < 1:
+            b[2] += 1
+            return False, 0
+        b[0] -= 1
+        suppressed, b[2] = b[2], 0
+        return True, suppressed
@@ -0,0 +1,168 @@
+# metrics.py — counter / gauge / histogram แบบเบาๆ + render เป็น Prometheus text format
+# (ไม่พึ่ง prometheus_client; observe() = lock + bisect เปิดทิ้งไว้ใน production ได้)
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+_REGISTRY: list = []
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(v)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self._fn = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn):
+        """ค่าอ่านสดตอน scrape (เช่นขนาดคิว) — fn คืนตัวเลข"""
+        self._fn = fn
+
+    def render(self) -> list[str]:
+        if self._fn is not None:
+            try:
+                self.set(self._fn())
+            except Exception:
+                pass
+        return super().render()
+
+# ช่วงเวลาเริ่มต้น: 1 ms ถึง 60 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, n) in items:
+            cum = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cum}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for m in _REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# ──────────────────────────────────────────────────────────────────────
+# Metrics ของบอท (ประกาศที่เดียว โมดูลอื่น import ไปใช้)
+_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+FETCH_SECONDS = Histogram("lotto_fetch_duration_seconds", "Day file fetch time (request to parsed body)", ("status",))
+FETCH_BYTES = Histogram("lotto_fetch_bytes", "Bytes downloaded per day file fetch", (), _SIZE_BUCKETS)
+FETCH_RESPONSES = Counter("lotto_fetch_responses_total", "Day file fetches by HTTP status", ("status",))
+DECODE_SECONDS = Histogram("lotto_day_decode_seconds", "CPU time spent decoding/parsing a day file body")
+
+ANALYSIS_SECONDS = Histogram("lotto_analysis_seconds", "Time per formula in the poller", ("formula",))
+ANALYSIS_JOB_SECONDS = Histogram("lotto_analysis_job_seconds", "Pasted-text analysis job time in the worker pool")
+ANALYSIS_PENDING = Gauge("lotto_analysis_pending", "Analysis jobs running or queued in the worker pool")
+
+POLL_LAG_SECONDS = Histogram("lotto_poll_lag_seconds", "How late the poll job woke up versus its schedule",
+                             (), (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+POLL_SECONDS = Histogram("lotto_poll_duration_seconds", "Full poll_and_analyze run time")
+
+SEND_SECONDS = Histogram("telegram_send_seconds", "Bot API send_message call latency", ("chat_id",))
+DELIVERY_SECONDS = Histogram("telegram_delivery_seconds", "Time to deliver one message incl. rate-limit waits and retries",
+                             ("chat_id",))
+SEND_RETRIES = Counter("telegram_send_retries_total", "Retried sends", ("chat_id", "reason"))
+SEND_FAILURES = Counter("telegram_send_failures_total", "Messages given up on", ("chat_id",))
+SENT = Counter("telegram_sent_total", "Messages delivered", ("chat_id",))
+
+HANDLER_QUEUE = Gauge("telegram_update_queue_depth", "Updates waiting in the Application update queue")
+LAST_HEARTBEAT = Gauge("bot_last_heartbeat_timestamp_seconds", "Unix time of the last poller heartbeat")
+LAST_BROADCAST = Gauge("bot_last_broadcast_timestamp_seconds", "Unix time of the last successful send")
+LOG_DROPPED = Gauge("log_records_dropped", "Log records dropped because the log queue was full")
+
+# ──────────────────────────────────────────────────────────────────────
+# เวลา boot: วินาทีนับจาก import โมดูลนี้ (server.py import เป็นอย่างแรก) ถึงแต่ละขั้น
+BOOT_STARTED = time.time()
+BOOT_TIMINGS: dict[str, float] = {}
+BOOT_SECONDS = Gauge("bot_boot_phase_seconds", "Seconds from process start to each boot phase", ("phase",))
+
+def boot_mark(phase: str) -> float | None:
+    """บันทึกครั้งแรกของแต่ละขั้นเท่านั้น; คืนวินาที หรือ None ถ้าเคยบันทึกแล้ว"""
+    if phase in BOOT_TIMINGS:
+        return None
+    t = round(time.time() - BOOT_STARTED, 3)
+    BOOT_TIMINGS[phase] = t
+    BOOT_SECONDS.set(t, phase=phase)
+    return t
@@ -0,0 +1,315 @@
+# rounds.py — คลังรอบรายวันแบบคอลัมน์ (หลักละ 1 ไบต์ใน array) + ไฟล์ไบนารีต่อวัน/กลุ่ม อ่านกลับด้วย mmap
+#
+# - poll แต่ละครั้งต่อท้ายเฉพาะรอบใหม่ ทั้งในหน่วยความจำและในไฟล์ (append-only)
+# - สูตรอ่านหลักเป็น int จากคอลัมน์ตรงๆ ไม่ต้อง int(top3[i]) ทีละตัวอักษร
+# - รีสตาร์ท / ย้อนดูวันเก่า: mmap ไฟล์แล้วแยกคอลัมน์ด้วย slice แบบ stride ไม่ต้อง decode JSON
+# - ใช้แทน list[dict] เดิมได้: len(arch), arch[i] → dict, arch[a:b] → list[dict]
+#
+# ไฟล์ {วัน}_{group key}.rounds (key ที่มีอักษรนอก [A-Za-z0-9_-] เขียนเป็น "~" + hex ของ UTF-8): header 8 ไบต์ (MAGIC) แล้วรอบละ 8 ไบต์ "<H5Bx"
+# (เลขรอบ, หลักร้อย/สิบ/หน่วยของสามตัวบน, หลักสิบ/หน่วยของสองตัวล่าง, padding)
+import os
+import re
+import sys
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from datetime import date
+
+from dayparse import DayGames, GameDay, MAX_ROUND, is_ascii_digits
+
+MAGIC = b"RNDS\x01\x00\x00\x00"
+RECORD = struct.Struct("<H5Bx")
+COLUMNS = ("h", "t", "u", "bt", "bu")
+SUFFIX = ".rounds"
+
+# group key มาจาก JSON ต้นทาง — ห้ามใช้เป็นชื่อไฟล์ตรงๆ ถ้ามี "/" ".." ฯลฯ
+_SAFE_KEY = re.compile(r"[A-Za-z0-9_-]+")
+
+def _encode_key(key: str) -> str:
+    return key if _SAFE_KEY.fullmatch(key) else "~" + key.encode().hex()
+
+def _decode_key(name: str) -> str | None:
+    if not name.startswith("~"):
+        return name if _SAFE_KEY.fullmatch(name) else None
+    try:
+        return bytes.fromhex(name[1:]).decode()
+    except ValueError:
+        return None
+
+_TOP3 = [f"{i:03d}" for i in range(1000)]
+_BOTTOM2 = [f"{i:02d}" for i in range(100)]
+
+class RoundArchive:
+    """รอบของหนึ่งกลุ่มในหนึ่งวัน: rounds (array H) + หลัก h t u bt bu (array B คอลัมน์ละตัว)
+
+    saved = จำนวนรอบที่อยู่ในไฟล์แล้ว — flush() เขียนเฉพาะส่วนที่เกิน"""
+
+    __slots__ = ("key", "path", "saved", "rounds", "h", "t", "u", "bt", "bu")
+
+    def __init__(self, key: str = "", path: str | None = None):
+        self.key = key
+        self.path = path
+        self.saved = 0
+        self.rounds = array("H")
+        self.h = array("B")
+        self.t = array("B")
+        self.u = array("B")
+        self.bt = array("B")
+        self.bu = array("B")
+
+    @classmethod
+    def from_rows(cls, key: str, rows, path: str | None = None) -> "RoundArchive":
+        arch = cls(key, path)
+        arch.extend(rows)
+        return arch
+
+    # ── อ่าน ──
+    def __len__(self) -> int:
+        return len(self.rounds)
+
+    def top3(self, i: int) -> str:
+        return _TOP3[self.h[i] * 100 + self.t[i] * 10 + self.u[i]]
+
+    def bottom2(self, i: int) -> str:
+        return _BOTTOM2[self.bt[i] * 10 + self.bu[i]]
+
+    def digits(self, i: int) -> tuple[int, int, int, int, int]:
+        return self.h[i], self.t[i], self.u[i], self.bt[i], self.bu[i]
+
+    def row(self, i: int) -> dict:
+        return {"round": self.rounds[i], "top3": self.top3(i), "bottom2": self.bottom2(i)}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("round index out of range")
+        return self.row(i)
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def pairs(self, start: int = 0, stop: int | None = None) -> list[tuple[str, str]]:
+        """[(top3, bottom2), ...] — รูปแบบที่ backtest ส่งให้ worker process"""
+        return [(self.top3(i), self.bottom2(i)) for i in range(*slice(start, stop).indices(len(self)))]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self) * RECORD.size
+
+    def fingerprint(self, n: int) -> int:
+        """crc32 ของรอบ 0..n-1 ทุกคอลัมน์ — ตัวนับที่เก็บไว้ใช้ตรวจว่านับจากข้อมูลชุดเดียวกับคลังนี้"""
+        crc = 0
+        for col in (self.rounds, self.h, self.t, self.u, self.bt, self.bu):
+            crc = zlib.crc32(memoryview(col)[:n], crc)
+        return crc
+
+    def continues(self, rows) -> bool:
+        """rows (ผล parse ของไฟล์ล่าสุด) = รอบเดิมในคลังนี้ + รอบใหม่ต่อท้าย?
+        เทียบแค่รอบสุดท้ายที่มีอยู่ (ไฟล์ต้นทางแก้ย้อนหลัง → จำนวนหรือรอบท้ายจะไม่ตรง)"""
+        if rows is self:
+            return True
+        n = len(self)
+        return len(rows) >= n and (n == 0 or rows[n - 1] == self.row(n - 1))
+
+    # ── เขียน ──
+    def append(self, round_no: int, top3: str, bottom2: str):
+        # ตรวจก่อนเติมคอลัมน์ใดๆ — พังกลางทางแล้วคอลัมน์จะยาวไม่เท่ากัน
+        if not (isinstance(round_no, int) and 0 <= round_no <= MAX_ROUND
+                and is_ascii_digits(top3, 3) and is_ascii_digits(bottom2, 2)):
+            raise ValueError(f"invalid round {round_no!r}: {top3!r} - {bottom2!r}")
+        self.rounds.append(round_no)
+        self.h.append(ord(top3[0]) - 48)
+        self.t.append(ord(top3[1]) - 48)
+        self.u.append(ord(top3[2]) - 48)
+        self.bt.append(ord(bottom2[0]) - 48)
+        self.bu.append(ord(bottom2[1]) - 48)
+
+    def extend(self, rows):
+        for r in rows:
+            self.append(r["round"], r["top3"], r["bottom2"])
+
+    def flush(self):
+        """เขียนรอบที่ยังไม่อยู่ในไฟล์ต่อท้าย (saved == 0 → เขียนไฟล์ใหม่ทั้งไฟล์)"""
+        if self.path is None or self.saved == len(self):
+            return
+        buf = bytearray(MAGIC if not self.saved else b"")
+        pack = RECORD.pack
+        for i in range(self.saved, len(self)):
+            buf += pack(self.rounds[i], self.h[i], self.t[i], self.u[i], self.bt[i], self.bu[i])
+        tmp = self.path if self.saved else self.path + ".tmp"
+        with open(tmp, "ab" if self.saved else "wb") as f:
+            f.write(buf)
+        if not self.saved:
+            os.replace(tmp, self.path)
+        self.saved = len(self)
+
+    @classmethod
+    def load(cls, path: str, key: str = "") -> "RoundArchive":
+        """mmap ไฟล์แล้วแยกเป็นคอลัมน์ (record ท้ายที่เขียนไม่ครบเพราะ crash ถูกตัดทิ้ง)"""
+        arch = cls(key, path)
+        with open(path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            n = max(0, size - len(MAGIC)) // RECORD.size
+            if n:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if mm[:len(MAGIC)] != MAGIC:
+                        raise ValueError(f"{path}: not a round archive")
+                    body = memoryview(mm)[len(MAGIC):len(MAGIC) + n * RECORD.size]
+                    try:
+                        arch.rounds.frombytes(body.cast("H")[0::RECORD.size // 2].tobytes())
+                        for k, col in enumerate(COLUMNS):
+                            getattr(arch, col).frombytes(body[2 + k::RECORD.size].tobytes())
+                    finally:
+                        body.release()
+                if sys.byteorder == "big":
+                    arch.rounds.byteswap()
+            if size != len(MAGIC) + n * RECORD.size:
+                f.truncate(len(MAGIC) + n * RECORD.size if n else 0)
+        arch.saved = n
+        return arch
+
+class RoundStore:
+    """RoundArchive ต่อ (วัน, group key) ใน directory เดียว — โหลดจากไฟล์ครั้งแรกแล้วเก็บไว้ในหน่วยความจำ
+
+    คลังของวันล่าสุด (วันที่ poller ใช้) อยู่ในหน่วยความจำทุกกลุ่มไม่จำกัดจำนวน: ถ้าถูกทิ้งแล้วโหลดใหม่
+    จะได้ object ใหม่ และ engine / cache รายงานของ bot ต้องเริ่มนับใหม่ทั้งวัน
+    วันก่อนหน้า (backtest) เก็บไม่เกิน MAX_CACHED ตัว ทิ้งตัวที่ไม่ได้ใช้นานสุดก่อน"""
+
+    MAX_CACHED = 16
+
+    def __init__(self, root: str):
+        self.root = root
+        self._cache: dict[tuple[date, str], RoundArchive] = {}
+        self._lock = threading.Lock()
+        self.stats = {"loaded": 0, "appended": 0, "rebuilt": 0, "errors": 0}
+
+    def path_for(self, d: date, key: str) -> str:
+        return os.path.join(self.root, f"{d.isoformat()}_{_encode_key(key)}{SUFFIX}")
+
+    def keys(self, d: date) -> list[str]:
+        """group key ที่มีไฟล์ของวันนั้น"""
+        prefix = f"{d.isoformat()}_"
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        keys = (_decode_key(n[len(prefix):-len(SUFFIX)]) for n in names if n.startswith(prefix) and n.endswith(SUFFIX))
+        return sorted(k for k in keys if k is not None)
+
+    def get(self, d: date, key: str) -> RoundArchive | None:
+        with self._lock:
+            return self._get(d, key)
+
+    def _get(self, d: date, key: str) -> RoundArchive | None:
+        arch = self._cache.pop((d, key), None)
+        if arch is not None:
+            self._cache[(d, key)] = arch        # ย้ายไปท้าย (ใช้ล่าสุด)
+        else:
+            path = self.path_for(d, key)
+            try:
+                arch = RoundArchive.load(path, key)
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError) as e:
+                self.stats["errors"] += 1
+                logging.warning("[ROUNDS] unreadable archive %s: %s", path, e)
+                return None
+            self.stats["loaded"] += 1
+            self._put(d, key, arch)
+        return arch
+
+    def _put(self, d: date, key: str, arch: RoundArchive):
+        self._cache[(d, key)] = arch
+        newest = max(k[0] for k in self._cache)
+        older = [k for k in self._cache if k[0] != newest]
+        for k in older[:max(0, len(older) - self.MAX_CACHED)]:
+            del self._cache[k]
+
+    def sync(self, d: date, key: str, rows) -> RoundArchive:
+        """ต่อท้ายรอบใหม่ของ rows เข้าคลัง (และไฟล์) แล้วคืนคลังนั้น
+        rows ไม่ต่อจากของเดิม (ต้นทางแก้ย้อนหลัง) → สร้างคลังใหม่ทั้งวัน"""
+        with self._lock:
+            arch = self._get(d, key)
+            if arch is None or not arch.continues(rows):
+                if arch is not None:
+                    self.stats["rebuilt"] += 1
+                    logging.warning("[ROUNDS] %s %s: source rows changed, rebuilding archive", d, key)
+                    try:
+                        os.remove(arch.path)
+                    except OSError:
+                        pass
+                arch = RoundArchive(key, self.path_for(d, key))
+                self._put(d, key, arch)
+            n = len(arch)
+            if len(rows) > n:
+                arch.extend(rows[n:])
+                self.stats["appended"] += len(rows) - n
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                arch.flush()
+            except OSError as e:
+                # ไฟล์เป็นแค่ตัวเร่ง restart — คลังในหน่วยความจำยังใช้ได้ตามปกติ
+                self.stats["errors"] += 1
+                logging.warning("[ROUNDS] write failed for %s: %s", arch.path, e)
+            return arch
+
+    def sync_day(self, d: date, day: DayGames) -> DayGames:
+        """DayGames ที่ results ของทุกเกมเป็น RoundArchive (กลุ่มเดียวกันใช้คลังเดียวกัน)"""
+        world = self.sync(d, day.key, day.results) if day.key else day.results
+        games = {}
+        for gid, g in day.games.items():
+            arch = world if day.key and g.key == day.key else self.sync(d, g.key, g.results)
+            games[gid] = g._replace(results=arch)
+        return DayGames(day.key, world, games)
+
+    def load_day(self, d: date, meta: dict) -> DayGames | None:
+        """ประกอบ DayGames กลับจาก day_meta() + ไฟล์คลัง (ไม่มีไฟล์ของ world264 → None)"""
+        key = meta.get("key")
+        world = self.get(d, key) if key else []
+        if world is None:
+            return None
+        games = {}
+        for gid, (gk, t, st) in meta.get("games", {}).items():
+            arch = self.get(d, gk)
+            if arch is not None:
+                games[gid] = GameDay(gk, t, st, arch)
+        return DayGames(key, world, games)
+
+    def day_stats(self, d: date) -> tuple[int, int, int]:
+        """(จำนวนกลุ่ม, รอบรวม, ไบต์รวม) ของวันนั้นที่อยู่ในคลัง"""
+        groups = rounds = 0
+        for key in self.keys(d):
+            arch = self.get(d, key)
+            if arch is not None:
+                groups += 1
+                rounds += len(arch)
+        return groups, rounds, rounds * RECORD.size
+
+    def prune(self, cutoff: str) -> int:
+        """ลบไฟล์ของวันที่เก่ากว่า cutoff (YYYY-MM-DD)"""
+        removed = 0
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        with self._lock:
+            for name in names:
+                if name.endswith(SUFFIX) and name[:10] < cutoff:
+                    try:
+                        os.remove(os.path.join(self.root, name))
+                        removed += 1
+                    except OSError:
+                        pass
+            for k in [k for k in self._cache if k[0].isoformat() < cutoff]:
+                del self._cache[k]
+        return removed
+
+def day_meta(day: DayGames) -> dict:
+    """ส่วนของ DayGames ที่ไม่อยู่ในไฟล์คลัง (snapshot ใน state.py เก็บแค่นี้)"""
+    return {"key": day.key, "games": {gid: [g.key, g.lotto_type, g.lotto_subtype] for gid, g in day.games.items()}}
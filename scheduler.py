@@ -0,0 +1,132 @@
+# scheduler.py — กำหนดเวลา poll ตามจังหวะออกผลที่เรียนรู้ได้
+import os
+import time
+from datetime import date
+from statistics import median
+
+# ค่าเริ่มต้น (ปรับได้ด้วย ENV)
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "60"))          # ยังไม่รู้จังหวะ / เลยเวลาที่คาดไว้นาน
+POLL_BURST_INTERVAL = float(os.getenv("POLL_BURST_INTERVAL", "5"))
+POLL_LEAD = float(os.getenv("POLL_LEAD", "30"))                  # ตื่นก่อนเวลาที่คาดไว้กี่วินาที
+POLL_IDLE_INTERVAL = float(os.getenv("POLL_IDLE_INTERVAL", "600"))  # ช่วงกลางคืน / ไม่มีรอบใหม่นาน
+POLL_IDLE_AFTER = float(os.getenv("POLL_IDLE_AFTER", "2700"))
+
+class PollScheduler:
+    """เรียนรู้ว่ารอบใหม่ออกทุกกี่วินาที จากเวลาที่เห็นจำนวนรอบเพิ่มขึ้น
+
+    - หลับยาวจนเกือบถึงเวลาที่คาดว่า "รอบที่ปิดล็อค" จะออก (ไม่ต้องตื่นทุกรอบย่อย)
+    - ใกล้เวลาแล้ว poll ถี่ (burst) จนกว่ารอบนั้นจะมา
+    - เลยเวลาที่คาดไว้นานแล้วยังไม่มา (กลางคืน) → ถอยไปใช้ POLL_IDLE_INTERVAL
+    เวลาทั้งหมดเป็น time.time() และรับ now จากภายนอกได้ (ทดสอบด้วยนาฬิกาปลอมได้)
+    """
+
+    MAX_OBSERVATIONS = 64
+    MIN_CADENCE = 20.0
+    MAX_CADENCE = 3 * 3600.0
+    PRECISE_WINDOW = 90.0
+
+    def __init__(self, base_interval: float = POLL_INTERVAL, burst_interval: float = POLL_BURST_INTERVAL,
+                 lead: float = POLL_LEAD, idle_interval: float = POLL_IDLE_INTERVAL,
+                 idle_after: float = POLL_IDLE_AFTER):
+        self.base_interval = base_interval
+        self.burst_interval = burst_interval
+        self.lead = lead
+        self.idle_interval = idle_interval
+        self.idle_after = idle_after
+        self.day: date | None = None
+        self.observations: list[tuple[int, float, bool]] = []   # (จำนวนรอบ, เวลาออกโดยประมาณ, แม่นยำไหม)
+        self.last_cadence: float | None = None             # ยกข้ามวันได้
+        self.next_due: float | None = None
+        self.fetches_today = 0
+        self._last_poll: float | None = None
+
+    # ── input ──
+    def observe(self, day: date, round_count: int, now: float | None = None):
+        now = time.time() if now is None else now
+        if day != self.day:
+            self.day = day
+            self.observations = []
+            self.fetches_today = 0
+            self._last_poll = None
+        self.fetches_today += 1
+        prev_poll, self._last_poll = self._last_poll, now
+        if round_count <= 0 or (self.observations and round_count <= self.observations[-1][0]):
+            return
+
+        # รอบใหม่ออกระหว่าง poll ก่อนหน้ากับตอนนี้: ถ้าช่วงนั้นสั้นพอ ถือว่ารู้เวลาออกแน่นอน
+        precise = prev_poll is not None and now - prev_poll <= self.PRECISE_WINDOW
+        cad = self.cadence()
+        t_est = now
+        if not precise and self.observations and cad:
+            # หลับข้ามหลายรอบ: ประมาณเวลาออกของรอบล่าสุดจากจังหวะเดิม (ไม่ก่อน poll ก่อนหน้า)
+            prev_count, prev_t, _ = self.observations[-1]
+            t_est = min(now, max(prev_poll or prev_t, prev_t + (round_count - prev_count) * cad))
+        self.observations.append((round_count, t_est, precise))
+        del self.observations[:-self.MAX_OBSERVATIONS]
+        cad = self._estimate()
+        if cad is not None:
+            self.last_cadence = cad
+
+    def _estimate(self) -> float | None:
+        # ใช้เฉพาะจุดที่รู้เวลาออกแน่นอน
+        exact = [(c, t) for c, t, precise in self.observations if precise]
+        steps = [
+            (t2 - t1) / (c2 - c1)
+            for (c1, t1), (c2, t2) in zip(exact, exact[1:])
+        ]
+        if not steps:
+            return None
+        return min(max(median(steps), self.MIN_CADENCE), self.MAX_CADENCE)
+
+    def cadence(self) -> float | None:
+        return self._estimate() or self.last_cadence
+
+    # ── output ──
+    def next_delay(self, lock_size: int, now: float | None = None) -> float:
+        now = time.time() if now is None else now
+        delay = self._delay(lock_size, now)
+        self.next_due = now + delay
+        return delay
+
+    def _delay(self, lock_size: int, now: float) -> float:
+        cad = self.cadence()
+        if not self.observations:
+            # วันใหม่ยังไม่มีรอบ (กลางคืน): ถอยได้ แต่ไม่เกินเวลาที่ล็อคแรกจะครบ
+            if cad is None:
+                return self.base_interval
+            return min(self.idle_interval, max(self.base_interval, cad * (lock_size - 1)))
+        count, last_seen, _ = self.observations[-1]
+        if cad is None:
+            return self.base_interval
+
+        target = (count // lock_size + 1) * lock_size
+        expected = last_seen + (target - count) * cad
+        wake = expected - min(self.lead, cad / 4)
+        if now < wake:
+            return wake - now
+        if now < expected + 2 * cad:
+            return self.burst_interval
+        if now < expected + max(self.idle_after, 3 * cad):
+            return self.base_interval
+        return self.idle_interval
+
+    def on_track(self, now: float | None = None, grace: float = 60.0) -> bool:
+        """poller ยังทำงานตามนัดอยู่ไหม (ใช้ตัดสินใจเติม heartbeat)"""
+        now = time.time() if now is None else now
+        return self.next_due is not None and now <= self.next_due + grace
+
+    # ── persistence (เก็บรวมกับ state รายวัน) ──
+    def to_dict(self) -> dict:
+        return {
+            "day": self.day.isoformat() if self.day else None,
+            "observations": [list(o) for o in self.observations],
+            "last_cadence": self.last_cadence,
+        }
+
+    def restore(self, d: dict):
+        if not d:
+            return
+        if d.get("day"):
+            self.day = date.fromisoformat(d["day"])
+            self.observations = [(int(c), float(t), bool(p)) for c, t, p in d.get("observations", [])]
+        self.last_cadence = d.get("last_cadence") or self.last_cadence
@@ -1,10 +1,69 @@
 # server.py
-import os, threading, traceback, sys, asyncio, time, json
-from fastapi import FastAPI, Response
+import metrics  # import ก่อนอย่างอื่น: เวลา boot นับจากตรงนี้
+import os, threading, traceback, sys, asyncio, time, json, hmac, importlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 import uvicorn
-import bot  # โมดูลบอทของเรา
 
-app = FastAPI()
+# โมดูลบอทของเรา — import ทีหลังในเธรดแยก (telegram/httpx/dotenv + ตรวจ token ช้า)
+# เพื่อให้ uvicorn ตอบ / และ /healthz ได้ทันทีที่ process ขึ้น
+bot = None
+boot_error: str | None = None
+
+# โหมด webhook: Application ของบอทรันบน event loop เดียวกับ uvicorn (ไม่มีเธรดบอท)
+tg_app = None
+
+async def boot():
+    """import บอท → warm-up จาก snapshot → เริ่มรับ update (webhook หรือเธรด polling)"""
+    global bot, boot_error, tg_app, bot_thread
+    try:
+        mod = await asyncio.to_thread(importlib.import_module, "bot")
+        print(f"[SERVER] bot imported at {metrics.boot_mark('bot_imported')}s", flush=True)
+        await asyncio.to_thread(mod.warm_up)
+        bot = mod
+        if bot.BOT_MODE == "webhook":
+            # webhook: ทุก instance รับคำสั่งได้ แต่ poll/broadcast เฉพาะ leader (poll_job เช็ค lease)
+            bot.leader.start()
+            app_ = bot.build_application("webhook")
+            await app_.initialize()
+            await app_.post_init(app_)
+            await app_.start()
+            tg_app = app_
+            print(f"[SERVER] webhook mode: {bot.webhook_url()}", flush=True)
+        else:
+            # BOT_MODE=polling (หรือไม่มี WEBHOOK_URL) → ทางสำรอง: run_polling ในเธรดแยกแบบเดิม
+            bot_thread = threading.Thread(target=run_bot, daemon=True)
+            bot_thread.start()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        boot_error = traceback.format_exc()
+        print("[SERVER] boot failed:\n" + boot_error, file=sys.stderr, flush=True)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global tg_app
+    boot_task = asyncio.create_task(boot())
+    print(f"[SERVER] http ready at {metrics.boot_mark('http_ready')}s", flush=True)
+    try:
+        yield
+    finally:
+        if not boot_task.done():
+            boot_task.cancel()
+            try:
+                await boot_task
+            except asyncio.CancelledError:
+                pass
+        if tg_app is not None:
+            await tg_app.stop()
+            await tg_app.shutdown()
+            await tg_app.post_shutdown(tg_app)
+            tg_app = None
+        if bot is not None:
+            # คืน lease ทันที ให้ instance ใหม่รับช่วงได้ภายในไม่กี่วินาที
+            await asyncio.to_thread(bot.leader.release)
+
+app = FastAPI(lifespan=lifespan)
 
 # กำหนดอายุ heartbeat สูงสุดก่อนถือว่าไม่สุขภาพดี (วินาที)
 HB_MAX_AGE = int(os.getenv("HB_MAX_AGE", "180"))
@@ -14,7 +73,7 @@ bot_thread = None
 
 @app.api_route("/", methods=["GET", "HEAD"])
 def root():
-    return {"ok": True, "service": "world264-analysis-bot"}
+    return {"ok": True, "service": "world264-analysis-bot", "booting": bot is None}
 
 @app.api_route("/healthz", methods=["GET", "HEAD"])
 def healthz():
@@ -24,15 +83,27 @@ def healthz():
     hb_age = round(now - hb, 1) if hb else None
     bc_age = round(now - bc, 1) if bc else None
 
-    alive = bot_thread.is_alive() if bot_thread else False
-    healthy = bool(alive and hb_age is not None and hb_age < HB_MAX_AGE)
+    if bot_thread is not None:
+        alive = bot_thread.is_alive()
+    else:
+        alive = bool(tg_app is not None and tg_app.running)
+    # standby (อีก instance ถือ lease) ไม่ poll จึงไม่มี heartbeat — ถือว่าปกติตราบที่ยังรอ lease อยู่
+    standby = bot is not None and not bot.leader.is_leader
+    if standby:
+        healthy = bool(alive and bot.leader.running)
+    else:
+        healthy = bool(alive and hb_age is not None and hb_age < HB_MAX_AGE)
 
     status = {
         "ok": healthy,
         "alive": alive,
+        "booting": bot is None and boot_error is None,
+        "role": None if bot is None else ("standby" if standby else "leader"),
+        "boot_failed": boot_error is not None,
         "hb_age_s": hb_age,
         "last_broadcast_age_s": bc_age,
         "max_hb_age_s": HB_MAX_AGE,
+        "boot_s": metrics.BOOT_TIMINGS,
     }
     return Response(
         content=json.dumps(status),
@@ -40,10 +111,30 @@ def healthz():
         status_code=200 if healthy else 503,
     )
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/favicon.ico")
 def favicon():
     return Response(status_code=204)
 
+# path ของ webhook อยู่ใน config ของบอท (รู้หลัง import) → รับทุก POST แล้วเทียบ path เอง
+@app.post("/{path:path}")
+async def telegram_webhook(path: str, request: Request):
+    if tg_app is None:
+        # ยัง boot ไม่เสร็จ: 503 ให้ Telegram ส่งซ้ำภายหลัง
+        return Response(status_code=503)
+    if "/" + path != bot.WEBHOOK_PATH:
+        return Response(status_code=404)
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, bot.WEBHOOK_SECRET):
+        return Response(status_code=403)
+    from telegram import Update  # โหลดไปแล้วตอน import บอท
+    # เข้าคิวแล้วตอบ 200 ทันที — handler รันต่อบน loop เดียวกัน
+    await tg_app.update_queue.put(Update.de_json(await request.json(), tg_app.bot))
+    return Response(status_code=200)
+
 def run_bot():
     print("[SERVER] starting bot thread...", flush=True)
     # 🔁 autorestart: ถ้าบอทล้ม ให้รันใหม่อัตโนมัติ
@@ -57,9 +148,6 @@ def run_bot():
             time.sleep(3)  # backoff ก่อนลองใหม่
 
 if __name__ == "__main__":
-    bot_thread = threading.Thread(target=run_bot, daemon=True)
-    bot_thread.start()
-
     port = int(os.getenv("PORT", "10000"))
     print(f"[SERVER] uvicorn listening on 0.0.0.0:{port}", flush=True)
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,467 @@
+# state.py — state รายวัน + ประวัติรายล็อค (SQLite WAL, cache ในหน่วยความจำ, write-behind)
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import date, timedelta
+
+from dayparse import WORLD264_GAME, DayGames, day_games_to_dict, day_games_from_dict
+from lease import LEASE_SCHEMA, token_is_current
+from rounds import RoundArchive, RoundStore, day_meta
+
+STATE_DB_NAME = os.getenv("STATE_DB_NAME", "world264_state.sqlite3")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))
+STATE_RETENTION_DAYS = int(os.getenv("STATE_RETENTION_DAYS", "14"))
+# prune คืนพื้นที่ทีละกี่ page ต่อการถือ lock หนึ่งครั้ง (get/begin_lock บน event loop แทรกได้ระหว่างช่วง)
+STATE_VACUUM_STEP = int(os.getenv("STATE_VACUUM_STEP", "256"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS day_state (
+    day     TEXT PRIMARY KEY,
+    data    TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS game_state (
+    day     TEXT NOT NULL,
+    game    TEXT NOT NULL,           -- state["games"][game] ของเกมอื่นนอกจาก world264
+    data    TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (day, game)
+);
+CREATE TABLE IF NOT EXISTS lock_history (
+    day       TEXT    NOT NULL,
+    game      TEXT    NOT NULL,      -- game id เช่น "01-22" (world264)
+    lock_size INTEGER NOT NULL,
+    usable    INTEGER NOT NULL,      -- รอบที่ครบล็อคนี้ (รอบ 1..usable ถูกวิเคราะห์)
+    rows      TEXT    NOT NULL,      -- [[top3, bottom2], ...] ของล็อคนี้
+    report    TEXT,
+    status    TEXT    NOT NULL,      -- sending | sent | partial | failed | skipped
+    sent      INTEGER NOT NULL DEFAULT 0,
+    targets   INTEGER NOT NULL DEFAULT 0,
+    errors    TEXT,                  -- {chat_id: error}
+    created   REAL    NOT NULL,
+    updated   REAL    NOT NULL,
+    PRIMARY KEY (day, game, lock_size, usable)
+);
+CREATE TABLE IF NOT EXISTS day_snapshot (
+    day           TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    data          TEXT NOT NULL,     -- day_meta() (แถวอยู่ในไฟล์ของ RoundStore) หรือ day_games_to_dict() รุ่นเก่า
+    updated       REAL NOT NULL
+);
+"""
+
+_LOCK_COLUMNS = "lock_size, usable, rows, report, status, sent, targets, errors, created, updated"
+
+def _migrate(db: sqlite3.Connection):
+    """lock_history รุ่นแรกไม่มีคอลัมน์ game (มีแต่ world264) → สร้างตารางใหม่แล้วย้ายข้อมูล"""
+    cols = [r[1] for r in db.execute("PRAGMA table_info(lock_history)")]
+    if "game" in cols:
+        return
+    db.execute("BEGIN IMMEDIATE")
+    db.execute("ALTER TABLE lock_history RENAME TO lock_history_v1")
+    db.execute(_SCHEMA[_SCHEMA.index("CREATE TABLE IF NOT EXISTS lock_history"):])
+    db.execute(f"INSERT INTO lock_history (day, game, {_LOCK_COLUMNS}) "
+               f"SELECT day, '{WORLD264_GAME}', {_LOCK_COLUMNS} FROM lock_history_v1")
+    db.execute("DROP TABLE lock_history_v1")
+    db.execute("COMMIT")
+    logging.info("[STATE] migrated lock_history to per-game rows")
+
+def _enable_incremental_vacuum(db: sqlite3.Connection):
+    """ไฟล์ที่สร้างก่อนมี auto_vacuum=INCREMENTAL ต้อง VACUUM ครั้งเดียวถึงจะเปลี่ยนได้
+    (ทำตอนเปิด connection ครั้งแรก — warm-up นอก event loop)"""
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    db.execute("VACUUM")
+    logging.info("[STATE] switched database to incremental vacuum")
+
+def _day_doc(state: dict) -> str:
+    """แถว day_state: state ของวันยกเว้น "games" (แต่ละเกมอยู่ในแถว game_state ของตัวเอง)"""
+    return json.dumps({k: v for k, v in state.items() if k != "games"}, ensure_ascii=False)
+
+def _serialize(state: dict, game: str | None) -> str:
+    return _day_doc(state) if game is None else json.dumps(state["games"][game], ensure_ascii=False)
+
+def _legacy_file(state_dir: str, d: date) -> str:
+    return os.path.join(state_dir, f".world264_state_{d.isoformat()}.json")
+
+class StateStore:
+    """state ต่อวัน (dict เดิมของ load_state/save_state) + ประวัติรายล็อค
+
+    - get() อ่านจาก cache ในหน่วยความจำ; แตะดิสก์ครั้งเดียวต่อวัน (หรือไฟล์ JSON เก่าถ้ายังไม่เคยย้าย)
+    - save() serialize ทันทีแล้วให้เธรด flusher เขียนลง SQLite ภายหลัง (write-behind, รวมหลายครั้งเป็น 1 transaction)
+    - state["games"][gid] ของแต่ละเกมเป็นแถวแยก (game_state): save(..., game=gid) / begin_lock ของเกมนั้น
+      serialize เฉพาะเกมนั้น — ค่าใช้จ่ายต่อล็อคไม่โตตามจำนวนเกมทั้งหมด
+    - save(..., durable=True) / begin_lock() เขียนทันที — ใช้ก่อน broadcast เพื่อให้ crash แล้วไม่ส่งซ้ำ
+    - เขียนแบบ transaction ใน WAL: crash กลางทางได้ state เก่าทั้งก้อน ไม่ใช่ไฟล์ว่าง
+    - save_snapshot() เก็บไฟล์รายวันที่ parse แล้ว + ETag ล่าสุด (write-behind) ให้ warm-up หลังรีสตาร์ท
+      แถวของแต่ละรอบอยู่ใน rounds (RoundStore: ไฟล์ไบนารีต่อวัน/กลุ่มใต้ state_dir/rounds) — snapshot เก็บแค่ meta
+    - ลบวันที่เก่ากว่า retention_days (รวมไฟล์ JSON แบบเดิม) วันละครั้ง
+    """
+
+    MAX_CACHED_DAYS = 3
+
+    def __init__(self, state_dir: str, db_name: str = STATE_DB_NAME,
+                 flush_interval: float = STATE_FLUSH_INTERVAL, retention_days: int = STATE_RETENTION_DAYS):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, db_name)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._lock = threading.RLock()
+        self._cache: dict[date, dict] = {}
+        self._dirty: dict[tuple[date, str | None], str] = {}    # (วัน, game id หรือ None = แถว day_state)
+        self._snapshot: tuple | None = None      # (day, etag, last_modified, DayGames) รอเขียน
+        self._wake = threading.Event()
+        self._flusher: threading.Thread | None = None
+        self._pruned_for: date | None = None
+        self.stats = {"reads": 0, "writes": 0, "flushes": 0, "migrated": 0, "pruned": 0}
+        self._conn: sqlite3.Connection | None = None
+        self.rounds = RoundStore(os.path.join(state_dir, "rounds"))
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # เปิดใหม่ได้หลัง close() (บอทถูกรีสตาร์ทในโปรเซสเดิม)
+        if self._conn is None:
+            self._conn = self._open()
+        return self._conn
+
+    def _open(self) -> sqlite3.Connection:
+        os.makedirs(self.state_dir, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL")   # มีผลทันทีกับไฟล์ใหม่ (ก่อนสร้างตาราง)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA + LEASE_SCHEMA)
+        _migrate(db)
+        _enable_incremental_vacuum(db)
+        return db
+
+    # ── day state ──
+    def get(self, d: date) -> dict:
+        """dict ของวันนั้น (ตัวเดียวกับใน cache — แก้แล้วต้อง save() เพื่อบันทึก)"""
+        with self._lock:
+            state = self._cache.get(d)
+            if state is None:
+                state = self._load(d)
+                self._cache[d] = state
+                while len(self._cache) > self.MAX_CACHED_DAYS:
+                    old = next(iter(self._cache))
+                    if self._is_dirty(old):
+                        break
+                    del self._cache[old]
+            return state
+
+    def _is_dirty(self, d: date) -> bool:
+        return any(k[0] == d for k in self._dirty)
+
+    def _load(self, d: date) -> dict:
+        self.stats["reads"] += 1
+        state = self._load_day(d)
+        # แถวรุ่นก่อน (หรือไฟล์ JSON) เก็บทุกเกมไว้ในแถวของวัน → ย้ายไปแถวของแต่ละเกม
+        migrate = bool(state.get("games"))
+        games = state.setdefault("games", {})
+        for gid, data in self._db.execute("SELECT game, data FROM game_state WHERE day = ?", (d.isoformat(),)):
+            try:
+                games[gid] = json.loads(data)
+            except ValueError as e:
+                logging.error("[STATE] corrupt game row for %s %s: %s", d, gid, e)
+        if migrate:
+            self._mark_all(d, state)
+        return state
+
+    def _load_day(self, d: date) -> dict:
+        row = self._db.execute("SELECT data FROM day_state WHERE day = ?", (d.isoformat(),)).fetchone()
+        if row:
+            try:
+                return json.loads(row[0])
+            except ValueError as e:
+                logging.error("[STATE] corrupt row for %s: %s", d, e)
+        # ย้ายจากไฟล์ JSON แบบเดิม (กันส่งซ้ำหลังอัปเกรด)
+        legacy = _legacy_file(self.state_dir, d)
+        if os.path.exists(legacy):
+            try:
+                with open(legacy, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+            except Exception as e:
+                logging.warning("[STATE] legacy file unreadable %s: %s", legacy, e)
+            else:
+                self.stats["migrated"] += 1
+                self._mark_all(d, state)
+                return state
+        return {"last_processed_round_count": 0}
+
+    def _mark_all(self, d: date, state: dict):
+        """ให้ flusher เขียนทั้งแถวของวันและทุกเกม (ที่ยังไม่มีงานเขียนใหม่กว่ารออยู่)"""
+        self._dirty.setdefault((d, None), _day_doc(state))
+        for gid, gstate in state.get("games", {}).items():
+            self._dirty.setdefault((d, gid), json.dumps(gstate, ensure_ascii=False))
+        self._ensure_flusher()
+        self._wake.set()
+
+    def save(self, d: date, state: dict, durable: bool = False, game: str | None = None):
+        """game=None: แถวของวัน (ทุกอย่างยกเว้น "games"), game=gid: เฉพาะ state["games"][gid]"""
+        key = (d, game)
+        data = _serialize(state, game)
+        with self._lock:
+            self._cache[d] = state
+            self._dirty[key] = data
+            if durable:
+                try:
+                    self._write({key: data})
+                    del self._dirty[key]
+                    return
+                except sqlite3.Error:
+                    pass                     # ให้ flusher ลองใหม่
+        self._ensure_flusher()
+        self._wake.set()
+
+    def invalidate(self):
+        """ทิ้ง cache ที่ไม่มีงานค้างเขียน — อ่านใหม่จาก SQLite (instance อื่นอาจเขียนไปแล้ว)"""
+        with self._lock:
+            for d in [d for d in self._cache if not self._is_dirty(d)]:
+                del self._cache[d]
+
+    # ── lock history ──
+    def begin_lock(self, d: date, lock_size: int, usable: int, rows: list[dict],
+                   report: str | None, targets: int, state: dict | None = None, game: str = WORLD264_GAME,
+                   fence: tuple[str, int] | None = None) -> bool:
+        """บันทึกล็อคที่กำลังจะส่ง (status=sending) พร้อม state ใน transaction เดียว แล้ว commit ทันที
+        state = dict ของวัน; เขียนเฉพาะส่วนของ game (world264 = แถวของวัน, เกมอื่น = แถว game_state ของเกมนั้น)
+
+        fence=(ชื่อ lease, token): ถ้ามี instance อื่นยึด lease ไปแล้วจะไม่บันทึกอะไรและคืน False
+        SQLite พัง → คืน False เช่นกัน (ไม่มีอะไรถูกบันทึก ผู้เรียกย้อน state ของตัวเองแล้วลองใหม่ poll ถัดไป)"""
+        now = time.time()
+        status = "sending" if report and targets else "skipped"
+        part = None if game == WORLD264_GAME else game
+        data = _serialize(state, part) if state is not None else None
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                if fence is not None and not token_is_current(self._db, *fence):
+                    self._db.execute("ROLLBACK")
+                    logging.warning("[STATE] lock %s %s %s/%s fenced out (token %s)",
+                                    d, game, usable, lock_size, fence[1])
+                    return False
+                if data is not None:
+                    self._write_rows({(d, part): data}, now)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO lock_history "
+                    f"(day, game, {_LOCK_COLUMNS}) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, NULL, ?, ?)",
+                    (d.isoformat(), game, lock_size, usable,
+                     json.dumps([[r["top3"], r["bottom2"]] for r in rows]),
+                     report, status, targets, now, now),
+                )
+                self._db.execute("COMMIT")
+                self.stats["writes"] += 1
+            except sqlite3.Error as e:
+                self._rollback()
+                logging.error("[STATE_SAVE_ERROR] lock %s %s %d/%d: %s", d, game, usable, lock_size, e)
+                return False
+            if state is not None:
+                # ถึงดิสก์แล้วเท่านั้นจึงเลิกรอเขียน (commit พัง → งานค้างเดิมยังอยู่)
+                self._cache[d] = state
+                self._dirty.pop((d, part), None)
+        return True
+
+    def finish_lock(self, d: date, lock_size: int, usable: int, deliveries, game: str = WORLD264_GAME):
+        """ผลการส่งของล็อค (list ของ DeliveryResult) — ไม่เร่งด่วน แต่เขียนใน transaction เดียว"""
+        sent = sum(1 for x in deliveries if x.ok)
+        errors = {str(x.chat_id): x.error for x in deliveries if not x.ok}
+        status = "sent" if not errors else ("partial" if sent else "failed")
+        with self._lock:
+            try:
+                self._db.execute(
+                    "UPDATE lock_history SET status = ?, sent = ?, errors = ?, updated = ? "
+                    "WHERE day = ? AND game = ? AND lock_size = ? AND usable = ?",
+                    (status, sent, json.dumps(errors) if errors else None, time.time(),
+                     d.isoformat(), game, lock_size, usable),
+                )
+                self.stats["writes"] += 1
+            except sqlite3.Error as e:
+                logging.error("[STATE_SAVE_ERROR] lock %s %s %s/%s: %s", d, game, usable, lock_size, e)
+
+    def lock_history(self, d: date, lock_size: int | None = None, limit: int = 100,
+                     game: str = WORLD264_GAME) -> list[dict]:
+        sql = f"SELECT {_LOCK_COLUMNS} FROM lock_history WHERE day = ? AND game = ?"
+        args: list = [d.isoformat(), game]
+        if lock_size is not None:
+            sql += " AND lock_size = ?"
+            args.append(lock_size)
+        sql += " ORDER BY updated DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [
+            {"lock_size": ls, "usable": usable, "rows": json.loads(rows_json), "report": report,
+             "status": status, "sent": sent, "targets": targets,
+             "errors": json.loads(errors) if errors else {}, "created": created, "updated": updated}
+            for ls, usable, rows_json, report, status, sent, targets, errors, created, updated in rows
+        ]
+
+    # ── snapshot ไฟล์รายวัน ──
+    def save_snapshot(self, d: date, day: DayGames, etag: str | None = None, last_modified: str | None = None):
+        """เก็บเฉพาะตัวล่าสุด; serialize และเขียนในเธรด flusher (ไม่กิน event loop)"""
+        with self._lock:
+            self._snapshot = (d, etag, last_modified, day)
+        self._ensure_flusher()
+        self._wake.set()
+
+    def load_snapshot(self, d: date) -> tuple[str | None, str | None, DayGames] | None:
+        with self._lock:
+            pending = self._snapshot
+            if pending is not None and pending[0] == d:
+                return pending[1], pending[2], pending[3]
+            row = self._db.execute(
+                "SELECT etag, last_modified, data FROM day_snapshot WHERE day = ?", (d.isoformat(),)
+            ).fetchone()
+        if not row:
+            return None
+        try:
+            doc = json.loads(row[2])
+            if "rows" in doc:
+                return row[0], row[1], day_games_from_dict(doc)     # snapshot รุ่นก่อน: แถวเป็น JSON
+            day = self.rounds.load_day(d, doc)
+            if day is None:
+                return None
+            return row[0], row[1], day
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error("[STATE] corrupt snapshot for %s: %s", d, e)
+            return None
+
+    def _write_snapshot(self, snap: tuple):
+        d, etag, last_modified, day = snap
+        doc = day_meta(day) if isinstance(day.results, RoundArchive) else day_games_to_dict(day)
+        data = json.dumps(doc, separators=(",", ":"))
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO day_snapshot (day, etag, last_modified, data, updated) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (d.isoformat(), etag, last_modified, data, time.time()),
+                )
+                self.stats["writes"] += 1
+            except sqlite3.Error as e:
+                # snapshot เป็นแค่ตัวเร่ง boot — พลาดก็ไม่ลองใหม่
+                logging.warning("[STATE] snapshot write failed for %s: %s", d, e)
+
+    # ── write-behind ──
+    def _write_rows(self, batch: dict[tuple[date, str | None], str], now: float):
+        """ภายใน transaction ของผู้เรียก"""
+        self._db.executemany(
+            "INSERT OR REPLACE INTO day_state (day, data, updated) VALUES (?, ?, ?)",
+            [(d.isoformat(), data, now) for (d, game), data in batch.items() if game is None],
+        )
+        self._db.executemany(
+            "INSERT OR REPLACE INTO game_state (day, game, data, updated) VALUES (?, ?, ?, ?)",
+            [(d.isoformat(), game, data, now) for (d, game), data in batch.items() if game is not None],
+        )
+
+    def _write(self, batch: dict[tuple[date, str | None], str]):
+        now = time.time()
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._write_rows(batch, now)
+            self._db.execute("COMMIT")
+            self.stats["writes"] += len(batch)
+        except sqlite3.Error as e:
+            self._rollback()
+            logging.error("[STATE_SAVE_ERROR] %s", e)
+            raise
+
+    def _rollback(self):
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK")
+
+    def flush(self):
+        with self._lock:
+            snap, self._snapshot = self._snapshot, None
+        if snap is not None:
+            self._write_snapshot(snap)
+        with self._lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            try:
+                self._write(batch)
+                self.stats["flushes"] += 1
+            except sqlite3.Error:
+                # เก็บไว้ลองใหม่รอบหน้า (ยกเว้นที่ถูก save ทับไปแล้ว)
+                for key, data in batch.items():
+                    self._dirty.setdefault(key, data)
+                return
+            today = max(d for d, _ in batch)
+        if today != self._pruned_for:
+            self.prune(today)
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="state-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # รอให้ save ที่ตามมาติดๆ รวมเป็น transaction เดียว
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("[STATE] flush failed: %s", e)
+
+    # ── retention ──
+    def prune(self, today: date):
+        """ลบวันที่เก่ากว่า retention_days คืนพื้นที่ แล้ว checkpoint WAL ให้ไฟล์ไม่โตเรื่อยๆ
+
+        ไม่ VACUUM ทั้งไฟล์ใต้ lock (get/begin_lock บน event loop จะค้างรอทั้งหมด) —
+        ใช้ incremental_vacuum ทีละ STATE_VACUUM_STEP page แล้วปล่อย lock ระหว่างช่วง"""
+        cutoff = (today - timedelta(days=self.retention_days)).isoformat()
+        with self._lock:
+            self._pruned_for = today
+            try:
+                n = self._db.execute("DELETE FROM day_state WHERE day < ?", (cutoff,)).rowcount
+                n += self._db.execute("DELETE FROM game_state WHERE day < ?", (cutoff,)).rowcount
+                n += self._db.execute("DELETE FROM lock_history WHERE day < ?", (cutoff,)).rowcount
+                n += self._db.execute("DELETE FROM day_snapshot WHERE day < ?", (cutoff,)).rowcount
+            except sqlite3.Error as e:
+                logging.warning("[STATE] prune failed: %s", e)
+                return
+        try:
+            free = None
+            while True:
+                with self._lock:
+                    left = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+                    if not left or left == free:     # หมดแล้ว / ไฟล์ไม่ใช่ auto_vacuum=INCREMENTAL
+                        break
+                    free = left
+                    # executescript: execute() เดินคำสั่งแค่ step เดียว = คืนแค่ page เดียว
+                    self._db.executescript(f"PRAGMA incremental_vacuum({STATE_VACUUM_STEP})")
+            with self._lock:
+                self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            logging.warning("[STATE] vacuum failed: %s", e)
+        removed = self.rounds.prune(cutoff)
+        for name in os.listdir(self.state_dir):
+            if name.startswith(".world264_state_") and name.endswith(".json") and \
+               name[len(".world264_state_"):-len(".json")] < cutoff:
+                try:
+                    os.remove(os.path.join(self.state_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        self.stats["pruned"] += n + removed
+        if n or removed:
+            logging.info("[STATE] pruned %s rows and %s files older than %s", n, removed, cutoff)
+
+    def close(self):
+        """flush แล้วปิด connection — เรียกใช้ต่อได้ (เปิดใหม่เองเมื่อบอทถูกรีสตาร์ท)"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,5 @@
+# โมดูลของบอทอยู่ที่รากของ repo (ไม่ใช่ package) — ให้ test import ได้ตรงๆ
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
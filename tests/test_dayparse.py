@@ -0,0 +1,97 @@
+# dayparse: stream parser (ทีละ chunk) ต้องได้ผลเหมือนทางเดิมที่ decode ทั้งเอกสาร
+# (pick_world264_key + extract_all_results_sorted / extract_games)
+import json
+import random
+
+import pytest
+
+from dayparse import (
+    pick_world264_key, extract_all_results_sorted, extract_games,
+    World264StreamParser, GamesStreamParser, parse_world264, parse_games,
+)
+
+GAME_TYPES = [("01", "22"), ("02", "01"), ("03", "05"), ("01", "23")]
+
+def random_record(rng: random.Random, t: str, st: str, i: int) -> dict:
+    rec = {"round_number": str(i) if rng.random() < 0.9 else rng.choice([i, "x", None, "70000"]),
+           "lotto_type": t, "lotto_subtype": st}
+    if rng.random() < 0.9:
+        top3 = f"{rng.randrange(1000):03d}" if rng.random() < 0.95 else rng.choice(["๑๒๓", "12", None])
+        rec["result"] = {"top_three": top3, "bottom_two": f"{rng.randrange(100):02d}"}
+    return rec
+
+def random_day(rng: random.Random) -> dict:
+    doc = {}
+    for g in range(rng.randrange(0, 7)):
+        t, st = rng.choice(GAME_TYPES)
+        key = rng.choice(["0122", f"{t}{st}", f"g{g}", f"{t}{st}x"])
+        kind = rng.random()
+        if kind < 0.05:
+            doc[key] = [1, 2]                                   # กลุ่มที่ไม่ใช่ object
+        elif kind < 0.1:
+            doc[key] = {}
+        elif kind < 0.15:
+            doc[key] = {"b": random_record(rng, t, st, 1), "a": 1}  # รอบที่ไม่ใช่ object
+        else:
+            order = list(range(1, rng.randrange(2, 31)))
+            rng.shuffle(order)
+            doc[key] = {f"r{i}": random_record(rng, t, st, i) for i in order}
+    return doc
+
+def whole_document(doc: dict):
+    key = pick_world264_key(doc)
+    return key, extract_all_results_sorted(doc, key) if key else [], extract_games(doc)
+
+def stream(parser_cls, data: bytes, rng: random.Random):
+    p = parser_cls()
+    pos = 0
+    while pos < len(data):
+        step = rng.randrange(1, 200)
+        p.feed(data[pos:pos + step])
+        pos += step
+    return p.close()
+
+@pytest.mark.parametrize("seed", range(200))
+def test_stream_parsers_match_whole_document(seed):
+    rng = random.Random(seed)
+    doc = random_day(rng)
+    data = json.dumps(doc, indent=rng.choice([None, 1]), ensure_ascii=rng.random() < 0.5).encode()
+    key, results, games = whole_document(json.loads(data))
+
+    got = stream(GamesStreamParser, data, rng)
+    assert (got.key, got.results) == (key, results)
+    assert got.games == games
+    w = stream(World264StreamParser, data, rng)
+    assert (w.key, w.results) == (key, results)
+    assert parse_games(data) == got
+    assert parse_world264(data) == w
+
+@pytest.mark.parametrize("seed", range(30))
+def test_truncated_file_is_rejected_both_ways(seed):
+    rng = random.Random(seed)
+    doc = random_day(rng) or {"0122": {"r1": random_record(rng, "01", "22", 1)}}
+    data = json.dumps(doc).encode()
+    cut = data[:rng.randrange(1, len(data))]
+    with pytest.raises(ValueError):
+        json.loads(cut)
+    for parse in (parse_world264, parse_games):
+        with pytest.raises(ValueError):
+            parse(cut)
+    p = GamesStreamParser()
+    p.feed(cut)
+    with pytest.raises(ValueError):
+        p.close()
+
+@pytest.mark.parametrize("bad", [
+    b'{"0122": {"r1": {"lotto_type": "01",, "lotto_subtype": "22"}}}',
+    b'{"0122": {"r1": {"lotto_type": "01" "lotto_subtype": "22"}}}',
+    b'{"0122": {"r1" {"lotto_type": "01"}}}',
+    b'{"0122": {"r1": {"lotto_type": "01"}} "0223": {}}',
+    b'{"0122": {"r1": {"lotto_type": "01"}}}}',
+])
+def test_malformed_object_is_rejected_both_ways(bad):
+    with pytest.raises(ValueError):
+        json.loads(bad)
+    for parse in (parse_world264, parse_games):
+        with pytest.raises(ValueError):
+            parse(bad)
@@ -0,0 +1,94 @@
+# สูตร 1: ตาราง bit-mask (analyze_3_digit_combos / ComboAccumulator / MultiLockEngine)
+# ต้องให้ผลเหมือนทางเดิมแบบ set (analyze_3_digit_combos_reference) ทุกไบต์
+import random
+
+import pytest
+
+from analysis import (
+    analyze_3_digit_combos, analyze_3_digit_combos_reference,
+    ComboAccumulator, MultiLockEngine, LOCK_SIZE_RANGE,
+)
+from rounds import RoundArchive
+
+SEEDS = range(40)
+
+def random_day(rng: random.Random, n: int) -> list[str]:
+    """เลข 3 ตัว n รอบ — ปนเลขเบิ้ล (หลักสิบ = หน่วย) ให้บ่อยกว่าของจริง"""
+    nums = []
+    for _ in range(n):
+        t = rng.randrange(10)
+        u = t if rng.random() < 0.2 else rng.randrange(10)
+        nums.append(f"{rng.randrange(10)}{t}{u}")
+    return nums
+
+def as_rows(nums: list[str]) -> list[dict]:
+    return [{"round": i + 1, "top3": t3, "bottom2": f"{i % 100:02d}"} for i, t3 in enumerate(nums)]
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_bitmask_tables_match_reference(seed):
+    rng = random.Random(seed)
+    nums = random_day(rng, rng.randrange(0, 70))
+    for size in LOCK_SIZE_RANGE:
+        assert analyze_3_digit_combos(nums, size) == analyze_3_digit_combos_reference(nums, size)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_accumulator_matches_reference_at_every_round(seed):
+    rng = random.Random(seed)
+    nums = random_day(rng, rng.randrange(1, 50))
+    size = rng.choice(LOCK_SIZE_RANGE)
+    acc = ComboAccumulator(size)
+    for i, num in enumerate(nums, 1):
+        acc.feed(num)
+        if rng.random() < 0.3:
+            # ตัวนับที่ถูกเก็บลง state แล้วโหลดกลับต้องนับต่อได้เหมือนเดิม
+            acc = ComboAccumulator.from_dict(acc.to_dict())
+        assert acc.report() == analyze_3_digit_combos_reference(nums[:i], size)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_accumulator_feed_tu_matches_reference(seed):
+    rng = random.Random(seed)
+    nums = random_day(rng, rng.randrange(1, 60))
+    arch = RoundArchive.from_rows("w", as_rows(nums))
+    size = rng.choice(LOCK_SIZE_RANGE)
+    acc = ComboAccumulator(size)
+    cut = rng.randrange(len(nums) + 1)
+    acc.feed_tu(arch.t[:cut], arch.u[:cut])
+    acc.feed_tu(arch.t[cut:], arch.u[cut:])
+    assert acc.report() == analyze_3_digit_combos_reference(nums, size)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_multi_lock_engine_matches_reference(seed):
+    rng = random.Random(seed)
+    nums = random_day(rng, rng.randrange(1, 60))
+    eng = MultiLockEngine()
+    eng.extend(as_rows(nums))
+    # upto ไม่เรียง: ย้อนกลับต้องนับใหม่, ไปข้างหน้าต้องเติมต่อ — รวมล็อคที่ยังไม่ครบ
+    for upto in rng.sample(range(1, len(nums) + 1), min(len(nums), 8)):
+        for size in LOCK_SIZE_RANGE:
+            assert eng.formula_1(size, upto) == analyze_3_digit_combos_reference(nums[:upto], size)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_multi_lock_engine_archive_sync_matches_reference(seed):
+    rng = random.Random(seed)
+    nums = random_day(rng, rng.randrange(2, 60))
+    rows = as_rows(nums)
+    cut = rng.randrange(1, len(rows))
+    arch = RoundArchive.from_rows("w", rows[:cut])
+    eng = MultiLockEngine()
+    eng.sync(arch)
+    size = rng.choice(LOCK_SIZE_RANGE)
+    assert eng.formula_1(size) == analyze_3_digit_combos_reference(nums[:cut], size)
+    arch.extend(rows[cut:])
+    eng.sync(arch)
+    for size in LOCK_SIZE_RANGE:
+        assert eng.formula_1(size) == analyze_3_digit_combos_reference(nums, size)
+
+def test_invalid_and_double_only_inputs_match_reference():
+    cases = [[], ["111", "022", "933"], ["12", "a12", "123", "1234", "456"], ["100", "200"]]
+    for nums in cases:
+        for size in (2, 4, 7):
+            assert analyze_3_digit_combos(nums, size) == analyze_3_digit_combos_reference(nums, size)
+            eng = MultiLockEngine()
+            eng.extend({"top3": t3} for t3 in nums)
+            expected = analyze_3_digit_combos_reference(nums, size)
+            assert eng.formula_1(size) == expected
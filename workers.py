@@ -0,0 +1,141 @@
+# workers.py — รันงานวิเคราะห์ (CPU-bound) นอก event loop
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import ANALYSIS_JOB_SECONDS
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "process")          # process | thread
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "10"))
+ANALYSIS_QUEUE_LIMIT = int(os.getenv("ANALYSIS_QUEUE_LIMIT", "8"))
+MAX_ANALYZE_CHARS = int(os.getenv("MAX_ANALYZE_CHARS", "100000"))
+
+class PoolBusy(Exception):
+    """งานค้างเต็มคิวแล้ว — ให้ผู้เรียกตอบว่าไม่ว่างแทนที่จะรอ"""
+
+class PoolBroken(PoolBusy):
+    """worker process ตาย (เช่นโดน OOM kill) ระหว่างงานนี้ — pool ถูกสร้างใหม่แล้ว ลองใหม่ได้
+    (เป็น PoolBusy: handler ที่ตอบ "คิวเต็ม ลองใหม่" อยู่แล้วรับมือได้เลย)"""
+
+class AnalysisPool:
+    """pool ขนาดจำกัดสำหรับ analyze_numbers ฯลฯ
+
+    - งานที่ยังไม่เสร็จ (กำลังรัน + รอคิว) ไม่เกิน workers + queue_limit ไม่งั้น PoolBusy
+    - รอผลไม่เกิน timeout วินาที; งานที่เกินเวลายังนับว่าค้างจนกว่าจะจบจริง
+      (process ที่รันอยู่หยุดกลางคันไม่ได้) จึงไม่ทำให้ pool ล้น
+    - ใช้ process pool แบบ spawn (ปลอดภัยกับเธรดของ uvicorn/บอท) หรือ thread pool
+    """
+
+    def __init__(self, workers: int = ANALYSIS_WORKERS, mode: str = ANALYSIS_MODE,
+                 timeout: float = ANALYSIS_TIMEOUT, queue_limit: int = ANALYSIS_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.timeout = timeout
+        self.limit = self.workers + max(0, queue_limit)
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "run_time_total": 0.0,
+            "run_time_max": 0.0,
+        }
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "thread":
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="analysis")
+            else:
+                ctx = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=ctx)
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def snapshot(self) -> dict:
+        done = self.stats["completed"]
+        return {
+            **self.stats,
+            "pending": self._pending,
+            "running": min(self._pending, self.workers),
+            "queued": max(0, self._pending - self.workers),
+            "run_time_avg": self.stats["run_time_total"] / done if done else 0.0,
+        }
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.limit:
+                self.stats["rejected"] += 1
+                raise PoolBusy(f"{self._pending} analysis jobs pending")
+            self._pending += 1
+            self.stats["submitted"] += 1
+
+        started = time.perf_counter()
+        try:
+            executor = self._get_executor()
+            try:
+                cf = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # pool พังไปตั้งแต่งานก่อน (submit ไม่รับงานอีกเลย) → สร้างใหม่แล้วส่งอีกครั้ง
+                logging.error("[ANALYSIS] process pool broken; recreating")
+                self._discard(executor)
+                executor = self._get_executor()
+                cf = executor.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        def _done(f):
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._pending -= 1
+                if f.cancelled():
+                    pass                      # ถูกยกเลิกตอน timeout ก่อนได้รัน
+                elif f.exception() is not None:
+                    self.stats["errors"] += 1
+                else:
+                    self.stats["completed"] += 1
+                    self.stats["run_time_total"] += elapsed
+                    self.stats["run_time_max"] = max(self.stats["run_time_max"], elapsed)
+            ANALYSIS_JOB_SECONDS.observe(elapsed)
+        cf.add_done_callback(_done)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(cf), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logging.warning("[ANALYSIS] %s timed out after %ss", getattr(fn, "__name__", fn), self.timeout)
+            raise
+        except BrokenProcessPool as e:
+            # worker ตาย (เช่นโดน OOM kill) → สร้าง pool ใหม่ในงานถัดไป
+            logging.error("[ANALYSIS] process pool broken; recreating")
+            self._discard(executor)
+            raise PoolBroken(str(e)) from e
+
+    def _discard(self, executor: Executor):
+        """ปิด pool ที่พัง — เฉพาะถ้ายังเป็นตัวปัจจุบัน: งานที่พังพร้อมกันอีกงานอาจสร้างตัวใหม่ไปแล้ว
+        (shutdown ตัวใหม่ด้วย cancel_futures จะยกเลิกงานดีๆ ที่เพิ่งส่งเข้าไป)"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        # นอก lock: cancel_futures เรียก _done ของงานที่ถูกยกเลิก ซึ่งต้องใช้ lock เดียวกัน
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None